@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# @File    : bench_parser.py
+# @Time    : 4/22/2021 3:20 PM
+# @Author  : Zavier Cai
+# @Email   : caizefeng18@gmail.com
+"""
+Benchmark of the single-pass output.sx parser against the former grep/tail/awk pipelines.
+
+    python benchmarks/bench_parser.py [--steps 200 2000 20000] [--repeat 5]
+
+The legacy pipelines only understand two constrained atoms, so the synthetic outputs use two atoms
+and pad every SCF step with verbose lines, the way real SPHInX logs grow to tens of MB.
+"""
+import argparse
+import os
+import re
+import subprocess as sp
+import tempfile
+import time
+
+import numpy as np
+
+from spinforce.SphinxOutput import parse_output
+
+
+def legacy_read(work_dir):
+    def run(cmd):
+        sub = sp.Popen(cmd, shell=True, stdout=sp.PIPE, cwd=work_dir)
+        out = str(sub.stdout.read(), 'utf-8')
+        sub.kill()
+        sub.wait()
+        return out
+
+    total_energy = float(run('tail -1 energy.dat | awk \'{print $5}\''))
+    spin_info = run('grep -A 3 "nu(0)" output.sx | tail -4')
+    final_spin = np.array([float(i) for i in re.findall(r'^Spin of atom \d = (.*?)$', spin_info, flags=re.MULTILINE)])
+    nu = np.array([float(i) for i in re.findall(r'^nu\(\d*\) = (.*?)$', spin_info, flags=re.MULTILINE)])
+
+    convergence_reached = bool(run('grep "Convergence reached." output.sx'))
+    if convergence_reached:
+        line = run('grep -B 1 "Convergence reached." output.sx | head -n 1')
+    else:
+        line = run('grep -B 2 "Convergence not yet reached." output.sx | head -n 1')
+    num_step = int(re.findall(r'F\((\d+)\)=', line)[0])
+    return convergence_reached, num_step, final_spin, nu, total_energy
+
+
+def write_synthetic_output(work_dir, num_steps, filler_lines=40):
+    filler = "".join("| band {:4d}   eig = {:14.8f} Ha   occ = {:.6f}\n".format(i, -0.3 + 0.01 * i, 1.0)
+                     for i in range(filler_lines))
+    with open(os.path.join(work_dir, "output.sx"), "w") as f, open(os.path.join(work_dir, "energy.dat"), "w") as e:
+        f.write("+" + "-" * 77 + "\n| S/PHI/nX\n+" + "-" * 77 + "\n")
+        for step in range(1, num_steps + 1):
+            decay = np.exp(-step / num_steps * 10)
+            f.write(filler)
+            f.write("nu(0) = {:.12f}\nSpin of atom 0 = {:.12f}\n".format(-0.01 * (1 + decay), 2.2 + decay))
+            f.write("nu(1) = {:.12f}\nSpin of atom 1 = {:.12f}\n".format(0.02 * (1 + decay), -2.2 - decay))
+            f.write("F({})={:.12f}, eBand=-1.0, dEnergy={:.3e}\n".format(step, -246.8 + decay, decay))
+            e.write("{} 0.0 {:.12f} {:.12f} {:.12f}\n".format(step, -246.8 + decay, -246.8, -246.8 + decay / 2))
+        f.write("Convergence reached.\n")
+    return os.path.getsize(os.path.join(work_dir, "output.sx"))
+
+
+def best_of(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the output.sx parser")
+    parser.add_argument("--steps", type=int, nargs="+", default=[200, 2000, 20000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print("{:>8} {:>10} {:>12} {:>12} {:>8}".format("steps", "size/MB", "legacy/ms", "single/ms", "speedup"))
+    with tempfile.TemporaryDirectory() as work_dir:
+        for num_steps in args.steps:
+            size = write_synthetic_output(work_dir, num_steps)
+
+            legacy = legacy_read(work_dir)
+            result = parse_output(os.path.join(work_dir, "output.sx"), os.path.join(work_dir, "energy.dat"))
+            assert legacy[0] == result.convergence_reached and legacy[1] == result.num_step
+            assert np.allclose(legacy[2], result.final_spin) and np.allclose(legacy[3], result.nu)
+            assert legacy[4] == result.total_energy
+
+            t_legacy = best_of(lambda: legacy_read(work_dir), args.repeat)
+            t_single = best_of(lambda: parse_output(os.path.join(work_dir, "output.sx"),
+                                                    os.path.join(work_dir, "energy.dat")), args.repeat)
+            print("{:>8} {:>10.2f} {:>12.2f} {:>12.2f} {:>7.1f}x".format(
+                num_steps, size / 2 ** 20, t_legacy * 1e3, t_single * 1e3, t_legacy / t_single))
+
+
+if __name__ == '__main__':
+    main()
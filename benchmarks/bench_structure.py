@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# @File    : bench_structure.py
+# @Time    : 4/26/2021 10:12 AM
+# @Author  : Zavier Cai
+# @Email   : caizefeng18@gmail.com
+"""
+Benchmark of the single-pass structure.sx/forces.sx tokenizer against the former line-by-line parser.
+
+    python benchmarks/bench_structure.py [--atoms 100 1000 10000] [--repeat 5]
+
+The generated files mimic sx2aims/SPHInX output: two species, relative coordinates in
+``structure.sx`` and one ``force = [...]`` line per atom in ``forces.sx``.
+"""
+import argparse
+import os
+import re
+import tempfile
+import time
+
+import numpy as np
+
+from spinforce.SphinxIO import SphinxIO
+
+
+def legacy_read_atomwise_info(content, entry_pattern, cell=None):
+    entry_dict = {}
+    entry_list = []
+    current_type = -1
+    for line in content.split('\n'):
+        pure_line = line.strip()
+        if pure_line[0:2] != "//":
+            element = re.findall(r'element\s*=\s*"(.*)"\s*;', pure_line)
+            entry_raw = re.findall(entry_pattern, pure_line)
+            if element:
+                current_type += 1
+                entry_dict[str(current_type)] = []
+            elif entry_raw:
+                entry = np.fromstring(entry_raw[0].strip(' []'), dtype=float, sep=',')
+                if "relative" in pure_line:
+                    entry = entry @ cell
+                entry_dict[str(current_type)].append(entry)
+                entry_list.append(entry)
+    for atom_type, entry in entry_dict.items():
+        entry_dict[atom_type] = np.array(entry)
+    return entry_dict, np.array(entry_list).reshape(-1)
+
+
+def legacy_read(work_dir):
+    with open(os.path.join(work_dir, "structure.sx")) as f:
+        content = f.read()
+    cell_parameter = re.findall(r'\s*cell\s*?=\s*?(.*?)\s*;', content, flags=re.DOTALL)[0]
+    cell = np.fromstring(re.sub(r'[\[\]\n]', '', cell_parameter), dtype=float, sep=',').reshape((3, 3))
+    _, structure_array = legacy_read_atomwise_info(content, r'atom\s*{\s*coords\s*=(.*?)\s*;', cell)
+    with open(os.path.join(work_dir, "forces.sx")) as f:
+        _, force_array = legacy_read_atomwise_info(f.read(), r'force\s*=(.*?)\s*;')
+    return cell, structure_array, force_array
+
+
+def new_read(work_dir):
+    cell, _, structure_array = SphinxIO.read_structure(os.path.join(work_dir, "structure.sx"))
+    _, force_array = SphinxIO.read_force(os.path.join(work_dir, "forces.sx"))
+    return cell, structure_array, force_array
+
+
+def write_synthetic_structure(work_dir, num_atoms, seed=0):
+    rng = np.random.RandomState(seed)
+    side = 5.35 * np.ceil(num_atoms ** (1 / 3))
+    relative = rng.uniform(0, 1, (num_atoms, 3))
+    forces = rng.normal(0, 1e-3, (num_atoms, 3))
+    half = num_atoms // 2
+    with open(os.path.join(work_dir, "structure.sx"), "w") as f:
+        f.write("cell = [[{0:.8f}, 0, 0],\n       [0, {0:.8f}, 0],\n       [0, 0, {0:.8f}]];\n".format(side))
+        for element, atoms in (("Fe", range(half)), ("Co", range(half, num_atoms))):
+            f.write("species  {{\n  element=\"{}\";\n".format(element))
+            for i in atoms:
+                f.write("  atom {{coords = [ {:.10f} , {:.10f} , {:.10f} ] ; relative; label = \"A{}\"; }}\n".format(
+                    *relative[i], i))
+            f.write("}\n")
+    with open(os.path.join(work_dir, "forces.sx"), "w") as f:
+        f.write("structure  {\n   movable;\n")
+        for element, atoms in (("Fe", range(half)), ("Co", range(half, num_atoms))):
+            f.write("   species  {{\n      element=\"{}\";\n".format(element))
+            for i in atoms:
+                f.write("      atom {{coords = [ {:.10f} , {:.10f} , {:.10f} ]; label = \"A{}\";\n".format(
+                    *(relative[i] * side), i))
+                f.write("            force  = [{:.10f},{:.10f},{:.10f}]; }}\n".format(*forces[i]))
+            f.write("   }\n")
+        f.write("}\n")
+
+
+def best_of(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the structure.sx/forces.sx parser")
+    parser.add_argument("--atoms", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print("{:>8} {:>12} {:>12} {:>8}".format("atoms", "legacy/ms", "single/ms", "speedup"))
+    with tempfile.TemporaryDirectory() as work_dir:
+        for num_atoms in args.atoms:
+            write_synthetic_structure(work_dir, num_atoms)
+
+            for legacy, new in zip(legacy_read(work_dir), new_read(work_dir)):
+                assert legacy.shape == new.shape and np.allclose(legacy, new)
+
+            t_legacy = best_of(lambda: legacy_read(work_dir), args.repeat)
+            t_single = best_of(lambda: new_read(work_dir), args.repeat)
+            print("{:>8} {:>12.2f} {:>12.2f} {:>7.1f}x".format(
+                num_atoms, t_legacy * 1e3, t_single * 1e3, t_legacy / t_single))
+
+
+if __name__ == '__main__':
+    main()
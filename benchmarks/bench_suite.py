@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# @File    : bench_suite.py
+# @Time    : 4/30/2021 11:20 AM
+# @Author  : Zavier Cai
+# @Email   : caizefeng18@gmail.com
+"""
+End-to-end benchmarks of the orchestration, run against the fake SPHInX in spinforce/scripts.
+
+    python benchmarks/bench_suite.py [--atoms 2 64 512] [--variants 8 32] [--steps 30] [--frames 2000]
+
+* parser:   output.sx/structure.sx/forces.sx as written by the fake for each atom count, in MB/s
+* writer:   DPWriter raw and npy throughput in frames/s
+* campaign: full ``python -m spinforce`` runs for every atom count x variant count; the per-variant
+            overhead is the wall time per variant minus the time the fake binary needs on its own,
+            next to the preparing/collecting overhead the task logs itself
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from spinforce.DPIO import DPWriter
+from spinforce.SfStructure import SfStructure
+from spinforce.SphinxIO import SphinxIO
+from spinforce.SphinxOutput import parse_output
+
+PACKAGE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "spinforce")
+FAKE_SPHINX = os.path.abspath(os.path.join(PACKAGE_DIR, "scripts", "fake_sphinx.py"))
+INPUT_TEMPLATE = os.path.abspath(os.path.join(PACKAGE_DIR, "templates", "input.sx"))
+_OVERHEAD_PATTERN = re.compile(r'Orchestration overhead per variant for Tag \d+: ([\d.]+) ms preparing, '
+                               r'([\d.]+) ms collecting')
+
+
+def write_structure(path, num_atoms):
+    side = 5.35 * max(1, int(np.ceil(num_atoms ** (1 / 3))))
+    relative = np.random.RandomState(num_atoms).uniform(0, 1, (num_atoms, 3))
+    half = (num_atoms + 1) // 2
+    with open(path, "w") as f:
+        f.write("cell = [[{0:.8f}, 0, 0],\n       [0, {0:.8f}, 0],\n       [0, 0, {0:.8f}]];\n".format(side))
+        for element, atoms in (("Fe", range(half)), ("Co", range(half, num_atoms))):
+            if len(atoms):
+                f.write("species  {{\n  element=\"{}\";\n".format(element))
+                for i in atoms:
+                    f.write("  atom {{coords = [ {:.10f} , {:.10f} , {:.10f} ] ; relative; label = \"A{}\"; }}\n"
+                            .format(*relative[i], i))
+                f.write("}\n")
+
+
+def prepare_run_dir(work_dir, num_atoms):
+    os.makedirs(work_dir, exist_ok=True)
+    write_structure(os.path.join(work_dir, "structure.sx"), num_atoms)
+    with open(INPUT_TEMPLATE) as src, open(os.path.join(work_dir, "input.sx"), "w") as dst:
+        dst.write(src.read())
+    spins = np.where(np.arange(num_atoms) % 2, -2.2, 2.2)
+    np.savetxt(os.path.join(work_dir, "spin-constraint.sx"), spins)
+    np.savetxt(os.path.join(work_dir, "spin-initial.sx"), spins)
+
+
+def run_fake(work_dir, env):
+    with open(os.path.join(work_dir, "output.sx"), "wb") as output:
+        subprocess.check_call([sys.executable, FAKE_SPHINX], cwd=work_dir, stdout=output, env=env)
+
+
+def best_of(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def median_of(func, repeat):
+    # the campaign runs are averages, so compare them with a typical rather than the best fake run
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return float(np.median(timings))
+
+
+def bench_parser(root, atom_counts, env, repeat):
+    print("\n== parser ==")
+    print("{:>8} {:>12} {:>14} {:>14} {:>14}".format("atoms", "output/MB", "output MB/s", "structure/ms",
+                                                      "forces/ms"))
+    fake_seconds = {}
+    for num_atoms in atom_counts:
+        work_dir = os.path.join(root, "parser_{}".format(num_atoms))
+        prepare_run_dir(work_dir, num_atoms)
+        fake_seconds[num_atoms] = median_of(lambda: run_fake(work_dir, env), repeat)
+        output_path = os.path.join(work_dir, "output.sx")
+        size = os.path.getsize(output_path) / 2 ** 20
+        t_output = best_of(lambda: parse_output(output_path, os.path.join(work_dir, "energy.dat")), repeat)
+        t_structure = best_of(lambda: SfStructure.read(os.path.join(work_dir, "structure.sx")), repeat)
+        t_force = best_of(lambda: SphinxIO.read_force(os.path.join(work_dir, "forces.sx")), repeat)
+        print("{:>8} {:>12.2f} {:>14.1f} {:>14.2f} {:>14.2f}".format(
+            num_atoms, size, size / t_output, t_structure * 1e3, t_force * 1e3))
+    return fake_seconds
+
+
+def bench_writer(root, atom_counts, num_frames):
+    print("\n== writer ==")
+    print("{:>8} {:>8} {:>10} {:>14} {:>12}".format("atoms", "format", "frames", "frames/s", "MB/s"))
+    logger = logging.getLogger("bench.DPWriter")
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+    for num_atoms in atom_counts:
+        rng = np.random.RandomState(0)
+        cell = np.eye(3) * 10.
+        coords = rng.uniform(0, 10, 3 * num_atoms)
+        spins = rng.uniform(-3, 3, 3 * num_atoms)
+        forces = rng.normal(0, 1e-3, 3 * num_atoms)
+        types = np.concatenate((np.zeros(num_atoms, dtype=int), np.ones(num_atoms, dtype=int)))
+        for output_format in ("raw", "npy"):
+            output_dir = os.path.join(root, "writer_{}_{}".format(num_atoms, output_format))
+            writer = DPWriter()
+            writer._logger = logger
+            start = time.perf_counter()
+            writer.init(output_dir, output_format, set_size=1000)
+            writer.write_type(types)
+            for frame in range(num_frames):
+                writer.write_frame(cell, coords, spins, -100. - frame, forces, spins)
+            writer.close()
+            elapsed = time.perf_counter() - start
+            size = sum(os.path.getsize(os.path.join(d, name)) for d, _, names in os.walk(output_dir) for name in names)
+            print("{:>8} {:>8} {:>10} {:>14.0f} {:>12.1f}".format(
+                num_atoms, output_format, num_frames, num_frames / elapsed, size / 2 ** 20 / elapsed))
+
+
+def bench_campaign(root, atom_counts, variant_counts, env, fake_seconds):
+    print("\n== campaign (inline backend) ==")
+    print("{:>8} {:>9} {:>10} {:>14} {:>14} {:>14} {:>14}".format(
+        "atoms", "variants", "wall/s", "per variant/ms", "fake/ms", "overhead/ms", "prep+coll/ms"))
+    for num_atoms in atom_counts:
+        for num_variants in variant_counts:
+            work_dir = os.path.join(root, "campaign_{}_{}".format(num_atoms, num_variants))
+            for name in ("structure_all", "spin_all", "config_all"):
+                os.makedirs(os.path.join(work_dir, name), exist_ok=True)
+            write_structure(os.path.join(work_dir, "structure_all", "1_structure.sx"), num_atoms)
+            np.savetxt(os.path.join(work_dir, "spin_all", "1_spin.sx"), np.where(np.arange(num_atoms) % 2, -2.2, 2.2))
+            config = {
+                "sphinx_file": {"working_dir": work_dir, "structure_dir": "structure_all", "spin_dir": "spin_all",
+                                "config_dir": "config_all", "input_path": INPUT_TEMPLATE},
+                "dp_file": {"output_dir": "raw_all"},
+                "sphinx_path": "{} {}".format(sys.executable, FAKE_SPHINX),
+                "spin_constraint": {"collinear": True, "atoms": [
+                    {"index": 0, "sampling": "uniform", "bound": {"low": -3, "high": 3, "points": num_variants}}]},
+            }
+            config_path = os.path.join(work_dir, "config.json")
+            with open(config_path, "w") as f:
+                json.dump(config, f)
+
+            start = time.perf_counter()
+            log = subprocess.run([sys.executable, "-m", "spinforce", config_path], env=env, check=True,
+                                 stdout=subprocess.PIPE, stderr=subprocess.STDOUT).stdout.decode()
+            wall = time.perf_counter() - start
+            per_variant = wall / num_variants
+            prepare, collect = (float(x) for x in _OVERHEAD_PATTERN.search(log).groups())
+            print("{:>8} {:>9} {:>10.2f} {:>14.1f} {:>14.1f} {:>14.1f} {:>14.2f}".format(
+                num_atoms, num_variants, wall, per_variant * 1e3, fake_seconds[num_atoms] * 1e3,
+                (per_variant - fake_seconds[num_atoms]) * 1e3, prepare + collect))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the spinforce orchestration against a fake SPHInX")
+    parser.add_argument("--atoms", type=int, nargs="+", default=[2, 64, 512])
+    parser.add_argument("--variants", type=int, nargs="+", default=[8, 32])
+    parser.add_argument("--steps", type=int, default=30, help="SCF steps of every fake SPHInX run")
+    parser.add_argument("--frames", type=int, default=2000, help="frames per writer benchmark")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--skip", nargs="*", default=[], choices=["parser", "writer", "campaign"],
+                        help="the parser section still runs for campaigns, which need the fake's own timing")
+    args = parser.parse_args()
+
+    env = dict(os.environ, FAKE_SPHINX_STEPS=str(args.steps), FAKE_SPHINX_DELAY="0", FAKE_SPHINX_FAIL="none")
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [os.path.dirname(os.path.abspath(PACKAGE_DIR)),
+                                                      env.get("PYTHONPATH")]))
+    with tempfile.TemporaryDirectory() as root:
+        fake_seconds = {}
+        if "parser" not in args.skip or "campaign" not in args.skip:
+            fake_seconds = bench_parser(root, args.atoms, env, args.repeat)
+        if "writer" not in args.skip:
+            bench_writer(root, args.atoms, args.frames)
+        if "campaign" not in args.skip:
+            bench_campaign(root, args.atoms, args.variants, env, fake_seconds)
+
+
+if __name__ == '__main__':
+    main()
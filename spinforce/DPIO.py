@@ -3,105 +3,364 @@
 # @Time    : 3/18/2021 3:38 PM
 # @Author  : Zavier Cai
 # @Email   : caizefeng18@gmail.com
+import io
+import itertools
+import json
 import logging
 import os
+import shutil
+import time
+from typing import Dict, Iterator
 
 import numpy as np
 
 from spinforce.helper.fs_helper import mkdir_without_override, batch_remove_if_exists
 
+FRAME_FILES = ("box", "coord", "energy", "force")
+
 
 class DPWriter:
+    """Writes DeePMD frames in commits of several frames at once.
+
+    Frames are staged in memory by ``write_frame`` and committed every ``flush_frames`` frames or
+    ``flush_seconds`` seconds, checked on every frame and by ``flush_if_due`` (executors call it while
+    they wait, inline runs only get to it between variants). A commit appends to and fsyncs all files,
+    then appends a record of their sizes and of the committed frame keys to ``frames.journal``.
+    In ``npy`` format the last, not yet full ``set.NNN`` is written again by every commit, so it holds
+    the committed frames as well. ``recover`` cuts everything back to the last record, so after a crash
+    the files always hold the same number of frames and no committed frame is lost.
+    """
+
     def __init__(self):
         self.f_box = None
         self.f_coord = None
         self.f_type = None
         self.f_energy = None
         self.f_force = None
+        self.f_journal = None
         self._logger = None  # type: logging.Logger
         self._type_written = None
         self._num_frames = None
         self._affine_parameter = None
 
-    def init(self, output_dir):
+        self._output_dir = None
+        self._format = "raw"  # "raw" text files or DeePMD "npy" sets
+        self._set_size = 5000
+        self._num_sets = 0  # full sets, the one being filled is set.<_num_sets>
+        self._buffers = {}
+
+        self._flush_frames = 50
+        self._flush_seconds = 30.0
+        self._last_flush = None
+        self._staged = []  # (rows by file name, key)
+        self._staged_type = None
+        self._num_committed = 0
+        self._committed_keys = set()
+
+    @property
+    def committed_keys(self):
+        return self._committed_keys
+
+    @property
+    def flush_seconds(self):
+        return self._flush_seconds
+
+    def path(self, name):
+        return os.path.join(self._output_dir, name)
+
+    def init(self, output_dir, output_format="raw", set_size=5000, flush_frames=50, flush_seconds=30.0,
+             resume=False):
         self._num_frames = 0
         self._affine_parameter = 0.5
+        self._output_dir = output_dir
+        self._format = output_format
+        self._set_size = set_size
+        self._num_sets = 0
+        self._buffers = {name: [] for name in FRAME_FILES}
+        self._flush_frames = flush_frames
+        self._flush_seconds = flush_seconds
+        self._last_flush = time.time()
+        self._staged = []
+        self._staged_type = None
+        self._num_committed = 0
+        self._committed_keys = set()
 
-        mkdir_without_override(output_dir)
-        box_path = os.path.join(output_dir, "box.raw")
-        coord_path = os.path.join(output_dir, "coord.raw")
-        type_path = os.path.join(output_dir, "type.raw")
-        energy_path = os.path.join(output_dir, "energy.raw")
-        force_path = os.path.join(output_dir, "force.raw")
+        if output_format not in ("raw", "npy"):
+            self._logger.error("Invalid DP output format \"{}\"!".format(output_format))
+            raise RuntimeError
 
-        batch_remove_if_exists(box_path, coord_path, type_path, energy_path, force_path)
+        mkdir_without_override(output_dir)
+        if resume and os.path.exists(self.path("frames.journal")):
+            self.recover()
+        else:
+            batch_remove_if_exists(*[self.path(name + ".raw") for name in FRAME_FILES + ("type",)],
+                                   self.path("frames.journal"))
+            for x in os.scandir(output_dir):
+                if x.is_dir() and x.name.startswith("set."):
+                    shutil.rmtree(x.path)
 
-        self.f_box = open(box_path, "a+")
-        self.f_coord = open(coord_path, "a+")
-        self.f_type = open(type_path, "a+")
-        self.f_energy = open(energy_path, "a+")
-        self.f_force = open(force_path, "a+")
+        self.f_type = open(self.path("type.raw"), "a")
+        self.f_journal = open(self.path("frames.journal"), "a")
+        if output_format == "raw":
+            self.f_box = open(self.path("box.raw"), "a")
+            self.f_coord = open(self.path("coord.raw"), "a")
+            self.f_energy = open(self.path("energy.raw"), "a")
+            self.f_force = open(self.path("force.raw"), "a")
+        else:
+            self._logger.info("Writing DeePMD sets of {} frames as set.NNN/*.npy".format(set_size))
 
+        self._logger.info("Committing frames every {} frames or {} s".format(flush_frames, flush_seconds))
         self._logger.info(
             "Using affine parameter {} to generate pseudo-coordinates from spins".format(self._affine_parameter))
 
+    def recover(self):
+        """Cut the output back to the last journal record, dropping frames of an interrupted commit."""
+        record = None
+        valid_lines = []
+        for line, record in self.journal_records(self.path("frames.journal")):
+            valid_lines.append(line)
+            self._committed_keys.update(record["keys"])
+        with open(self.path("frames.journal"), "w") as f:
+            f.writelines(valid_lines)
+
+        sizes = record["sizes"] if record else {}
+        for name in FRAME_FILES + ("type",):
+            file_path = self.path(name + ".raw")
+            if os.path.exists(file_path):
+                with open(file_path, "r+") as f:
+                    f.truncate(sizes.get(name, 0))
+
+        self._num_sets = record["sets"] if record else 0
+        set_frames = record.get("set_frames", 0) if record else 0
+        open_set = self.path("set.{:03d}".format(self._num_sets))
+        if set_frames and not os.path.exists(open_set):  # crashed while replacing it, see dump_set
+            os.rename(open_set + ".old", open_set)
+        num_set_dirs = self._num_sets + bool(set_frames)
+        for x in os.scandir(self._output_dir):
+            if x.is_dir() and x.name.startswith("set."):
+                suffix = x.name[len("set."):]
+                if not suffix.isdigit() or int(suffix) >= num_set_dirs:  # unfinished or uncommitted
+                    shutil.rmtree(x.path)
+        if set_frames:  # filled on from the committed frames of the open set
+            for name in FRAME_FILES:
+                self._buffers[name] = list(np.load(os.path.join(open_set, name + ".npy"))[:set_frames])
+
+        self._num_committed = self._num_frames = record["frames"] if record else 0
+        if os.path.exists(self.path("type.raw")) and os.path.getsize(self.path("type.raw")):
+            self._type_written = np.atleast_1d(np.loadtxt(self.path("type.raw"), dtype=int))
+        self._logger.info("Resuming from {} committed frames in {}".format(self._num_frames, self._output_dir))
+
+    @staticmethod
+    def journal_records(journal_path):
+        """(line, record) of every complete record of a ``frames.journal``."""
+        with open(journal_path, "r") as f:
+            lines = f.readlines()
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except ValueError:  # torn write of the last record
+                return
+            yield line, record
+
+    @staticmethod
+    def read_committed_keys(output_dir):
+        """Keys of the frames a resumed run would find committed in ``output_dir``, without touching its files."""
+        journal_path = os.path.join(output_dir, "frames.journal")
+        if not os.path.exists(journal_path):
+            return set()
+        return {key for _, record in DPWriter.journal_records(journal_path) for key in record["keys"]}
+
     def close(self):
-        self.f_box.flush()
-        self.f_coord.flush()
-        self.f_type.flush()
-        self.f_energy.flush()
-        self.f_force.flush()
-
-        self.f_box.close()
-        self.f_coord.close()
-        self.f_type.close()
-        self.f_energy.close()
-        self.f_force.close()
+        self.flush()
+
+        for f in (self.f_box, self.f_coord, self.f_type, self.f_energy, self.f_force, self.f_journal):
+            if f is not None:
+                f.close()
 
         self._logger.info("{} frames overall have been successfully written".format(self._num_frames))
 
-    def write_box(self, cell):
-        # Bohr, reshape to write on one line
-        np.savetxt(self.f_box, cell.reshape((1, -1)))
-        self.f_box.flush()
+    def write_frame(self, cell, coord_array, spin_array, total_energy, force_array, nu_array, key=None):
+        """Stage one complete frame of the atom types last given to ``write_type``; it reaches the files with the
+        next commit."""
+        rows = {
+            "box": cell.reshape(-1),  # Bohr
+            "coord": np.concatenate(
+                (coord_array, self.spin2pseudo_coords(coord_array, spin_array, self._affine_parameter))),
+            "energy": total_energy,  # Hartree
+            "force": np.concatenate((force_array, nu_array)),  # Hartree / Bohr, Hartree / a.u. (~ 2 mu_B)
+        }
+        self.write_rows(rows, key)
+
+    def write_rows(self, rows, key=None):
+        """Stage one frame given as its rows of ``FRAME_FILES``, e.g. as read back by ``DPReader``."""
+        self._staged.append((rows, key))
         self._num_frames += 1
 
-    def write_coord(self, coord_array, spin_array):
-        np.savetxt(self.f_coord,
-                   np.concatenate(
-                       (coord_array, self.spin2pseudo_coords(coord_array, spin_array, self._affine_parameter))).reshape(
-                       (1, -1)))
-        self.f_coord.flush()
+        if len(self._staged) >= self._flush_frames:
+            self.flush()
+        else:
+            self.flush_if_due()
+
+    def flush_if_due(self):
+        """Commit the staged frames if ``flush_seconds`` have passed since the last commit."""
+        if self._staged and time.time() - self._last_flush >= self._flush_seconds:
+            self.flush()
+
+    def flush(self):
+        """Commit all staged frames together."""
+        self._last_flush = time.time()
+        if not self._staged:
+            return
+
+        if self._staged_type is not None:
+            self.f_type.write(self._staged_type)
+            self.sync(self.f_type)
+            self._staged_type = None
+
+        if self._format == "npy":
+            for rows, _ in self._staged:
+                for name in FRAME_FILES:
+                    self._buffers[name].append(rows[name])
+                if len(self._buffers["box"]) >= self._set_size:
+                    self.dump_set()
+                    self._num_sets += 1
+                    for buffer in self._buffers.values():
+                        buffer.clear()
+            if self._buffers["box"]:
+                self.dump_set()  # the open set, until it is full
+        else:
+            for name, f in zip(FRAME_FILES, (self.f_box, self.f_coord, self.f_energy, self.f_force)):
+                text = io.StringIO()
+                for rows, _ in self._staged:
+                    if name == "energy":
+                        text.write(str(rows[name]) + '\n')
+                    else:
+                        np.savetxt(text, rows[name].reshape((1, -1)))
+                f.write(text.getvalue())
+                self.sync(f)
+        self._num_committed += len(self._staged)
+        self.write_journal([key for _, key in self._staged])
+        self._staged = []
 
-    def write_type(self, structure_dict):
+    def write_journal(self, keys):
+        keys = [key for key in keys if key is not None]
+        record = {"frames": self._num_committed, "sets": self._num_sets, "set_frames": len(self._buffers["box"]),
+                  "keys": keys,
+                  "sizes": {name: os.path.getsize(self.path(name + ".raw"))
+                            for name in FRAME_FILES + ("type",) if os.path.exists(self.path(name + ".raw"))}}
+        self.f_journal.write(json.dumps(record) + "\n")
+        self.sync(self.f_journal)
+        self._committed_keys.update(keys)
 
-        type_list = []
-        for atom_type, coords in structure_dict.items():
-            type_list.extend(np.repeat(int(atom_type), len(coords)).tolist())
-        type_array = np.array(type_list, dtype=int)
-        type_array = np.concatenate((type_list, type_array + len(structure_dict)))
+    @staticmethod
+    def sync(f):
+        f.flush()
+        os.fsync(f.fileno())
+
+    def dump_set(self):
+        # build the set under a temporary name so that a set directory is always complete; an earlier
+        # version of the open set is only moved aside, recover() takes it back if the swap is interrupted
+        set_dir = self.path("set.{:03d}".format(self._num_sets))
+        tmp_dir = set_dir + ".tmp"
+        old_dir = set_dir + ".old"
+        if os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        os.makedirs(tmp_dir)
+        for name, rows in self._buffers.items():
+            with open(os.path.join(tmp_dir, name + ".npy"), "wb") as f:
+                np.save(f, np.array(rows))
+                self.sync(f)
+        if os.path.exists(set_dir):
+            os.rename(set_dir, old_dir)
+        os.rename(tmp_dir, set_dir)
+        if os.path.exists(old_dir):
+            shutil.rmtree(old_dir)
+
+    def accepts_type(self, type_array):
+        """Whether frames of ``type_array`` fit the atom types written so far."""
+        return self._type_written is None or (len(self._type_written) == len(type_array) and
+                                              all(self._type_written == type_array))
 
-        if self._type_written is None:  # only write once
-            np.savetxt(self.f_type, type_array.reshape((1, -1)), fmt='%4d')
-            self.f_type.flush()
+    def write_type(self, type_array):
+        # called once per tag with SfStructure.dp_type_array, all tags must agree
+        if self._type_written is None:  # only write once, committed with the first frame
+            text = io.StringIO()
+            np.savetxt(text, type_array.reshape((1, -1)), fmt='%4d')
+            self._staged_type = text.getvalue()
             self._type_written = type_array
-        elif any(self._type_written != type_array):
+        elif not self.accepts_type(type_array):
             self._logger.error("Atom type not consistent between frames!")
             raise RuntimeError
 
-    def write_force(self, force_array, nu_array):
-        # Hartree / Bohr, Hartree / a.u. (~ 2 mu_B)
-        np.savetxt(self.f_force, np.concatenate((force_array, nu_array)).reshape((1, -1)))
-        self.f_force.flush()
-
-    def write_energy(self, total_energy):
-        # Hartree
-        self.f_energy.write(str(total_energy) + '\n')
-        self.f_energy.flush()
-
     @staticmethod
     def spin2pseudo_coords(coord_array, spin_array, affine_parameter):
         return coord_array + affine_parameter * spin_array
 
     def write_spin(self):
         NotImplemented
+
+
+class DPReader:
+    """Reads back the committed frames of a ``DPWriter`` output directory, a chunk of frames at a time.
+
+    Raw files are streamed line by line and npy sets are memory-mapped, so directories larger than
+    memory can be read. With a ``frames.journal`` only the frames of its last record are read, the
+    same ones ``DPWriter.recover`` would keep, including those committed to the open ``set.NNN``.
+    """
+
+    def __init__(self, output_dir):
+        self._output_dir = output_dir
+        self.type_array = np.atleast_1d(np.loadtxt(self.path("type.raw"), dtype=int))
+        self._num_frames = None
+        self._num_sets = None
+        self._set_frames = 0  # committed frames of the open set
+        if os.path.exists(self.path("frames.journal")):
+            records = [record for _, record in DPWriter.journal_records(self.path("frames.journal"))]
+            record = records[-1] if records else None
+            self._num_frames = record["frames"] if record else 0
+            self._num_sets = record["sets"] if record else 0
+            self._set_frames = record.get("set_frames", 0) if record else 0
+        self.format = "raw" if os.path.exists(self.path("box.raw")) else "npy"
+
+    def path(self, name):
+        return os.path.join(self._output_dir, name)
+
+    def set_dirs(self):
+        set_dirs = sorted(x.path for x in os.scandir(self._output_dir)
+                          if x.is_dir() and x.name.startswith("set.") and x.name[len("set."):].isdigit())
+        return set_dirs if self._num_sets is None else set_dirs[:self._num_sets + bool(self._set_frames)]
+
+    def chunks(self, chunk_size=1024) -> Iterator[Dict[str, np.ndarray]]:
+        """``{name: (frames, columns) array}`` of ``FRAME_FILES`` for up to ``chunk_size`` frames at a time."""
+        if self.format == "npy":
+            yield from self.npy_chunks(chunk_size)
+        else:
+            yield from self.raw_chunks(chunk_size)
+
+    def raw_chunks(self, chunk_size):
+        files = [open(self.path(name + ".raw"), "r") for name in FRAME_FILES]
+        try:
+            num_left = self._num_frames
+            while num_left is None or num_left > 0:
+                size = chunk_size if num_left is None else min(chunk_size, num_left)
+                lines = [list(itertools.islice(f, size)) for f in files]
+                num_read = min(len(file_lines) for file_lines in lines)
+                if not num_read:
+                    return
+                yield {name: np.array("".join(file_lines[:num_read]).split(), dtype=float).reshape((num_read, -1))
+                       for name, file_lines in zip(FRAME_FILES, lines)}
+                if num_left is not None:
+                    num_left -= num_read
+        finally:
+            for f in files:
+                f.close()
+
+    def npy_chunks(self, chunk_size):
+        for index, set_dir in enumerate(self.set_dirs()):
+            arrays = {name: np.load(os.path.join(set_dir, name + ".npy"), mmap_mode="r") for name in FRAME_FILES}
+            num_frames = len(arrays["box"])
+            if index == self._num_sets:  # may hold frames of a commit that never got its journal record
+                num_frames = min(num_frames, self._set_frames)
+            for start in range(0, num_frames, chunk_size):
+                yield {name: np.asarray(array[start:start + chunk_size], dtype=float).reshape(
+                    (min(chunk_size, num_frames - start), -1)) for name, array in arrays.items()}
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# @File    : SfArchive.py
+# @Time    : 5/9/2021 2:05 PM
+# @Author  : Zavier Cai
+# @Email   : caizefeng18@gmail.com
+import fnmatch
+import gzip
+import io
+import json
+import logging
+import lzma
+import os
+import tarfile
+from typing import Dict, List
+
+import numpy as np
+
+from spinforce.helper.fs_helper import mkdir_without_override
+
+COMPRESSIONS = {"gzip": ("outputs.tar.gz", lambda data, level: gzip.compress(data, level), gzip.decompress),
+                "xz": ("outputs.tar.xz", lambda data, level: lzma.compress(data, preset=level), lzma.decompress)}
+
+
+class SfArchive:
+    """Append-only archive of the raw SPHInX files of every variant, to re-extract data without rerunning DFT.
+
+    Each variant is one small tar of its files (``output.sx``, ``energy.dat``, ``forces.sx``, inputs, ... as
+    matched by ``patterns``) under ``<tag>/<variant>/``, compressed on its own and appended to
+    ``outputs.tar.gz`` (or ``.xz``). Concatenated members are still a valid gzip/xz file, so
+    ``tar -xzif outputs.tar.gz`` unpacks everything with standard tools. ``outputs.index`` holds one JSON
+    line per variant with its tag, variant, spins, cache key, status and the byte range of its member,
+    so a single variant is read by decompressing only its member. The member is synced before its index
+    line is written, and opening for appending cuts both files back to the last complete line.
+    """
+
+    def __init__(self, archive_dir, compression="gzip", level=6, patterns=("*.sx", "*.dat")):
+        self._archive_dir = archive_dir
+        self._compression = compression
+        self._level = level
+        self._patterns = list(patterns)
+        self._data_name, self._compress, _ = COMPRESSIONS[compression]
+        self._f_data = None
+        self._f_index = None
+        self._logger = None  # type: logging.Logger
+
+        self.entries = []  # type: List[Dict]
+
+    def path(self, name):
+        return os.path.join(self._archive_dir, name)
+
+    def load_index(self):
+        """Entries of all complete index lines, and the length of those lines in bytes."""
+        self.entries = []
+        valid_size = 0
+        if os.path.exists(self.path("outputs.index")):
+            with open(self.path("outputs.index"), "rb") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line.decode())
+                    except ValueError:  # torn write of the last line
+                        break
+                    self.entries.append(entry)
+                    valid_size += len(line)
+        return valid_size
+
+    def open(self):
+        mkdir_without_override(self._archive_dir)
+        valid_size = self.load_index()
+        if any(entry["compression"] != self._compression for entry in self.entries):
+            self._logger.error("Archive at {} was written with another compression!".format(self._archive_dir))
+            raise RuntimeError
+        data_size = max([entry["offset"] + entry["length"] for entry in self.entries] + [0])
+        # drop a member whose index line never made it, and the torn line itself
+        for name, size in ((self._data_name, data_size), ("outputs.index", valid_size)):
+            if os.path.exists(self.path(name)):
+                with open(self.path(name), "r+b") as f:
+                    f.truncate(size)
+        self._f_data = open(self.path(self._data_name), "ab")
+        self._f_index = open(self.path("outputs.index"), "ab")
+        self._logger.info("Raw SPHInX outputs archived at {} ({} variants so far)".format(
+            self.path(self._data_name), len(self.entries)))
+
+    def close(self):
+        for f in (self._f_data, self._f_index):
+            if f is not None:
+                f.close()
+        self._f_data = self._f_index = None
+
+    def matching_files(self, work_dir):
+        return sorted(name for name in os.listdir(work_dir) if os.path.isfile(os.path.join(work_dir, name)) and
+                      any(fnmatch.fnmatch(name, pattern) for pattern in self._patterns))
+
+    def append(self, tag, variant, spins, key, status, work_dir):
+        prefix = "{}/{:06d}/".format(tag, variant)
+        files = {}
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode="w", format=tarfile.PAX_FORMAT) as tar:
+            for name in self.matching_files(work_dir):
+                path = os.path.join(work_dir, name)
+                tar.add(path, arcname=prefix + name)
+                files[name] = os.path.getsize(path)
+        member = self._compress(buffer.getvalue(), self._level)
+
+        offset = self._f_data.tell()
+        self._f_data.write(member)
+        self._f_data.flush()
+        os.fsync(self._f_data.fileno())
+        entry = {"tag": tag, "variant": variant, "spins": np.asarray(spins, dtype=float).tolist(), "key": key,
+                 "status": status, "compression": self._compression, "offset": offset, "length": len(member),
+                 "files": files}
+        self._f_index.write((json.dumps(entry) + "\n").encode())
+        self._f_index.flush()
+        os.fsync(self._f_index.fileno())
+        self.entries.append(entry)
+
+    def find(self, tag=None, variant=None, spins=None, tolerance=1e-6) -> List[Dict]:
+        """Entries matching all the given criteria, oldest first (a variant rerun later appears again)."""
+        found = []
+        for entry in self.entries:
+            if tag is not None and str(entry["tag"]) != str(tag) or variant is not None and entry["variant"] != variant:
+                continue
+            if spins is not None and (len(entry["spins"]) != len(spins) or
+                                      np.max(np.abs(np.array(entry["spins"]) - spins)) > tolerance):
+                continue
+            found.append(entry)
+        return found
+
+    def read(self, entry: Dict) -> Dict[str, bytes]:
+        """Content of every file of an entry, decompressing its member only."""
+        data_name, _, decompress = COMPRESSIONS[entry["compression"]]
+        with open(self.path(data_name), "rb") as f:
+            f.seek(entry["offset"])
+            member = decompress(f.read(entry["length"]))
+        with tarfile.open(fileobj=io.BytesIO(member), mode="r") as tar:
+            return {os.path.basename(info.name): tar.extractfile(info).read() for info in tar.getmembers()
+                    if info.isfile()}
+
+    def extract(self, entry: Dict, dest_dir):
+        """Write the files of an entry to ``dest_dir``, e.g. to parse them again with ``SphinxIO``."""
+        mkdir_without_override(dest_dir)
+        for name, content in self.read(entry).items():
+            with open(os.path.join(dest_dir, name), "wb") as f:
+                f.write(content)
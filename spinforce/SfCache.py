@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+# @File    : SfCache.py
+# @Time    : 4/24/2021 4:02 PM
+# @Author  : Zavier Cai
+# @Email   : caizefeng18@gmail.com
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+
+from spinforce.SfVariant import SfVariantJob, SfVariantResult
+from spinforce.helper.fs_helper import mkdir_without_override
+
+
+class SfResultCache:
+    """Content-addressed store of converged variants.
+
+    A variant is identified by the SHA-256 of the input template, the structure file, the full spin
+    vector and the collinear flag, so identical calculations are found again across reruns and
+    across campaigns sharing the cache directory. Each entry is one ``.npz`` file.
+    """
+
+    def __init__(self, cache_dir):
+        self._cache_dir = cache_dir
+        mkdir_without_override(cache_dir)
+
+    @staticmethod
+    def file_digest(*paths):
+        sha = hashlib.sha256()
+        for path in paths:
+            with open(path, "rb") as f:
+                sha.update(hashlib.sha256(f.read()).digest())
+        return sha.hexdigest()
+
+    @staticmethod
+    def key(files_digest, spins, collinear):
+        sha = hashlib.sha256(files_digest.encode())
+        sha.update(np.ascontiguousarray(spins, dtype=np.float64).tobytes())
+        sha.update(b"collinear" if collinear else b"non-collinear")
+        return sha.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self._cache_dir, key[:2], key + ".npz")
+
+    def contains(self, key):
+        return os.path.exists(self.path(key))
+
+    def load(self, job: SfVariantJob):
+        path = self.path(job.key)
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as entry:
+            result = SfVariantResult(job)
+            result.status = SfVariantResult.CONVERGED
+            result.num_step = int(entry["num_step"])
+            result.cell = entry["cell"]
+            result.structure_array = entry["structure_array"]
+            result.spin_array = entry["spin_array"]
+            result.nu_array = entry["nu_array"]
+            result.force_array = entry["force_array"]
+            result.total_energy = float(entry["total_energy"])
+            coords = np.split(result.structure_array.reshape((-1, 3)), np.cumsum(entry["type_counts"])[:-1])
+            result.structure_dict = {str(atom_type): coord for atom_type, coord in enumerate(coords)}
+        result.work_dir = None  # nothing to clean up
+        return result
+
+    def store(self, result: SfVariantResult):
+        path = self.path(result.key)
+        mkdir_without_override(os.path.dirname(path))
+        type_counts = [len(coords) for coords in result.structure_dict.values()]
+        # write to a temporary file first so that a crash never leaves a truncated entry behind
+        fd, tmp_path = tempfile.mkstemp(suffix=".npz", dir=os.path.dirname(path))
+        with os.fdopen(fd, "wb") as f:
+            np.savez(f, num_step=result.num_step, cell=result.cell, structure_array=result.structure_array,
+                     spin_array=result.spin_array, nu_array=result.nu_array, force_array=result.force_array,
+                     total_energy=result.total_energy, type_counts=type_counts)
+        os.replace(tmp_path, path)
@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# @File    : SfDataset.py
+# @Time    : 5/5/2021 2:20 PM
+# @Author  : Zavier Cai
+# @Email   : caizefeng18@gmail.com
+import hashlib
+import logging
+import os
+from collections import OrderedDict
+from typing import List
+
+import numpy as np
+
+from spinforce.DPIO import DPReader, DPWriter
+
+
+class SfDatasetMerger:
+    """Stream-merges ``DPWriter`` output directories into one training and one validation set.
+
+    All directories must share one ``type.raw``. A frame is a duplicate if its cell and coordinates,
+    pseudo-atoms included, i.e. its structure and spin configuration, were already merged. Frames go
+    to the validation set either at random (``split="random"``, a fraction ``validation`` of the frames)
+    or with all frames of their tag (``split="tag"``, a fraction of the tags). DP files do not record the
+    tag, so a tag is recognised by its structure: the cell and the coordinates of the real atoms.
+    """
+
+    def __init__(self, output_dir, output_format="raw", validation=0.1, split="random", seed=0, set_size=5000,
+                 chunk_size=1024):
+        self._output_dir = output_dir
+        self._format = output_format
+        self._validation = validation
+        self._split = split
+        self._seed = seed
+        self._set_size = set_size
+        self._chunk_size = chunk_size
+        self._logger = None  # type: logging.Logger
+
+        self._validation_structures = set()
+
+    @staticmethod
+    def frame_digest(box, coord) -> bytes:
+        sha = hashlib.sha1(np.ascontiguousarray(box, dtype=np.float64).tobytes())
+        sha.update(np.ascontiguousarray(coord, dtype=np.float64).tobytes())
+        return sha.digest()
+
+    @staticmethod
+    def structure_digest(box, coord) -> bytes:
+        # the first half of a coord row are the real atoms, the second half their spin pseudo-atoms
+        return SfDatasetMerger.frame_digest(box, coord[:len(coord) // 2])
+
+    def fraction(self, digest):
+        """Stable pseudo-random number in [0, 1) of a frame, the same in every merge with the same seed."""
+        sha = hashlib.sha256(str(self._seed).encode())
+        sha.update(digest)
+        return int.from_bytes(sha.digest()[:8], "little") / 2 ** 64
+
+    def open_readers(self, source_dirs) -> List[DPReader]:
+        readers = [DPReader(source_dir) for source_dir in source_dirs]
+        type_array = readers[0].type_array
+        for source_dir, reader in zip(source_dirs, readers):
+            if len(reader.type_array) != len(type_array) or np.any(reader.type_array != type_array):
+                self._logger.error("Atom types of {} differ from those of {}, they cannot be merged!".format(
+                    source_dir, source_dirs[0]))
+                raise RuntimeError
+        return readers
+
+    def choose_validation_structures(self, readers: List[DPReader]):
+        structures = OrderedDict()
+        for reader in readers:
+            for chunk in reader.chunks(self._chunk_size):
+                for box, coord in zip(chunk["box"], chunk["coord"]):
+                    structures[self.structure_digest(box, coord)] = None
+        structures = list(structures)
+        num_validation = int(round(self._validation * len(structures)))
+        if self._validation > 0 and len(structures) > 1:
+            num_validation = min(max(num_validation, 1), len(structures) - 1)
+        else:
+            num_validation = 0
+            if self._validation > 0:
+                self._logger.warning("Only one tag found, no validation set can be split off by tag")
+        chosen = np.random.RandomState(self._seed).permutation(len(structures))[:num_validation]
+        self._validation_structures = {structures[i] for i in chosen}
+        self._logger.info("{} of {} tags go to the validation set".format(num_validation, len(structures)))
+
+    def is_validation(self, box, coord, digest):
+        if self._split == "tag":
+            return self.structure_digest(box, coord) in self._validation_structures
+        return self.fraction(digest) < self._validation
+
+    def new_writer(self, output_dir, type_array, name) -> DPWriter:
+        writer = DPWriter()
+        writer._logger = self._logger
+        writer.init(output_dir, self._format, self._set_size, flush_frames=self._chunk_size)
+        writer.write_type(type_array)
+        self._logger.info("{} set at {}".format(name, output_dir))
+        return writer
+
+    def merge(self, source_dirs):
+        if self._split not in ("random", "tag"):
+            self._logger.error("Invalid split \"{}\", use \"random\" or \"tag\"!".format(self._split))
+            raise RuntimeError
+        readers = self.open_readers(source_dirs)
+        if self._split == "tag":
+            self.choose_validation_structures(readers)
+
+        type_array = readers[0].type_array
+        if self._validation > 0:
+            train_writer = self.new_writer(os.path.join(self._output_dir, "train"), type_array, "Training")
+            validation_writer = self.new_writer(os.path.join(self._output_dir, "validation"), type_array, "Validation")
+        else:
+            train_writer = validation_writer = self.new_writer(self._output_dir, type_array, "Merged")
+
+        seen = set()
+        num_train = num_validation = 0
+        for source_dir, reader in zip(source_dirs, readers):
+            num_read = num_duplicates = 0
+            for chunk in reader.chunks(self._chunk_size):
+                for i, (box, coord) in enumerate(zip(chunk["box"], chunk["coord"])):
+                    num_read += 1
+                    digest = self.frame_digest(box, coord)
+                    if digest in seen:
+                        num_duplicates += 1
+                        continue
+                    seen.add(digest)
+                    rows = {"box": box, "coord": coord, "energy": float(chunk["energy"][i, 0]),
+                            "force": chunk["force"][i]}
+                    if self._validation > 0 and self.is_validation(box, coord, digest):
+                        validation_writer.write_rows(rows)
+                        num_validation += 1
+                    else:
+                        train_writer.write_rows(rows)
+                        num_train += 1
+            self._logger.info("{}: {} frames read, {} duplicates dropped".format(source_dir, num_read, num_duplicates))
+
+        train_writer.close()
+        if validation_writer is not train_writer:
+            validation_writer.close()
+        self._logger.info("{} frames merged: {} for training, {} for validation".format(
+            num_train + num_validation, num_train, num_validation))
@@ -0,0 +1,382 @@
+#!/usr/bin/env python3
+# @File    : SfExecutor.py
+# @Time    : 4/21/2021 10:05 AM
+# @Author  : Zavier Cai
+# @Email   : caizefeng18@gmail.com
+import asyncio
+import getpass
+import logging
+import os
+import re
+import shlex
+import signal
+import subprocess
+import tempfile
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Dict, List
+
+from spinforce.SfMonitor import SfScfMonitor
+from spinforce.SfVariant import SfVariantJob, SfVariantResult, aborted_variant, collect_variant, \
+    finish_continuation, merge_attempts, prepare_continuation, run_variant
+from spinforce.helper.proc_helper import command_argv, read_tail
+
+
+class SfExecutor:
+    """Runs prepared variant jobs and yields their results in submission order."""
+
+    # whether every job needs its own directory
+    sandboxed = True
+
+    # yielded among the jobs to hold back later jobs until the results of all earlier ones are consumed
+    BARRIER = object()
+
+    def __init__(self):
+        self._logger = None  # type: logging.Logger
+        self._idle_callback = None
+        self._idle_interval = None
+
+    def on_idle(self, callback, interval):
+        """Call ``callback`` at least every ``interval`` seconds while waiting for variants, e.g. to commit
+        frames on time during a stretch of slow ones."""
+        self._idle_callback = callback
+        self._idle_interval = interval
+
+    def idle(self):
+        if self._idle_callback is not None:
+            self._idle_callback()
+
+    def start(self):
+        pass
+
+    def shutdown(self):
+        pass
+
+    def capacity(self):
+        """(variants run at once, cores per variant) once started, for cost estimates; None if unknown."""
+        return 1, 1
+
+    def execute(self, jobs):
+        raise NotImplementedError
+
+    @staticmethod
+    def execute_ordered(jobs, max_in_flight, submit, wait_any):
+        """Keep up to ``max_in_flight`` jobs running and yield results in submission order.
+
+        ``submit(job)`` returns a handle; ``wait_any(handles)`` blocks until at least one handle is
+        done and returns a dict mapping the finished handles to their results. Results finishing
+        early wait in a buffer until all earlier jobs are done, so the order is deterministic. Jobs
+        carrying a known result are passed through in order without being submitted, a ``BARRIER`` waits
+        until every earlier result has been yielded (and so handled by the consumer).
+        """
+        running = {}
+        finished = {}
+        next_submit = 0
+        next_yield = 0
+        jobs = iter(jobs)
+        exhausted = False
+        barrier = False
+        while True:
+            while not exhausted and not barrier and len(running) < max_in_flight:
+                try:
+                    job = next(jobs)
+                except StopIteration:
+                    exhausted = True
+                    break
+                if job is SfExecutor.BARRIER:
+                    barrier = True
+                    break
+                if job.result is not None:
+                    finished[next_submit] = job.result
+                else:
+                    running[submit(job)] = next_submit
+                next_submit += 1
+
+            while next_yield in finished:
+                yield finished.pop(next_yield)
+                next_yield += 1
+
+            if not running:
+                if barrier:  # everything before it has been yielded
+                    barrier = False
+                    continue
+                break
+            for handle, result in wait_any(list(running)).items():
+                finished[running.pop(handle)] = result
+
+
+class SfInlineExecutor(SfExecutor):
+    """Runs variants one by one in the shared working directory."""
+
+    sandboxed = False
+
+    def execute(self, jobs):
+        for job in jobs:
+            if job is not SfExecutor.BARRIER:  # one job at a time anyway
+                yield job.result if job.result is not None else run_variant(job)
+
+
+class SfPoolExecutor(SfExecutor):
+    """Runs ``num_workers`` variants at once on a local process pool."""
+
+    def __init__(self, num_workers):
+        super().__init__()
+        self._num_workers = num_workers
+        self._pool = None  # type: ProcessPoolExecutor
+
+    def start(self):
+        self._pool = ProcessPoolExecutor(max_workers=self._num_workers)
+        self._logger.info("Running {} SPHInX variants concurrently on a local process pool".format(
+            self._num_workers))
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def capacity(self):
+        return self._num_workers, 1
+
+    def execute(self, jobs):
+        def submit(job):
+            return self._pool.submit(run_variant, job)
+
+        def wait_any(futures):
+            done, _ = wait(futures, timeout=self._idle_interval, return_when=FIRST_COMPLETED)
+            while not done:
+                self.idle()
+                done, _ = wait(futures, timeout=self._idle_interval, return_when=FIRST_COMPLETED)
+            return {future: future.result() for future in done}
+
+        return self.execute_ordered(jobs, self._num_workers, submit, wait_any)
+
+
+class SfAsyncExecutor(SfExecutor):
+    """Runs SPHInX processes side by side on disjoint sets of ``cores_per_job`` cores out of a core budget.
+
+    Each process is pinned to its cores and gets ``OMP_NUM_THREADS`` to match, so concurrent runs never
+    fight over a core. The processes are awaited on an asyncio event loop in this process, with the
+    SCF monitor polled between timeouts instead of a blocked worker per running variant; output is
+    parsed here once a process exits. An MPI launcher in ``sphinx_path`` inherits the pinning, as long
+    as its own binding is switched off.
+    """
+
+    def __init__(self, async_dict: Dict):
+        super().__init__()
+        self._cores = async_dict.get("cores")  # all cores this process may run on if None
+        self._cores_per_job = async_dict.get("cores_per_job", 1)
+        self._loop = None  # type: asyncio.AbstractEventLoop
+        self._free_cpu_sets = []  # type: List[List[int]]
+        self._num_slots = 0
+        self._tasks = set()
+
+    @staticmethod
+    def available_cpus():
+        if hasattr(os, "sched_getaffinity"):
+            return sorted(os.sched_getaffinity(0))
+        return list(range(os.cpu_count()))
+
+    def start(self):
+        cpus = self.available_cpus()
+        cores = self._cores or len(cpus)
+        if cores > len(cpus):
+            self._logger.warning("Core budget {} exceeds the {} cores available, using {}".format(
+                cores, len(cpus), len(cpus)))
+            cores = len(cpus)
+        self._num_slots = cores // self._cores_per_job
+        if self._num_slots < 1:
+            self._logger.error("Core budget {} is smaller than \"cores_per_job\" {}!".format(
+                cores, self._cores_per_job))
+            raise RuntimeError
+        self._free_cpu_sets = [cpus[i * self._cores_per_job:(i + 1) * self._cores_per_job]
+                               for i in range(self._num_slots)]
+        if not hasattr(os, "sched_setaffinity"):
+            self._logger.warning("CPU affinity not supported on this platform, only OMP_NUM_THREADS is set")
+
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)  # older Pythons attach their child watcher to the current loop
+        self._logger.info("Running {} SPHInX variants concurrently, {} cores each, on cores {}".format(
+            self._num_slots, self._cores_per_job, cpus[:self._num_slots * self._cores_per_job]))
+
+    def shutdown(self):
+        if self._loop is None:
+            return
+        for task in self._tasks:  # only left over if the run was interrupted
+            task.cancel()
+        if self._tasks:
+            self._loop.run_until_complete(asyncio.wait(self._tasks))
+        self._loop.close()
+        asyncio.set_event_loop(None)
+        self._loop = None
+
+    def execute(self, jobs):
+        def submit(job):
+            task = self._loop.create_task(self.run_job(job))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+            return task
+
+        def wait_any(tasks):
+            done, _ = self._loop.run_until_complete(asyncio.wait(tasks, timeout=self._idle_interval,
+                                                                 return_when=asyncio.FIRST_COMPLETED))
+            while not done:
+                self.idle()
+                done, _ = self._loop.run_until_complete(asyncio.wait(tasks, timeout=self._idle_interval,
+                                                                     return_when=asyncio.FIRST_COMPLETED))
+            return {task: task.result() for task in done}
+
+        return self.execute_ordered(jobs, self._num_slots, submit, wait_any)
+
+    def capacity(self):
+        cpus = self.available_cpus()
+        return max(min(self._cores or len(cpus), len(cpus)) // self._cores_per_job, 1), self._cores_per_job
+
+    @staticmethod
+    def pin(cpus):
+        if hasattr(os, "sched_setaffinity"):
+            os.sched_setaffinity(0, cpus)
+
+    async def run_job(self, job: SfVariantJob) -> SfVariantResult:
+        try:
+            result = await self.run_attempt(job)
+            while prepare_continuation(job, result):
+                result = merge_attempts(result, await self.run_attempt(job))
+        finally:
+            finish_continuation(job)
+        return result
+
+    async def run_attempt(self, job: SfVariantJob) -> SfVariantResult:
+        cpus = self._free_cpu_sets.pop()
+        try:
+            start = time.perf_counter()
+            monitor = None
+            if job.monitor is not None:
+                monitor = SfScfMonitor(job.monitor)
+                monitor.begin(job.work_dir)
+            returncode, stderr, abort_reason = await self.launch(job, cpus, monitor)
+            sphinx_seconds = time.perf_counter() - start
+        finally:
+            self._free_cpu_sets.append(cpus)
+
+        result = aborted_variant(job, monitor, abort_reason) if abort_reason else collect_variant(job)
+        result.timings["sphinx"] = sphinx_seconds
+        result.returncode, result.stderr = returncode, stderr
+        return result
+
+    async def launch(self, job: SfVariantJob, cpus, monitor: SfScfMonitor = None):
+        """Run SPHInX pinned to ``cpus``; returns its exit status, the tail of its stderr and the abort reason."""
+        env = dict(os.environ, OMP_NUM_THREADS=str(len(cpus)))
+        with open(os.path.join(job.work_dir, "output.sx"), "wb") as output, tempfile.TemporaryFile() as stderr:
+            try:
+                sub = await asyncio.create_subprocess_exec(
+                    *command_argv(job.sphinx_path), cwd=job.work_dir, stdout=output, stderr=stderr, env=env,
+                    preexec_fn=lambda: self.pin(cpus), start_new_session=True)
+            except OSError as error:  # binary gone or not executable
+                return None, str(error), None
+
+            abort_reason = None
+            waiter = asyncio.ensure_future(sub.wait())
+            try:
+                while not waiter.done():
+                    await asyncio.wait([waiter], timeout=monitor.poll_interval if monitor is not None else None)
+                    if not waiter.done():
+                        abort_reason = monitor.poll()
+                        if abort_reason:
+                            os.killpg(sub.pid, signal.SIGKILL)
+                            await waiter
+            except asyncio.CancelledError:
+                if sub.returncode is None:
+                    os.killpg(sub.pid, signal.SIGKILL)
+                    await sub.wait()
+                raise
+            if monitor is not None and not abort_reason:
+                monitor.follow()
+            return waiter.result(), read_tail(stderr), abort_reason
+
+
+class SfBatchExecutor(SfExecutor):
+    """Submits every variant as a batch job and polls the scheduler until it leaves the queue.
+
+    The scheduler is driven through two commands, e.g. for SLURM ``sbatch`` to submit and
+    ``squeue -h -o %i -u {user}`` to query. The status command runs once per poll for all queued jobs
+    (``{job_ids}`` expands to their comma-separated IDs); a job counts as finished once a successful
+    reply no longer lists its ID. A failed status command tells nothing, it is retried at the next poll.
+    ``spinforce/scripts/fake_scheduler.py`` is a local stand-in with the same interface.
+    """
+
+    def __init__(self, batch_dict: Dict):
+        super().__init__()
+        self._submit_cmd = shlex.split(batch_dict.get("submit_cmd", "sbatch"))
+        self._status_cmd = batch_dict.get("status_cmd", "squeue -h -o %i -u {user}")
+        self._job_id_pattern = re.compile(batch_dict.get("job_id_pattern", r"(\d+)"))
+        self._poll_interval = batch_dict.get("poll_interval", 30)
+        self._max_queued = batch_dict.get("max_queued", 1000)
+        self._max_status_failures = batch_dict.get("max_status_failures", 10)
+        self._concurrent_jobs = batch_dict.get("concurrent_jobs")
+        self._directives = batch_dict.get("directives", [])
+
+    def start(self):
+        self._logger.info("Submitting SPHInX variants with `{}`, at most {} queued at once".format(
+            " ".join(self._submit_cmd), self._max_queued))
+
+    def write_job_script(self, job: SfVariantJob):
+        script_path = os.path.join(job.work_dir, "job.sh")
+        with open(script_path, "w") as f:
+            f.write("#!/bin/sh\n")
+            for directive in self._directives:
+                f.write(directive + "\n")
+            f.write("cd {}\n".format(shlex.quote(job.work_dir)))
+            f.write("{} > output.sx\n".format(job.sphinx_path))
+        return script_path
+
+    def capacity(self):
+        # how many queued jobs the scheduler actually runs at once is up to it, only the user can tell
+        return self._concurrent_jobs, 1
+
+    def submit(self, job: SfVariantJob):
+        script_path = self.write_job_script(job)
+        sub = subprocess.run(self._submit_cmd + [script_path], cwd=job.work_dir,
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        job_id = self._job_id_pattern.search(sub.stdout)
+        if sub.returncode != 0 or job_id is None:
+            self._logger.error("Submitting Tag {} Variant {} failed: {}".format(
+                job.tag, job.variant, (sub.stdout + sub.stderr).strip()))
+            raise RuntimeError
+        self._logger.info("Tag {} Variant {} submitted as job {}".format(job.tag, job.variant, job_id.group(1)))
+        return job_id.group(1), job
+
+    def queued_job_ids(self, job_ids):
+        """Those of ``job_ids`` the scheduler still lists, or None if it could not be asked."""
+        joined = ",".join(job_ids)
+        status_cmd = shlex.split(self._status_cmd.format(job_ids=joined, job_id=joined, user=getpass.getuser()))
+        try:
+            sub = subprocess.run(status_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                 universal_newlines=True)
+        except OSError as error:
+            self._logger.warning("Querying the scheduler failed: {}".format(error))
+            return None
+        if sub.returncode != 0:
+            self._logger.warning("Querying the scheduler failed with status {}: {}".format(
+                sub.returncode, sub.stderr.strip()))
+            return None
+        return set(self._job_id_pattern.findall(sub.stdout)) & set(job_ids)
+
+    def execute(self, jobs):
+        def wait_any(handles):
+            num_failures = 0
+            while True:
+                queued = self.queued_job_ids([handle[0] for handle in handles])
+                if queued is None:
+                    num_failures += 1
+                    if num_failures >= self._max_status_failures:
+                        self._logger.error("Scheduler status unknown after {} attempts in a row!".format(num_failures))
+                        raise RuntimeError
+                else:
+                    num_failures = 0
+                    done = {handle: collect_variant(handle[1]) for handle in handles if handle[0] not in queued}
+                    if done:
+                        return done
+                self.idle()
+                time.sleep(self._poll_interval)
+
+        return self.execute_ordered(jobs, self._max_queued, self.submit, wait_any)
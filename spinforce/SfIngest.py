@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# @File    : SfIngest.py
+# @Time    : 5/10/2021 9:20 AM
+# @Author  : Zavier Cai
+# @Email   : caizefeng18@gmail.com
+import logging
+import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from typing import List
+
+import numpy as np
+
+from spinforce.DPIO import DPWriter
+from spinforce.SfCache import SfResultCache
+from spinforce.SfStructure import SfStructure
+from spinforce.SfVariant import SfVariantJob, parse_variant
+from spinforce.helper.fs_helper import change_dir
+
+RUN_FILES = ("structure.sx", "spin-constraint.sx", "output.sx")
+
+
+def ingest_run(work_dir):
+    """(work_dir, parsed result, DP atom types, error) of one finished run directory.
+
+    Module-level so that it can be shipped to a process pool.
+    """
+    try:
+        with change_dir(work_dir):
+            structure = SfStructure.read()
+            spins = np.atleast_1d(np.loadtxt("spin-constraint.sx"))
+            files_digest = SfResultCache.file_digest(*[name for name in ("input.sx", "structure.sx")
+                                                       if os.path.exists(name)])
+        job = SfVariantJob(None, None, work_dir, None, spins=spins, structure=structure)
+        job.key = SfResultCache.key(files_digest, spins, True)
+        return work_dir, parse_variant(job), structure.dp_type_array, None
+    except Exception as error:  # any half-written or foreign directory, it must not stop the others
+        return work_dir, None, None, "{}: {}".format(type(error).__name__, error)
+
+
+class SfRunIngester:
+    """Turns finished SPHInX run directories into one DeePMD dataset without running SPHInX again.
+
+    Every directory below the given roots holding ``RUN_FILES`` is a run; its ``structure.sx``,
+    ``spin-constraint.sx``, ``output.sx``, ``energy.dat`` and ``forces.sx`` are parsed by ``parse_variant``
+    on ``num_workers`` processes, so the same convergence and constraint filters apply as in a campaign.
+    Accepted frames stream into a ``DPWriter`` in the sorted order of the directories. Each frame is keyed
+    like ``SfResultCache`` (input files and spins), so copies of a run are written once and ``resume``
+    skips the runs already committed to ``output_dir``. All frames must share the atom types of the first.
+    """
+
+    def __init__(self, output_dir, output_format="raw", num_workers=None, resume=False, set_size=5000,
+                 chunk_size=1024):
+        self._output_dir = output_dir
+        self._format = output_format
+        self._num_workers = num_workers or os.cpu_count()
+        self._resume = resume
+        self._set_size = set_size
+        self._chunk_size = chunk_size
+        self._logger = None  # type: logging.Logger
+
+    @staticmethod
+    def find_runs(root_dirs) -> List[str]:
+        run_dirs = []
+        for root_dir in root_dirs:
+            for dir_path, dir_names, file_names in os.walk(root_dir):
+                dir_names.sort()
+                if all(name in file_names for name in RUN_FILES):
+                    run_dirs.append(dir_path)
+        return run_dirs
+
+    def parsed_runs(self, run_dirs):
+        if self._num_workers <= 1:
+            yield from map(ingest_run, run_dirs)
+            return
+        # ordered, and in chunks so that thousands of small parses are not one round trip each
+        chunk_size = max(1, min(64, len(run_dirs) // (4 * self._num_workers)))
+        with ProcessPoolExecutor(max_workers=self._num_workers) as pool:
+            yield from pool.map(ingest_run, run_dirs, chunksize=chunk_size)
+
+    def ingest(self, root_dirs):
+        run_dirs = self.find_runs(root_dirs)
+        self._logger.info("{} SPHInX run directories found, parsing them on {} processes".format(
+            len(run_dirs), self._num_workers))
+
+        writer = DPWriter()
+        writer._logger = self._logger
+        writer.init(self._output_dir, self._format, self._set_size, flush_frames=self._chunk_size,
+                    resume=self._resume)
+        seen = set(writer.committed_keys)
+        counts = Counter()
+        for num_parsed, (work_dir, result, dp_type_array, error) in enumerate(self.parsed_runs(run_dirs), 1):
+            if error is not None:
+                counts["unreadable"] += 1
+                self._logger.warning("Cannot parse {}: {}".format(work_dir, error))
+            elif not result.accepted:
+                counts[result.status] += 1
+            elif result.key in seen:
+                counts["duplicate"] += 1
+            elif not writer.accepts_type(dp_type_array):
+                counts["other atom types"] += 1
+                self._logger.warning("Atom types of {} differ from those of the first frame, skipped".format(
+                    work_dir))
+            else:
+                writer.write_type(dp_type_array)
+                writer.write_frame(result.cell, result.structure_array, result.spin_array, result.total_energy,
+                                   result.force_array, result.nu_array, result.key)
+                seen.add(result.key)
+                counts["written"] += 1
+            if num_parsed % 10000 == 0:
+                self._logger.info("{} of {} runs parsed".format(num_parsed, len(run_dirs)))
+        writer.close()
+
+        skipped = ", ".join("{} {}".format(count, status) for status, count in sorted(counts.items())
+                            if status != "written")
+        self._logger.info("{} of {} runs written as frames{}".format(
+            counts["written"], len(run_dirs), " ({} skipped)".format(skipped) if skipped else ""))
+        return counts
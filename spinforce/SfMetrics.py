@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# @File    : SfMetrics.py
+# @Time    : 5/3/2021 9:50 AM
+# @Author  : Zavier Cai
+# @Email   : caizefeng18@gmail.com
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict
+
+
+class SfMetrics:
+    """Timing spans and counters of a run.
+
+    Totals are always kept in memory for the end-of-run summary. If enabled, every span and counter
+    increment is also appended to a JSON-lines file, and the totals are written as a Prometheus
+    textfile-collector file (periodically and at the end), replaced atomically each time.
+    """
+
+    def __init__(self, metrics_dict: Dict = None, working_dir="."):
+        metrics_dict = metrics_dict or {}
+        enabled = metrics_dict.get("enabled", False)
+        self._jsonl_path = os.path.join(working_dir, metrics_dict.get("jsonl", "metrics.jsonl")) if enabled else None
+        self._prometheus_path = os.path.join(working_dir, metrics_dict.get("prometheus", "spinforce.prom")) \
+            if enabled else None
+        self._prometheus_interval = metrics_dict.get("prometheus_interval", 15.0)
+
+        self._logger = None  # type: logging.Logger
+        self._jsonl = None
+        self._start = None
+        self._last_prometheus = 0.
+        self._spans = OrderedDict()  # (phase, tag) -> [seconds, count]
+        self._counters = OrderedDict()  # (name, sorted labels) -> value
+
+    def start(self):
+        self._start = time.time()
+        if self._jsonl_path is not None:
+            self._jsonl = open(self._jsonl_path, "w", buffering=1)
+            self._logger.info("Metrics stream at {}, Prometheus textfile at {}".format(self._jsonl_path,
+                                                                                     self._prometheus_path))
+
+    def close(self):
+        self.write_prometheus()
+        if self._jsonl is not None:
+            self._jsonl.close()
+            self._jsonl = None
+
+    @contextmanager
+    def span(self, phase, tag=None, variant=None):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(phase, time.perf_counter() - start, tag, variant)
+
+    def observe(self, phase, seconds, tag=None, variant=None):
+        """Record a span measured elsewhere, e.g. SPHInX time reported back by a worker."""
+        total = self._spans.setdefault((phase, tag), [0., 0])
+        total[0] += seconds
+        total[1] += 1
+        self.emit({"event": "span", "phase": phase, "tag": tag, "variant": variant, "seconds": seconds})
+
+    def inc(self, name, value=1, tag=None, variant=None, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        self._counters[key] = self._counters.get(key, 0) + value
+        event = {"event": "counter", "name": name, "tag": tag, "variant": variant, "value": value}
+        event.update(labels)
+        self.emit(event)
+
+    def emit(self, event):
+        if self._jsonl is not None:
+            event["time"] = time.time()
+            self._jsonl.write(json.dumps(event) + "\n")
+        if self._prometheus_path is not None and time.time() - self._last_prometheus > self._prometheus_interval:
+            self.write_prometheus()
+
+    def total(self, phase, tag=None):
+        """(seconds, count) of a phase, for one tag or summed over all."""
+        spans = [value for (name, span_tag), value in self._spans.items()
+                 if name == phase and (tag is None or span_tag == tag)]
+        return sum(value[0] for value in spans), sum(value[1] for value in spans)
+
+    def phases(self):
+        return list(OrderedDict.fromkeys(phase for phase, _ in self._spans))
+
+    def write_prometheus(self):
+        if self._prometheus_path is None:
+            return
+        self._last_prometheus = time.time()
+        lines = ["# HELP spinforce_phase_seconds_total Wall time spent in each phase, summed over variants and workers",
+                 "# TYPE spinforce_phase_seconds_total counter"]
+        for phase in self.phases():
+            lines.append('spinforce_phase_seconds_total{{phase="{}"}} {:.6f}'.format(phase, self.total(phase)[0]))
+        lines += ["# HELP spinforce_phase_spans_total Number of timed spans of each phase",
+                  "# TYPE spinforce_phase_spans_total counter"]
+        for phase in self.phases():
+            lines.append('spinforce_phase_spans_total{{phase="{}"}} {}'.format(phase, self.total(phase)[1]))
+        for name in OrderedDict.fromkeys(name for name, _ in self._counters):
+            lines.append("# TYPE spinforce_{}_total counter".format(name))
+            for (counter_name, labels), value in self._counters.items():
+                if counter_name == name:
+                    label_text = ",".join('{}="{}"'.format(key, label) for key, label in labels)
+                    lines.append("spinforce_{}_total{} {}".format(name, "{" + label_text + "}" if labels else "",
+                                                                  value))
+        lines += ["# TYPE spinforce_run_seconds gauge", "spinforce_run_seconds {:.3f}".format(self.elapsed)]
+
+        tmp_path = self._prometheus_path + ".tmp"  # the collector must never read a half-written file
+        with open(tmp_path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, self._prometheus_path)
+
+    @property
+    def elapsed(self):
+        return time.time() - self._start if self._start is not None else 0.
+
+    def summary(self):
+        elapsed = self.elapsed
+        self._logger.info("Where the time went ({:.1f} s of wall time; phases run by workers are summed over them):"
+                          .format(elapsed))
+        self._logger.info("{:>12} {:>12} {:>8} {:>12} {:>8}".format("phase", "total/s", "spans", "mean/ms", "share"))
+        for phase in self.phases():
+            seconds, count = self.total(phase)
+            self._logger.info("{:>12} {:>12.2f} {:>8} {:>12.2f} {:>7.1%}".format(
+                phase, seconds, count, seconds / count * 1e3, seconds / elapsed if elapsed else 0.))
+        for (name, labels), value in self._counters.items():
+            self._logger.info("{}{}: {}".format(name, "".join(" {}={}".format(*label) for label in labels), value))
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+# @File    : SfMonitor.py
+# @Time    : 4/23/2021 11:18 AM
+# @Author  : Zavier Cai
+# @Email   : caizefeng18@gmail.com
+import os
+import re
+import signal
+import subprocess
+import time
+from typing import Dict
+
+import numpy as np
+
+from spinforce.SphinxIO import SphinxIO
+from spinforce.helper.fs_helper import batch_remove_if_exists
+from spinforce.helper.proc_helper import command_argv
+
+_STEP_PATTERN = re.compile(rb'^F\((\d+)\)=\s*([-+\d.eE]+)', flags=re.MULTILINE)
+_SPIN_PATTERN = re.compile(rb'^Spin of atom (\d+) = (\S+)', flags=re.MULTILINE)
+
+
+class SfTail:
+    """Hands out the complete lines appended to a file since the last call, starting over if it was truncated."""
+
+    def __init__(self, path):
+        self._path = path
+        self._offset = 0
+        self._remainder = b""
+
+    def read_new(self) -> bytes:
+        if not os.path.exists(self._path):
+            return b""
+        with open(self._path, "rb") as f:
+            if os.fstat(f.fileno()).st_size < self._offset:  # rewritten from scratch
+                self._offset = 0
+                self._remainder = b""
+            f.seek(self._offset)
+            data = self._remainder + f.read()
+        self._offset += len(data) - len(self._remainder)
+        end = data.rfind(b"\n") + 1
+        self._remainder = data[end:]
+        return data[:end]
+
+
+class SfScfMonitor:
+    """Runs SPHInX in the current directory and kills it once the SCF is hopeless.
+
+    ``output.sx`` and ``energy.dat`` are tailed while SPHInX runs. The run is aborted when
+
+    * the SCF energy keeps oscillating without the amplitude decaying,
+    * the spin residual of the "Spin of atom" lines against ``spin-constraint.sx`` stops shrinking, or
+    * extrapolating the current energy convergence rate, ``dEnergy`` cannot be reached within the
+      ``maxSteps`` left in ``input.sx``.
+    """
+
+    def __init__(self, monitor_dict: Dict):
+        self._poll_interval = monitor_dict.get("poll_interval", 2.0)
+        self._window = monitor_dict.get("window", 10)
+        self._min_steps = monitor_dict.get("min_steps", 20)
+        self._oscillation_ratio = monitor_dict.get("oscillation_ratio", 0.8)
+        self._stall_ratio = monitor_dict.get("stall_ratio", 0.95)
+        self._convergence_margin = monitor_dict.get("convergence_margin", 2.0)
+        self._spin_tolerance = 1e-5  # same as SphinxIO.check_constraint
+
+        self._max_steps = None
+        self._d_energy = None
+        self._targets = None
+        self._output_tail = None  # type: SfTail
+        self._energy_tail = None  # type: SfTail
+        self._num_step = 0
+        self._returncode = None
+        self._step_energies = []
+        self._dat_energies = []
+        self._residuals = []
+        self._spin_block = []
+
+    @property
+    def num_step(self):
+        return self._num_step
+
+    @property
+    def returncode(self):
+        return self._returncode
+
+    @property
+    def poll_interval(self):
+        return self._poll_interval
+
+    def begin(self, work_dir="."):
+        """Read the targets of the variant in ``work_dir``, before SPHInX starts writing there."""
+        # left over by the previous variant of an inline run, they would be taken for its own history
+        batch_remove_if_exists(os.path.join(work_dir, "output.sx"), os.path.join(work_dir, "energy.dat"))
+        self._max_steps, self._d_energy = SphinxIO.read_scf_parameters(os.path.join(work_dir, "input.sx"))
+        self._targets = np.atleast_1d(np.loadtxt(os.path.join(work_dir, "spin-constraint.sx")))
+        self._output_tail = SfTail(os.path.join(work_dir, "output.sx"))
+        self._energy_tail = SfTail(os.path.join(work_dir, "energy.dat"))
+
+    def follow(self):
+        self.update(self._output_tail.read_new(), self._energy_tail.read_new())
+
+    def poll(self):
+        """Take in what SPHInX wrote since the last call; returns the abort reason or ``None``."""
+        self.follow()
+        return self.check()
+
+    def run(self, sphinx_path, stderr=None):
+        """Run SPHInX to completion or abort; returns the abort reason or ``None``."""
+        self.begin()
+        with open("output.sx", "wb") as output:
+            sub = subprocess.Popen(command_argv(sphinx_path), stdout=output, stderr=stderr, start_new_session=True)
+        try:
+            while sub.poll() is None:
+                time.sleep(self._poll_interval)
+                reason = self.poll()
+                if reason:
+                    os.killpg(sub.pid, signal.SIGKILL)
+                    self._returncode = sub.wait()
+                    return reason
+        except BaseException:
+            if sub.poll() is None:
+                os.killpg(sub.pid, signal.SIGKILL)
+                sub.wait()
+            raise
+        self._returncode = sub.returncode
+        self.follow()
+        return None
+
+    def update(self, output_data: bytes, energy_data: bytes):
+        for match in _STEP_PATTERN.finditer(output_data):
+            self._num_step = int(match.group(1))
+            self._step_energies.append(float(match.group(2)))
+        for line in energy_data.split(b"\n"):
+            columns = line.split()
+            if len(columns) > 4:
+                self._dat_energies.append(float(columns[4]))
+        for match in _SPIN_PATTERN.finditer(output_data):
+            if match.group(1) == b"0":
+                self._spin_block = []
+            self._spin_block.append(float(match.group(2)))
+            if len(self._spin_block) == len(self._targets):
+                self._residuals.append(float(np.max(np.abs(np.array(self._spin_block) - self._targets))))
+
+    def check(self):
+        # energy.dat is the reference for the total energy, the F(n) lines are the fallback
+        energies = np.array(self._dat_energies if self._dat_energies else self._step_energies)
+        if len(energies) < max(self._min_steps, self._window + 1):
+            return None
+
+        diffs = np.diff(energies[-(self._window + 1):])
+        amplitudes = np.abs(diffs)
+        half = len(amplitudes) // 2
+
+        signs = np.sign(diffs)
+        flips = np.count_nonzero(signs[1:] * signs[:-1] < 0)
+        if flips >= self._oscillation_ratio * (len(diffs) - 1) and amplitudes[half:].mean() > self._d_energy \
+                and amplitudes[half:].mean() >= 0.5 * amplitudes[:half].mean():
+            return "SCF energy oscillating with amplitude {:.3e} over the last {} steps".format(
+                amplitudes[half:].mean(), self._window)
+
+        log_amplitudes = np.log(np.maximum(amplitudes, 1e-300))
+        slope = np.polyfit(np.arange(len(log_amplitudes)), log_amplitudes, 1)[0]
+        steps_left = self._max_steps - self._num_step
+        if amplitudes[-1] > self._d_energy:
+            steps_needed = np.inf if slope >= 0 else (np.log(self._d_energy) - log_amplitudes[-1]) / slope
+            if steps_needed > self._convergence_margin * steps_left:
+                return "dEnergy {:.1e} out of reach: about {:.0f} more steps needed, {} left of maxSteps {}".format(
+                    self._d_energy, steps_needed, steps_left, self._max_steps)
+
+        residuals = self._residuals
+        if len(residuals) >= 2 * self._window:
+            recent = min(residuals[-self._window:])
+            before = min(residuals[:-self._window])
+            if recent > self._spin_tolerance and recent > self._stall_ratio * before:
+                return "spin residual stalled at {:.3e} (best before the last {} steps: {:.3e})".format(
+                    recent, self._window, before)
+        return None
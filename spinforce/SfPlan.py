@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+# @File    : SfPlan.py
+# @Time    : 5/7/2021 3:40 PM
+# @Author  : Zavier Cai
+# @Email   : caizefeng18@gmail.com
+import json
+import logging
+import os
+from typing import Dict, List
+
+import numpy as np
+
+
+class SfCostModel:
+    """SPHInX time per variant, predicted from the metrics streams (``metrics.jsonl``) of earlier runs.
+
+    Every variant an earlier run handed to SPHInX contributes its SCF steps and its SPHInX wall time, and
+    the ``structure`` events of the stream give the atom count of its tag. The time per SCF step is fit
+    as ``a * num_atoms ** b``, with ``b`` fixed to ``scaling_exponent`` while only one system size has
+    been seen. A tag run before with the same atom count is predicted from its own mean instead.
+    """
+
+    def __init__(self, scaling_exponent=3.0):
+        self._scaling_exponent = scaling_exponent
+        self._samples = []  # (tag, num_atoms, SCF steps, SPHInX seconds) of every variant run before
+        self._log_coefficient = None
+        self._exponent = scaling_exponent
+        self._logger = None  # type: logging.Logger
+
+    def load(self, history_paths: List[str]):
+        for path in history_paths:
+            if not os.path.exists(path):
+                self._logger.warning("No run history at {}, skipped".format(path))
+                continue
+            num_atoms = {}
+            steps = {}
+            seconds = {}
+            with open(path, "r") as f:
+                for line in f:
+                    try:
+                        event = json.loads(line)
+                    except ValueError:  # last line of a run still in progress
+                        break
+                    if event["event"] == "structure":
+                        num_atoms[event["tag"]] = event["num_atoms"]
+                    elif event["event"] == "counter" and event["name"] == "scf_steps":
+                        steps[(event["tag"], event["variant"])] = event["value"]
+                    elif event["event"] == "span" and event["phase"] == "sphinx":
+                        seconds[(event["tag"], event["variant"])] = event["seconds"]
+            samples = [(tag, num_atoms[tag], steps[(tag, variant)], variant_seconds)
+                       for (tag, variant), variant_seconds in seconds.items()
+                       if tag in num_atoms and steps.get((tag, variant))]
+            self._samples += samples
+            self._logger.info("{} timed SPHInX runs read from {}".format(len(samples), path))
+        self.fit()
+
+    def fit(self):
+        if not self._samples:
+            return
+        log_atoms = np.log([sample[1] for sample in self._samples])
+        log_step_seconds = np.log([sample[3] / sample[2] for sample in self._samples])
+        if len(set(log_atoms.tolist())) > 1:
+            self._exponent = float(np.clip(np.polyfit(log_atoms, log_step_seconds, 1)[0], 1., 4.))
+        self._log_coefficient = float(np.mean(log_step_seconds - self._exponent * log_atoms))
+        self._logger.info("Seconds per SCF step fit as {:.3g} * num_atoms ** {:.2f}".format(
+            np.exp(self._log_coefficient), self._exponent))
+
+    def predict(self, tag, num_atoms, max_steps):
+        """(SCF steps, SPHInX seconds, source) of one variant; seconds are None without any history."""
+        same = [sample for sample in self._samples if sample[0] == tag and sample[1] == num_atoms]
+        if same:
+            return np.mean([sample[2] for sample in same]), np.mean([sample[3] for sample in same]), "tag history"
+        if self._samples:
+            steps = np.mean([sample[2] for sample in self._samples])
+            return steps, steps * np.exp(self._log_coefficient) * num_atoms ** self._exponent, "size fit"
+        return max_steps, None, "maxSteps"
+
+
+class SfPlan:
+    """Per-tag breakdown of what a run would calculate and what it would cost, see ``SfCostModel``.
+
+    ``concurrency`` is None if it is unknown how many variants run at once (e.g. batch jobs), then
+    only core-hours are estimated.
+    """
+
+    def __init__(self, cost_model: SfCostModel, concurrency=1, cores_per_job=1):
+        self._cost_model = cost_model
+        self._concurrency = concurrency
+        self._cores_per_job = cores_per_job
+        self._rows = []
+        self._logger = None  # type: logging.Logger
+
+    def add_tag(self, tag, counts: Dict, max_steps):
+        steps, seconds, source = self._cost_model.predict(tag, counts["num_atoms"], max_steps)
+        num_runs = counts["runs"] - counts["committed"] - counts["cached"]
+        self._rows.append((tag, counts, num_runs, steps, seconds, source))
+
+    def report(self):
+        self._logger.info("Plan of {} SPHInX variants at once, {} cores each:".format(
+            self._concurrency if self._concurrency is not None else "an unknown number of", self._cores_per_job))
+        self._logger.info("{:>6} {:>6} {:>9} {:>9} {:>9} {:>7} {:>8} {:>10} {:>10}  {}".format(
+            "tag", "atoms", "variants", "to run", "committed", "cached", "steps", "s/variant", "core-h", "source"))
+        for tag, counts, num_runs, steps, seconds, source in self._rows:
+            self._logger.info("{:>6} {:>6} {:>9} {:>9} {:>9} {:>7} {:>8.1f} {:>10} {:>10}  {}".format(
+                tag, counts["num_atoms"], counts["variants"], num_runs, counts["committed"], counts["cached"], steps,
+                "{:.1f}".format(seconds) if seconds is not None else "-",
+                "{:.2f}".format(num_runs * seconds * self._cores_per_job / 3600) if seconds is not None else "-",
+                source))
+
+        num_runs = sum(row[2] for row in self._rows)
+        if any(row[4] is None for row in self._rows if row[2]):
+            self._logger.warning("{} SPHInX runs, no timings to estimate their cost from: enable \"metrics\" for a "
+                                 "(pilot) run and list its stream under \"plan\": \"history\"".format(num_runs))
+            return
+        total_seconds = sum(row[2] * row[4] for row in self._rows if row[2])
+        if self._concurrency is None:
+            self._logger.info("{} SPHInX runs: about {:.2f} core-hours, wall time unknown (set \"concurrent_jobs\" "
+                              "of \"batch\" to the number of jobs the scheduler runs at once)".format(
+                                  num_runs, total_seconds * self._cores_per_job / 3600))
+            return
+        # variants of all tags stream through the executor together, so the slots stay busy until the end
+        wall_seconds = max([total_seconds / self._concurrency] + [row[4] for row in self._rows if row[2]])
+        self._logger.info("{} SPHInX runs: about {:.2f} h of wall time and {:.2f} core-hours".format(
+            num_runs, wall_seconds / 3600 if num_runs else 0., total_seconds * self._cores_per_job / 3600))
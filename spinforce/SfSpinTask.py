@@ -4,16 +4,29 @@
 # @Author  : Zavier Cai
 # @Email   : caizefeng18@gmail.com
 
+import copy
 import json
 import logging
 import os
-from typing import Dict
+import shutil
+from typing import Dict, Optional
 
 import numpy as np
 
 from spinforce.DPIO import DPWriter
+from spinforce.SfArchive import SfArchive
+from spinforce.SfCache import SfResultCache
+from spinforce.SfExecutor import SfExecutor
+from spinforce.SfMetrics import SfMetrics
+from spinforce.SfStructure import SfStructure
+from spinforce.SfSurrogate import SfActiveLearner
+from spinforce.SfSymmetry import SfSymmetry, SfSymmetryOperation
+from spinforce.SfVariant import SfVariantJob, SfVariantResult
+from spinforce.SfVariantSpace import SfVariantSpace, SfGridSpace, SfDesignSpace
 from spinforce.SphinxIO import SphinxIO
-from spinforce.helper.ndarray_helper import cartesian_product
+from spinforce.helper.design_helper import DESIGNS, SOBOL_MAX_DIM
+from spinforce.helper.fs_helper import link_or_copy, mkdir_without_override
+from spinforce.helper.ndarray_helper import serpentine_order
 
 
 class SfSpinTask:
@@ -33,12 +46,40 @@ class SfSpinTask:
         self._default_constraint = None
 
         self._changing_atom_indices = []
-        self._changing_spins = []
+        self._variants = None  # type: SfVariantSpace
         self._num_samples = 0
 
+        self._scratch_dir = None
+        self._keep_scratch = False
+        self._executor = None  # type: SfExecutor
+        self._monitor_config = None
+        self._warm_start_config = None
+        self._continuation_config = None
+        self._recovered_steps = []  # continuation steps of every frame recovered by continuing SPHInX
+        self._seeds = []  # (spins, seed directory, variant) of converged variants, oldest first
+        self._cache = None  # type: SfResultCache
+        self._archive = None  # type: SfArchive
+        self._files_digest = None
+
+        self._structure = None  # type: SfStructure
+        self._symmetry = None  # type: SfSymmetry
+        self._time_reversal = False
+        self._learner = None  # type: SfActiveLearner
+        self._metrics = None  # type: SfMetrics
+
         self._dp_writer = None  # type: DPWriter
         self._logger = None  # type: logging.Logger
 
+    def for_tag(self, tag, structure_file, spin_file) -> "SfSpinTask":
+        """A task for one more tag, sharing the settings, writer and executor of this one."""
+        task = copy.copy(self)
+        task._seeds = []
+        task._recovered_steps = []
+        task.tag = tag
+        task.structure_file = structure_file
+        task.spin_file = spin_file
+        return task
+
     @property
     def tag(self):
         return self._tag
@@ -88,18 +129,27 @@ class SfSpinTask:
     def parse_constraint(self):
         indices = []
         samples_list = []
+        bounds = []
+        design = self._constraint.get("design", {})
+        design = design if design.get("enabled", False) else None
         if self._constraint["collinear"]:
             self._logger.info("Using collinear spin calculation and constraints for Tag {}".format(self._tag))
             for constraint in self._constraint["atoms"]:
                 indices.append(constraint["index"])
-                samples_list.append(self.sampling_spin(constraint["sampling"], constraint["bound"]))
+                if design:
+                    bounds.append((constraint["bound"]["low"], constraint["bound"]["high"]))
+                else:
+                    samples_list.append(self.sampling_spin(constraint["sampling"], constraint["bound"]))
         else:
             self._logger.info("Using non-collinear spin calculation and constraints for Tag {}".format(self._tag))
             NotImplemented
 
         self._changing_atom_indices = indices
-        self._changing_spins = cartesian_product(samples_list).T.tolist()
-        self._num_samples = len(self._changing_spins[0])
+        if design:
+            self._variants = self.design_spin(design, np.array(bounds, dtype=float).reshape((-1, 2)))
+        else:
+            self._variants = SfGridSpace(samples_list)
+        self._num_samples = len(self._variants)
         self._logger.info("Indices of spin-varied atoms in this tag: {}\n".format(indices))
 
     def sampling_spin(self, sampling, bound_dict: Dict):
@@ -131,62 +181,389 @@ class SfSpinTask:
             raise RuntimeError
         return spin_samples
 
+    def design_spin(self, design_dict: Dict, bounds: np.ndarray) -> SfDesignSpace:
+        """Joint samples of all spin-varied atoms from a space-filling design of fixed budget."""
+        method = design_dict["method"]
+        budget = design_dict["budget"]
+        seed = design_dict.get("seed")
+        if method not in DESIGNS:
+            self._logger.error("Invalid design method \"{}\"!".format(method))
+            raise RuntimeError
+        if method == "sobol":
+            if len(bounds) > SOBOL_MAX_DIM:
+                self._logger.error("Sobol design supports at most {} spin-varied atoms!".format(SOBOL_MAX_DIM))
+                raise RuntimeError
+            if budget & (budget - 1):
+                self._logger.warning("Sobol budget {} is not a power of 2, the design loses its balance".format(budget))
+
+        self._logger.info("Using {} design of {} variants (seed {}) instead of the Cartesian grid".format(
+            method, budget, seed))
+        return SfDesignSpace(method, budget, seed, bounds)
+
     def run(self):
+        for result in self._executor.execute(self.jobs()):
+            self.collect_variant(result)
+        self.finish()
+
+    def jobs(self):
+        """Prepared jobs of all variants of the tag, set up when the first one is asked for."""
+        with self._metrics.span("setup", self._tag):
+            self.search_constraint_config()
+            self.read_constraint_config()
+            self.parse_constraint()
+
+            # pre-processing
+            if not self._executor.sandboxed:
+                link_or_copy(self._input_file, "input.sx")
+                link_or_copy(self._structure_file, "structure.sx")
+            spin_temp = np.loadtxt(self._spin_file)  # 1D array without x/y components if collinear
+            self.prepare_structure()
+            self.prepare_symmetry(spin_temp)
+            self.prepare_active()
+            self._files_digest = SfResultCache.file_digest(self._input_file, self._structure_file)
+
+        if self._learner is not None:
+            yield from self.active_jobs(spin_temp)
+            return
+        for calc_count in self.variant_order():
+            if self._symmetry is not None and not self._symmetry.is_representative(calc_count):
+                continue  # written from the result of the representative of its orbit
+            job = self.prepare_variant(calc_count, spin_temp)
+            if job is not None:
+                yield job
+
+    def plan(self, committed_keys):
+        """Atoms and variants of the tag, and how many of them a run would hand to SPHInX, without preparing any.
+
+        Variants stand for their orbit under symmetry; those already committed (if resuming) or cached are
+        counted separately.
+        """
         self.search_constraint_config()
         self.read_constraint_config()
         self.parse_constraint()
-
-        # pre-processing
-        os.system("cp {} input.sx".format(self._input_file))
-        os.system("cp {} structure.sx".format(self._structure_file))
-        spin_temp = np.loadtxt(self._spin_file)  # 1D array without x/y components if collinear
+        spin_temp = np.loadtxt(self._spin_file)
+        self._structure = SfStructure.read(self._structure_file)
+        self.prepare_symmetry(spin_temp)
+        self._files_digest = SfResultCache.file_digest(self._input_file, self._structure_file)
+
+        counts = {"num_atoms": self._structure.num_atoms, "variants": self._num_samples, "runs": 0, "committed": 0,
+                  "cached": 0}
+        active_dict = self._constraint.get("active", {})
+        if not committed_keys and self._cache is None or active_dict.get("enabled", False):
+            # no need to look at every variant, or no telling which ones active sampling will pick
+            counts["runs"] = self._symmetry.count_orbits() if self._symmetry is not None else self._num_samples
+            if active_dict.get("enabled", False):
+                counts["runs"] = min(counts["runs"], active_dict.get("budget", 256))
+                self._logger.info("Tag {} is sampled actively, at most {} variants run".format(self._tag,
+                                                                                             counts["runs"]))
+            return counts
         for calc_count in range(self._num_samples):
-            self._logger.info("Calculation begins for Tag {} Variant {}".format(self._tag, calc_count))
-            for atom_idx in self._changing_atom_indices:
-                spin_temp[atom_idx] = self._changing_spins[atom_idx][calc_count]
-            np.savetxt("spin-constraint.sx", spin_temp)
-            os.system("cp spin-constraint.sx spin-initial.sx")
-
-            cell, structure_dict, structure_array = SphinxIO.read_structure()
-            spin_dict, spin_array = SphinxIO.read_spin(structure_dict, self._constraint["collinear"])
-
-            # running SPHInX
-            self._logger.info("All files prepared, running SPHInX ...")
-            os.system("{} > output.sx".format(self._sphinx_path))
-
-            # post-processing
-            final_spin, nu = SphinxIO.read_final_spin_and_nu()
-            if self._constraint["collinear"]:
-                nu_array = SphinxIO.expand_collinear(nu)
-                final_spin_array = SphinxIO.expand_collinear(final_spin)
-            else:
-                nu_array = nu
-                final_spin_array = final_spin
-
-            convergence_reached, steps_over, num_step = SphinxIO.check_convergence()
-            constraint_reached = SphinxIO.check_constraint(spin_array, final_spin_array)  # both are 3N long
-            if (not convergence_reached) and steps_over:
-                self._logger.warning(
-                    "Convergence not yet reached within {} steps in Tag {} Variant {}, this frame won't be written to DP raw files!".format(
-                        num_step, self._tag, calc_count))
-                self._logger.warning("Current spin constraints is {}\n".format(spin_array))
-            if (not constraint_reached) and (not steps_over):
+            if self._symmetry is not None and not self._symmetry.is_representative(calc_count):
+                continue
+            spins = self.variant_spins(calc_count, spin_temp)
+            key = SfResultCache.key(self._files_digest, spins, self._constraint["collinear"])
+            counts["runs"] += 1
+            if self.is_committed(calc_count, spins, key, committed_keys):
+                counts["committed"] += 1
+            elif self._cache is not None and self._cache.contains(key):
+                counts["cached"] += 1
+        return counts
+
+    def finish(self):
+        """Once every result of the tag is collected."""
+        self.report_overhead()
+        if self._recovered_steps:
+            self._logger.info("{} frames of Tag {} recovered by continuing SPHInX, {:.1f} extra SCF steps each".format(
+                len(self._recovered_steps), self._tag, np.mean(self._recovered_steps)))
+        with self._metrics.span("cleanup", self._tag):
+            self.clear_seeds()
+            if self._executor.sandboxed and not self._keep_scratch:
+                shutil.rmtree(os.path.join(self._scratch_dir, str(self._tag)), ignore_errors=True)
+
+    def prepare_structure(self):
+        # structure and atom types are fixed within a tag, variants only differ in their spins
+        self._structure = SfStructure.read(self._structure_file)
+        self._dp_writer.write_type(self._structure.dp_type_array)
+        self._metrics.emit({"event": "structure", "tag": self._tag, "num_atoms": self._structure.num_atoms})
+        self._logger.info("Structure of Tag {}: {} atoms of {}".format(self._tag, self._structure.num_atoms,
+                                                                       self._structure.elements))
+
+    def prepare_symmetry(self, spin_temp):
+        self._symmetry = None
+        symmetry_dict = self._constraint.get("symmetry", {})
+        spatial = symmetry_dict.get("enabled", False)
+        self._time_reversal = self._constraint.get("time_reversal", False)
+        if self._time_reversal and not self._constraint["collinear"]:
+            self._logger.warning("Time-reversal augmentation is only implemented for collinear spins, ignored")
+            self._time_reversal = False
+        if not (spatial or self._time_reversal):
+            return
+        if not isinstance(self._variants, SfGridSpace):
+            if spatial:
+                self._logger.warning("Symmetry reduction needs a grid of spin samples, ignored for Tag {}".format(
+                    self._tag))
+            return
+        self._symmetry = SfSymmetry(self._structure, spin_temp, self._changing_atom_indices, self._variants,
+                                    symmetry_dict.get("tolerance", 1e-3), spatial, self._time_reversal)
+        if self._time_reversal and not self._symmetry.time_reversal:
+            self._logger.info("Flipping all spins leaves the grid of Tag {} (fixed atoms with spin or samples "
+                              "without their negatives), time-reversed frames are written in addition".format(self._tag))
+        self._logger.info("{} symmetry operations for Tag {}, calculating {} of {} variants (one per orbit)".format(
+            self._symmetry.num_operations, self._tag, self._symmetry.count_orbits(), self._num_samples))
+
+    def prepare_active(self):
+        self._learner = None
+        active_dict = self._constraint.get("active", {})
+        if not active_dict.get("enabled", False):
+            return
+        if not self._constraint["collinear"]:
+            self._logger.warning("Active sampling is only implemented for collinear spins, ignored for Tag {}".format(
+                self._tag))
+            return
+        eligible = None
+        if self._symmetry is not None:  # one variant per orbit, as without active sampling
+            eligible = lambda indices: self._symmetry.image_indices(indices).min(axis=0) == indices
+        self._learner = SfActiveLearner(active_dict, self._variants, self._structure.num_atoms, eligible)
+        self._learner._logger = self._logger
+        self._logger.info("Tag {} is sampled actively among its {} variants, at most {}".format(
+            self._tag, self._num_samples, active_dict.get("budget", 256)))
+
+    def active_jobs(self, spin_temp):
+        """Jobs of the batches the surrogate asks for, each chosen once all results of the previous one are in."""
+        while True:
+            batch = self._learner.next_batch()
+            if not batch:
+                return
+            for calc_count in batch:
+                job = self.prepare_variant(calc_count, spin_temp)
+                if job is not None:
+                    yield job
+            yield SfExecutor.BARRIER
+            if self._learner.converged():
+                return
+
+    def varied_nu(self, nu_array):
+        return nu_array.reshape((-1, 3))[self._changing_atom_indices, 2]  # collinear, z component
+
+    def derived_frames(self, calc_count, spins):
+        """(variant, operation, spins, key) of the frames written from the result of ``calc_count`` besides its own.
+
+        These are the other variants of its orbit and, if time reversal does not map the grid onto itself,
+        the time-reversed partners of all of them, which are no variants (``None``).
+        """
+        frames = []
+        if self._symmetry is not None:
+            for image, op in self._symmetry.images(calc_count):
+                frames.append((image, op, self.variant_spins(image, spins.copy())))
+        if self._time_reversal and (self._symmetry is None or not self._symmetry.time_reversal):
+            identity = SfSymmetryOperation.identity(len(spins))
+            frames += [(None, op.reversed(), -frame_spins) for _, op, frame_spins in
+                       [(calc_count, identity, spins)] + frames]
+        return [(variant, op, frame_spins,
+                 SfResultCache.key(self._files_digest, frame_spins, self._constraint["collinear"]))
+                for variant, op, frame_spins in frames]
+
+    def report_overhead(self):
+        prepare_seconds, num_prepared = self._metrics.total("prepare", self._tag)
+        collect_seconds, num_collected = self._metrics.total("collect", self._tag)
+        if num_prepared and num_collected:
+            self._logger.info(
+                "Orchestration overhead per variant for Tag {}: {:.2f} ms preparing, {:.2f} ms collecting".format(
+                    self._tag, prepare_seconds / num_prepared * 1e3, collect_seconds / num_collected * 1e3))
+
+    def variant_order(self, chunk_size=4096):
+        if self._warm_start_config is None or not isinstance(self._variants, SfGridSpace):  # no grid to walk
+            yield from range(self._num_samples)
+            return
+        # walk the grid boustrophedon-style over sorted samples, so consecutive variants are one spin step apart
+        shape = self._variants.shape
+        sort_orders = [np.argsort(samples) for samples in self._variants.samples_list]
+        for start in range(0, self._num_samples, chunk_size):
+            positions = np.arange(start, min(start + chunk_size, self._num_samples))
+            ranks = np.unravel_index(serpentine_order(shape, positions), shape)
+            digits = tuple(order[rank] for order, rank in zip(sort_orders, ranks))
+            yield from np.ravel_multi_index(digits, shape).tolist()
+
+    def variant_spins(self, calc_count, spin_temp):
+        """Put the spins of variant ``calc_count`` into the spin vector of the tag (in place) and return it."""
+        for atom_idx, spin in zip(self._changing_atom_indices, self._variants[calc_count]):
+            spin_temp[atom_idx] = spin
+        return spin_temp
+
+    def prepare_variant(self, calc_count, spin_temp) -> Optional[SfVariantJob]:
+        with self._metrics.span("prepare", self._tag, calc_count):
+            return self._prepare_variant(calc_count, spin_temp)
+
+    def _prepare_variant(self, calc_count, spin_temp) -> Optional[SfVariantJob]:
+        self._logger.info("Calculation begins for Tag {} Variant {}".format(self._tag, calc_count))
+        self.variant_spins(calc_count, spin_temp)
+        job = SfVariantJob(self._tag, calc_count, None, self._sphinx_path, self._constraint["collinear"],
+                           self._monitor_config, spin_temp.copy(), self._structure)
+        job.continuation = self._continuation_config
+        job.key = SfResultCache.key(self._files_digest, spin_temp, self._constraint["collinear"])
+
+        if self.is_committed(calc_count, spin_temp, job.key, self._dp_writer.committed_keys):
+            self._logger.info("Frame already committed to DP files by a previous run, skipping\n")
+            self._metrics.inc("variants", tag=self._tag, variant=calc_count, status="committed")
+            return None
+
+        if self._cache is not None:
+            job.result = self._cache.load(job)
+            if job.result is not None:
+                self._logger.info("Result found in cache, skipping SPHInX")
+                return job
+
+        if not self._executor.sandboxed:
+            job.work_dir = os.getcwd()
+        else:
+            # isolated sandbox so that concurrent variants never share a file
+            job.work_dir = os.path.join(self._scratch_dir, str(self._tag), "{:06d}".format(calc_count))
+            if os.path.exists(job.work_dir):
+                shutil.rmtree(job.work_dir)
+            os.makedirs(job.work_dir)
+            link_or_copy(self._input_file, os.path.join(job.work_dir, "input.sx"))
+            link_or_copy(self._structure_file, os.path.join(job.work_dir, "structure.sx"))
+
+        np.savetxt(os.path.join(job.work_dir, "spin-constraint.sx"), spin_temp)
+        link_or_copy(os.path.join(job.work_dir, "spin-constraint.sx"), os.path.join(job.work_dir, "spin-initial.sx"))
+        if self._warm_start_config is not None:
+            self.seed_variant(job.work_dir, spin_temp)
+
+        self._logger.info("All files prepared, running SPHInX ...")
+        return job
+
+    def is_committed(self, calc_count, spins, key, committed_keys):
+        """Whether the frame of a variant and all frames derived from it are among ``committed_keys``."""
+        return key in committed_keys and (self._symmetry is None and not self._time_reversal or all(
+            frame_key in committed_keys for _, _, _, frame_key in self.derived_frames(calc_count, spins)))
+
+    def seed_variant(self, work_dir, spins):
+        input_path = os.path.join(work_dir, "input.sx")
+        if not self._seeds:
+            link_or_copy(self._input_file, input_path)  # cold start
+            return
+
+        distances = [np.linalg.norm(spins - seed_spins) for seed_spins, _, _ in self._seeds]
+        nearest = int(np.argmin(distances))
+        seed_spins, seed_dir, seed_variant = self._seeds[nearest]
+        for name in os.listdir(seed_dir):  # copied, SPHInX rewrites its density and waves in place
+            shutil.copyfile(os.path.join(seed_dir, name), os.path.join(work_dir, name))
+        waves_file = "waves.sxb" if os.path.exists(os.path.join(seed_dir, "waves.sxb")) else None
+        SphinxIO.write_warm_start_input(self._input_file, input_path, "rho.sxb", waves_file)
+        self._logger.info("Warm start from Variant {} at spin distance {:.4f}".format(seed_variant, distances[nearest]))
+
+    def register_seed(self, result: SfVariantResult):
+        if not os.path.exists(os.path.join(result.work_dir, "rho.sxb")):
+            return
+        seed_dir = os.path.join(self._scratch_dir, "seeds", str(self._tag), "{:06d}".format(result.variant))
+        mkdir_without_override(seed_dir)
+        for name in ("rho.sxb", "waves.sxb"):
+            if os.path.exists(os.path.join(result.work_dir, name)):
+                shutil.copyfile(os.path.join(result.work_dir, name), os.path.join(seed_dir, name))
+        self._seeds.append((result.spins, seed_dir, result.variant))
+        if len(self._seeds) > self._warm_start_config.get("max_seeds", 64):
+            shutil.rmtree(self._seeds.pop(0)[1], ignore_errors=True)
+
+    def write_derived_frames(self, result: SfVariantResult):
+        frames = [frame for frame in self.derived_frames(result.variant, result.spins)
+                  if frame[3] not in self._dp_writer.committed_keys]
+        for variant, op, spins, key in frames:
+            force_array, nu_array = SfSymmetry.transform(op, result.force_array, result.nu_array)
+            with self._metrics.span("write", self._tag, variant):
+                self._dp_writer.write_frame(result.cell, result.structure_array,
+                                            self._structure.expand_spins(spins, self._constraint["collinear"]),
+                                            result.total_energy, force_array, nu_array, key)
+            if self._learner is not None and variant is not None:
+                self._learner.observe(variant, result.total_energy, self.varied_nu(nu_array))
+            self._metrics.inc("derived_frames", tag=self._tag, variant=variant,
+                              time_reversed=str(op.time_reversal).lower())
+        variants = [frame[0] for frame in frames if frame[0] is not None]
+        described = ["equivalent Variants {}".format(variants)] if variants else []
+        if len(frames) > len(variants):
+            described.append("{} time-reversed partners".format(len(frames) - len(variants)))
+        if described:
+            self._logger.info("Frames of {} written from Variant {}".format(" and ".join(described), result.variant))
+
+    def clear_seeds(self):
+        if self._warm_start_config is not None:
+            shutil.rmtree(os.path.join(self._scratch_dir, "seeds", str(self._tag)), ignore_errors=True)
+        self._seeds = []
+
+    def collect_variant(self, result: SfVariantResult):
+        for phase, seconds in result.timings.items():  # measured where the variant ran
+            self._metrics.observe(phase, seconds, self._tag, result.variant)
+        cached = result.work_dir is None
+        self._metrics.inc("variants", tag=self._tag, variant=result.variant,
+                          status="cached" if cached else result.status)
+        if not cached:
+            self._metrics.inc("scf_steps", sum(result.attempt_steps) or result.num_step or 0, tag=self._tag,
+                              variant=result.variant)
+        if result.retries:
+            self._metrics.inc("continuations", result.retries, tag=self._tag, variant=result.variant,
+                              status=result.status)
+            self._metrics.inc("continuation_steps", result.continuation_steps, tag=self._tag,
+                              variant=result.variant, status=result.status)
+        if result.accepted:
+            self._metrics.inc("frames", tag=self._tag, variant=result.variant)
+
+        with self._metrics.span("collect", self._tag, result.variant):
+            self._collect_variant(result)
+
+    def _collect_variant(self, result: SfVariantResult):
+        calc_count = result.variant
+        if result.retries:
+            self._logger.info("Tag {} Variant {} continued {} times from its own density, {} extra SCF steps".format(
+                self._tag, calc_count, result.retries, result.continuation_steps))
+        if result.status == SfVariantResult.STEPS_OVER:
+            self._logger.warning(
+                "Convergence not yet reached within {} steps in Tag {} Variant {}, this frame won't be written to DP raw files!".format(
+                    result.num_step, self._tag, calc_count))
+            self._logger.warning("Current spin constraints is {}\n".format(result.spin_array))
+        elif result.status == SfVariantResult.ABORTED:
+            self._logger.warning(
+                "SPHInX killed after {} steps in Tag {} Variant {}: {}, this frame won't be written to DP raw files!".format(
+                    result.num_step, self._tag, calc_count, result.abort_reason))
+            self._logger.warning("Current spin constraints is {}\n".format(result.spin_array))
+        elif result.status == SfVariantResult.FAILED:
+            if result.num_step:
                 self._logger.warning(
-                    "Incomplete spin constraints within {} steps in Tag {} Variant {}, this frame won't be written to DP raw files!".format(
-                        num_step, self._tag, calc_count))
-                self._logger.warning("Current spin constraints is {}\n".format(spin_array))
+                    "No total energy in energy.dat after {} steps in Tag {} Variant {}, this frame won't be written to DP raw files!".format(
+                        result.num_step, self._tag, calc_count))
             else:
-                force_dict, force_array = SphinxIO.read_force()
-                total_energy = SphinxIO.read_final_energy()
-
-                self._dp_writer.write_box(cell)
-                self._dp_writer.write_coord(structure_array, spin_array)
-                self._dp_writer.write_type(structure_dict)  # should change to one time
-                self._dp_writer.write_energy(total_energy)
-                self._dp_writer.write_force(force_array, nu_array)
-
-                self._logger.info(
-                    "Calculation successfully finished within {} steps for Tag {} Variant {}".format(num_step,
-                                                                                                     self._tag,
-                                                                                                     calc_count))
-                self._logger.info("Current spin constraints is {}\n".format(spin_array))
+                self._logger.warning(
+                    "SPHInX terminated without any SCF step in Tag {} Variant {}, this frame won't be written to DP raw files!".format(
+                        self._tag, calc_count))
+            if result.returncode or result.stderr:
+                self._logger.warning("SPHInX exited with status {}: {}".format(result.returncode, result.stderr))
+            self._logger.warning("Check {} for details\n".format(os.path.join(result.work_dir, "output.sx")))
+        elif result.status == SfVariantResult.CONSTRAINT_FAILED:
+            self._logger.warning(
+                "Incomplete spin constraints within {} steps in Tag {} Variant {}, this frame won't be written to DP raw files!".format(
+                    result.num_step, self._tag, calc_count))
+            self._logger.warning("Current spin constraints is {}\n".format(result.spin_array))
+        else:
+            with self._metrics.span("write", self._tag, calc_count):
+                self._dp_writer.write_frame(result.cell, result.structure_array, result.spin_array,
+                                            result.total_energy, result.force_array, result.nu_array, result.key)
+            if self._learner is not None:
+                self._learner.observe(calc_count, result.total_energy, self.varied_nu(result.nu_array))
+            if self._symmetry is not None or self._time_reversal:
+                self.write_derived_frames(result)
+            if result.retries:
+                self._recovered_steps.append(result.continuation_steps)
+
+            self._logger.info(
+                "Calculation successfully finished within {} steps for Tag {} Variant {}".format(result.num_step,
+                                                                                                 self._tag,
+                                                                                                 calc_count))
+            self._logger.info("Current spin constraints is {}\n".format(result.spin_array))
+            if self._warm_start_config is not None and result.work_dir is not None:
+                self.register_seed(result)
+            if self._cache is not None and result.work_dir is not None:  # freshly computed
+                self._cache.store(result)
+
+        if self._archive is not None and result.work_dir is not None:  # before the next variant overwrites them
+            with self._metrics.span("archive", self._tag, calc_count):
+                self._archive.append(self._tag, calc_count, result.spins, result.key, result.status, result.work_dir)
+        if self._executor.sandboxed and not self._keep_scratch and result.work_dir is not None:
+            shutil.rmtree(result.work_dir, ignore_errors=True)
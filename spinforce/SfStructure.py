@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+# @File    : SfStructure.py
+# @Time    : 4/26/2021 4:35 PM
+# @Author  : Zavier Cai
+# @Email   : caizefeng18@gmail.com
+import numpy as np
+
+from spinforce.SphinxIO import SphinxIO
+
+
+class SfStructure:
+    """Cell, coordinates and atom types of one tag, parsed once and shared by all of its spin variants."""
+
+    def __init__(self, cell, coord_array, type_array, elements):
+        self.cell = cell  # Bohr
+        self.coord_array = coord_array  # (N, 3), Bohr, in the atom order of structure.sx
+        self.type_array = type_array  # species index of each atom
+        self.elements = elements
+        self.structure_dict, self.structure_array = SphinxIO.group_by_type(coord_array, type_array, len(elements))
+        # real atoms followed by their spin pseudo-atoms, see DPWriter.spin2pseudo_coords
+        self.dp_type_array = np.concatenate((type_array, type_array + len(elements)))
+
+    @property
+    def num_atoms(self):
+        return len(self.type_array)
+
+    @staticmethod
+    def read(path="structure.sx") -> "SfStructure":
+        with open(path, "r") as f:
+            content = f.read()
+        cell = SphinxIO.parse_cell(content)
+        return SfStructure(cell, *SphinxIO.tokenize_atomwise(content, "coords", cell))
+
+    def expand_spins(self, spins, collinear=True):
+        """Flat 3N spin vector of the constrained spins, as SphinxIO.read_spin would return it."""
+        if collinear:
+            return SphinxIO.expand_collinear(np.atleast_1d(spins)[:self.num_atoms])
+        NotImplemented
+        return np.zeros(0)
@@ -6,11 +6,23 @@
 import json
 import logging
 import os
+import shutil
 import subprocess
 
+import numpy as np
+
 from spinforce.DPIO import DPWriter
+from spinforce.SfArchive import COMPRESSIONS, SfArchive
+from spinforce.SfCache import SfResultCache
+from spinforce.SfExecutor import SfAsyncExecutor, SfBatchExecutor, SfExecutor, SfInlineExecutor, SfPoolExecutor
 from spinforce.SfLogging import SfLogging
+from spinforce.SfMetrics import SfMetrics
+from spinforce.SfPlan import SfCostModel, SfPlan
 from spinforce.SfSpinTask import SfSpinTask
+from spinforce.SfValidation import SfForceValidator
+from spinforce.SphinxIO import SphinxIO
+from spinforce.helper.fs_helper import batch_remove_matching
+from spinforce.helper.proc_helper import command_argv
 
 
 class SfStructureSpinTask:
@@ -22,9 +34,22 @@ class SfStructureSpinTask:
         self._input_path = None
 
         self._output_dir = None
+        self._dp_file_config = {}
 
         self._sphinx_path = None
 
+        self._executor = SfInlineExecutor()  # type: SfExecutor
+        self._scratch_dir = None
+        self._keep_scratch = False
+        self._monitor_config = None
+        self._warm_start_config = None
+        self._continuation_config = None
+        self._cache = None  # type: SfResultCache
+        self._archive = None  # type: SfArchive
+        self._validation_config = {}
+        self._plan_config = {}
+        self._metrics = SfMetrics()
+
         self._tags = []
         self._default_constraint = None
         self._single_task = SfSpinTask()
@@ -119,9 +144,12 @@ class SfStructureSpinTask:
 
     @sphinx_path.setter
     def sphinx_path(self, value):
-        check_version = "{} --version | grep \"S/PHI/nX\"".format(value)
-        sub = subprocess.Popen(check_version, shell=True, stdout=subprocess.PIPE)
-        if not sub.stdout.read():
+        try:
+            version = subprocess.run(command_argv(value) + ["--version"], stdout=subprocess.PIPE,
+                                     stderr=subprocess.DEVNULL, timeout=60).stdout
+        except (OSError, ValueError, subprocess.TimeoutExpired):
+            version = b""
+        if b"S/PHI/nX" not in version:
             self._logger.error("Invalid SPHInX binary specified!")
             raise RuntimeError
         self._sphinx_path = value
@@ -150,7 +178,7 @@ class SfStructureSpinTask:
         else:
             return value
 
-    def read_config(self, task_config_file):
+    def read_config(self, task_config_file, check_sphinx=True):
         self._logger.info("Loading configuration from file {}".format(os.path.abspath(task_config_file)))
         with open(task_config_file, "r") as f:
             config = json.load(f)
@@ -164,23 +192,101 @@ class SfStructureSpinTask:
             self.input_path = file_system_dict["input_path"]
             self.output_dir = config["dp_file"]["output_dir"]
 
-            self._dp_writer.init(self._output_dir)
+            self._dp_file_config = config["dp_file"]
 
-            self.sphinx_path = config["sphinx_path"]
+            if check_sphinx:
+                self.sphinx_path = config["sphinx_path"]
+            else:  # nothing is run
+                self._sphinx_path = config["sphinx_path"]
 
             if "spin_constraint" in config.keys():
                 self._default_constraint = config["spin_constraint"]
 
+            self.read_execution_config(config.get("execution", {}))
+
+            if config.get("monitor", {}).get("enabled", False):
+                self._monitor_config = config["monitor"]
+                if isinstance(self._executor, SfBatchExecutor):
+                    self._logger.warning("SCF monitoring is not available for batch jobs and will be skipped")
+                    self._monitor_config = None
+                else:
+                    self._logger.info("Hopeless SCF runs will be aborted early: {}".format(self._monitor_config))
+
+            if config.get("warm_start", {}).get("enabled", False):
+                self._warm_start_config = config["warm_start"]
+                self._logger.info("Variants warm-start from the nearest converged spin configuration")
+
+            if config.get("continuation", {}).get("enabled", False):
+                self._continuation_config = config["continuation"]
+                if isinstance(self._executor, SfBatchExecutor):
+                    self._logger.warning("Continuing unconverged SCF runs is not available for batch jobs and will "
+                                         "be skipped")
+                    self._continuation_config = None
+                else:
+                    self._logger.info("Unconverged SCF runs continue from their own density: {}".format(
+                        self._continuation_config))
+
+            self._validation_config = config.get("validation", {})
+            self._plan_config = config.get("plan", {})
+            self._plan_config.setdefault("history", [config.get("metrics", {}).get("jsonl", "metrics.jsonl")])
+            self._metrics = SfMetrics(config.get("metrics"), self._working_dir)
+            self._metrics._logger = self._logging_generator.get_logger("Metrics")
+
+            if config.get("cache", {}).get("enabled", False):
+                cache_dir = self.check_join_wd(config["cache"].get("dir", "cache"))
+                self._cache = SfResultCache(cache_dir)
+                self._logger.info("Converged variants cached at {}".format(cache_dir))
+
+            if config.get("archive", {}).get("enabled", False):
+                archive_dict = config["archive"]
+                compression = archive_dict.get("compression", "gzip")
+                if compression not in COMPRESSIONS:
+                    self._logger.error("Invalid archive compression \"{}\"!".format(compression))
+                    raise RuntimeError
+                self._archive = SfArchive(self.check_join_wd(archive_dict.get("dir", "archive")), compression,
+                                          archive_dict.get("level", 6), archive_dict.get("files", ["*.sx", "*.dat"]))
+                self._archive._logger = self._logging_generator.get_logger("Archive")
+
+    def read_execution_config(self, execution_dict):
+        num_workers = execution_dict.get("num_workers", 1)
+        if num_workers < 1:
+            self._logger.error("\"num_workers\" must be a positive integer!")
+            raise RuntimeError
+        backend = execution_dict.get("backend", "pool" if num_workers > 1 else "inline")
+
+        if backend == "inline":
+            self._executor = SfInlineExecutor()
+        elif backend == "pool":
+            self._executor = SfPoolExecutor(num_workers)
+        elif backend == "async":
+            self._executor = SfAsyncExecutor(execution_dict.get("async", {}))
+        elif backend == "batch":
+            self._executor = SfBatchExecutor(execution_dict.get("batch", {}))
+        else:
+            self._logger.error("Invalid execution backend \"{}\"!".format(backend))
+            raise RuntimeError
+        self._executor._logger = self._logging_generator.get_logger("Executor")
+
+        self._scratch_dir = self.check_join_wd(execution_dict.get("scratch_dir", "scratch"))
+        self._keep_scratch = execution_dict.get("keep_scratch", False)
+        self._logger.info("Execution backend: {}".format(backend))
+        if self._executor.sandboxed:
+            self._logger.info("Variant sandboxes under {}".format(self._scratch_dir))
+
     def run(self, task_config_file):
         self._logger = self._logging_generator.get_logger("TaskTag")
         self._dp_writer._logger = self._logging_generator.get_logger("DPWriter")
         self._single_task._logger = self._logging_generator.get_logger("TaskVariant")
 
         self.read_config(task_config_file)
+        dp_file_dict = self._dp_file_config
+        self._dp_writer.init(self._output_dir, dp_file_dict.get("format", "raw"), dp_file_dict.get("set_size", 5000),
+                             dp_file_dict.get("flush_frames", 50), dp_file_dict.get("flush_seconds", 30.0),
+                             dp_file_dict.get("resume", False))
         self._logger.info("Loading finished\n")
 
         os.chdir(self._working_dir)
-        os.system("rm -f *.dat *.sxb relaxedStr.sx relaxHist.sx forces.sx output.sx")
+        batch_remove_matching("*.dat", "*.sxb", "relaxedStr.sx", "relaxHist.sx", "forces.sx", "output.sx")
 
         self._logger.info("Task begins\n")
         self._single_task._config_dir = self._config_dir
@@ -188,12 +294,117 @@ class SfStructureSpinTask:
         self._single_task._sphinx_path = self._sphinx_path
         self._single_task._default_constraint = self._default_constraint
         self._single_task._dp_writer = self._dp_writer
+        self._single_task._scratch_dir = self._scratch_dir
+        self._single_task._keep_scratch = self._keep_scratch
+        self._single_task._executor = self._executor
+        self._single_task._monitor_config = self._monitor_config
+        self._single_task._warm_start_config = self._warm_start_config
+        self._single_task._continuation_config = self._continuation_config
+        self._single_task._cache = self._cache
+        self._single_task._archive = self._archive
+        self._single_task._metrics = self._metrics
+
+        if (self._executor.sandboxed or self._warm_start_config) and os.path.exists(self._scratch_dir):
+            shutil.rmtree(self._scratch_dir)
+        self._metrics.start()
+        if self._archive is not None:
+            self._archive.open()
+        self._executor.on_idle(self._dp_writer.flush_if_due, self._dp_writer.flush_seconds)
+        self._executor.start()
+        try:
+            self.run_tags()
+        finally:
+            self._executor.shutdown()
+            if self._archive is not None:
+                self._archive.close()
+
+        with self._metrics.span("write"):
+            self._dp_writer.close()
+        self._metrics.summary()
+        self._metrics.close()
+        self._logger.info("Task done")
+
+    def run_tags(self):
+        # one stream of jobs over all tags keeps the executor busy across tag boundaries; results come back
+        # in submission order, so a tag is complete once a result of a later tag shows up
+        tasks = []
+
+        def jobs():
+            for tag, structure_file, spin_file in zip(self._tags, self._structure_paths, self._spin_paths):
+                tasks.append(self._single_task.for_tag(tag, structure_file, spin_file))
+                yield from tasks[-1].jobs()
+
+        for result in self._executor.execute(jobs()):
+            while tasks[0].tag != result.tag:
+                tasks.pop(0).finish()
+            tasks[0].collect_variant(result)
+        for task in tasks:
+            task.finish()
+
+    def validate(self, task_config_file):
+        """Finite-difference check of nu on a sample of the configured variants instead of generating data."""
+        self._logger = self._logging_generator.get_logger("TaskTag")
+        self._single_task._logger = self._logging_generator.get_logger("TaskVariant")
+
+        self.read_config(task_config_file)
+        self._logger.info("Loading finished\n")
+        os.chdir(self._working_dir)
 
+        validator = SfForceValidator(self._validation_config)
+        validator._logger = self._logging_generator.get_logger("Validation")
+        validator._executor = self._executor
+        validator._sphinx_path = self._sphinx_path
+        validator._validation_dir = os.path.join(self._scratch_dir, "validation")
+        validator._keep_scratch = self._keep_scratch
+
+        self._single_task._config_dir = self._config_dir
+        self._single_task._default_constraint = self._default_constraint
         for tag, structure_file, spin_file in zip(self._tags, self._structure_paths, self._spin_paths):
             self._single_task.tag = tag
-            self._single_task.structure_file = structure_file
-            self._single_task.spin_file = spin_file
-            self._single_task.run()
+            self._single_task.search_constraint_config()
+            self._single_task.read_constraint_config()
+            if not self._single_task._constraint["collinear"]:
+                self._logger.warning("Validation of non-collinear spin forces is not implemented, Tag {} skipped"
+                                     .format(tag))
+                continue
+            self._single_task.parse_constraint()
+            spin_temp = np.loadtxt(spin_file)
+            validator.add_samples(tag, self._single_task._num_samples,
+                                  lambda i: self._single_task.variant_spins(i, spin_temp.copy()),
+                                  structure_file, self._input_path)
+
+        self._executor.start()
+        try:
+            validator.run()
+        finally:
+            self._executor.shutdown()
+        validator.report(os.path.join(self._working_dir, "fd_validation.dat"))
+        self._logger.info("Validation done")
+
+    def plan(self, task_config_file):
+        """Count the variants of every tag and estimate the cost of running them, without running SPHInX."""
+        self._logger = self._logging_generator.get_logger("TaskTag")
+        self._single_task._logger = self._logging_generator.get_logger("TaskVariant")
 
-        self._dp_writer.close()
-        self._logger.info("Task done")
+        self.read_config(task_config_file, check_sphinx=False)
+        self._logger.info("Loading finished\n")
+        os.chdir(self._working_dir)
+
+        cost_model = SfCostModel(self._plan_config.get("scaling_exponent", 3.0))
+        cost_model._logger = self._logging_generator.get_logger("Plan")
+        cost_model.load([self.check_join_wd(path) for path in self._plan_config["history"]])
+        concurrency, cores_per_job = self._executor.capacity()
+        plan = SfPlan(cost_model, concurrency, self._plan_config.get("cores_per_job") or cores_per_job)
+        plan._logger = cost_model._logger
+
+        committed_keys = DPWriter.read_committed_keys(self._output_dir) \
+            if self._dp_file_config.get("resume", False) else set()
+        max_steps = SphinxIO.read_scf_parameters(self._input_path)[0]
+        self._single_task._config_dir = self._config_dir
+        self._single_task._input_file = self._input_path
+        self._single_task._default_constraint = self._default_constraint
+        self._single_task._cache = self._cache
+        for tag, structure_file, spin_file in zip(self._tags, self._structure_paths, self._spin_paths):
+            plan.add_tag(tag, self._single_task.for_tag(tag, structure_file, spin_file).plan(committed_keys),
+                         max_steps)
+        plan.report()
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+# @File    : SfSurrogate.py
+# @Time    : 5/8/2021 10:15 AM
+# @Author  : Zavier Cai
+# @Email   : caizefeng18@gmail.com
+import logging
+from typing import Callable, Dict, List
+
+import numpy as np
+
+from spinforce.SfVariantSpace import SfVariantSpace
+
+LENGTH_SCALES = (0.05, 0.1, 0.2, 0.3, 0.5, 0.8, 1.2, 2.0)
+
+
+def _kernel_blocks(a, b, length_scale):
+    """Squared-exponential covariances (unit variance) between values and gradients at ``a`` and ``b``.
+
+    Returns ``cov(f(a), f(b))`` as ``(n_a, n_b)``, ``cov(grad f(a), f(b))`` as ``(n_a, d, n_b)`` and
+    ``cov(grad f(a), grad f(b))`` as ``(n_a, d, n_b, d)``.
+    """
+    diff = (a[:, np.newaxis, :] - b[np.newaxis, :, :]) / length_scale  # (n_a, n_b, d)
+    k = np.exp(-0.5 * np.sum(diff ** 2, axis=2))
+    k_gf = -np.transpose(diff, (0, 2, 1)) / length_scale * k[:, np.newaxis, :]
+    eye = np.eye(a.shape[1])
+    k_gg = (eye[np.newaxis, :, np.newaxis, :] - diff.transpose((0, 2, 1))[:, :, :, np.newaxis] *
+            diff[:, np.newaxis, :, :]) / length_scale ** 2 * k[:, np.newaxis, :, np.newaxis]
+    return k, k_gf, k_gg
+
+
+class SfGradientGP:
+    """Gaussian process of the energy over the varied spins, conditioned on energies and their gradients ``nu``.
+
+    Inputs are expected in the unit cube. The mean is the mean observed energy; the length scale is the one
+    of ``LENGTH_SCALES`` of highest marginal likelihood, the signal variance its closed-form optimum and the
+    noise a ``nugget`` relative to it (SPHInX energies and forces are nearly exact, it only keeps the
+    covariance matrix well-conditioned).
+    """
+
+    def __init__(self, nugget=1e-6, length_scale=0.3):
+        self._nugget = nugget
+        self.length_scale = length_scale
+        self.variance = 1.
+        self._x = np.zeros((0, 0))
+        self._mean = 0.
+        self._chol = None
+        self._alpha = None  # L^-1 of the centered observations
+
+    @property
+    def num_observations(self):
+        return len(self._x)
+
+    def observation_covariance(self, x, length_scale):
+        k, k_gf, k_gg = _kernel_blocks(x, x, length_scale)
+        n, d = x.shape
+        k_gf = k_gf.reshape((n * d, n))
+        cov = np.block([[k, k_gf.T], [k_gf, k_gg.reshape((n * d, n * d))]])
+        cov[np.diag_indices_from(cov)] += self._nugget
+        return cov
+
+    def cross_covariance(self, x_new):
+        """``cov(observations, f(x_new))`` (unit variance), energies first and then gradients atom by atom."""
+        k, k_gf, _ = _kernel_blocks(self._x, x_new, self.length_scale)
+        return np.concatenate((k, k_gf.reshape((-1, len(x_new)))))
+
+    def fit(self, x, energies, gradients):
+        self._x = np.asarray(x, dtype=float)
+        self._mean = float(np.mean(energies))
+        targets = np.concatenate((np.asarray(energies) - self._mean, np.asarray(gradients).reshape(-1)))
+        best = None
+        for length_scale in LENGTH_SCALES:
+            try:
+                chol = np.linalg.cholesky(self.observation_covariance(self._x, length_scale))
+            except np.linalg.LinAlgError:  # too smooth for the data, numerically singular
+                continue
+            alpha = np.linalg.solve(chol, targets)
+            variance = max(float(alpha @ alpha) / len(targets), 1e-300)
+            log_likelihood = -0.5 * len(targets) * np.log(variance) - np.sum(np.log(np.diag(chol)))
+            if best is None or log_likelihood > best[0]:
+                best = (log_likelihood, length_scale, variance, chol, alpha)
+        if best is None:
+            raise np.linalg.LinAlgError("No length scale gives a positive definite covariance")
+        _, self.length_scale, self.variance, self._chol, self._alpha = best
+
+    def whitened(self, x_new):
+        """``L^-1 cov(observations, f(x_new))``, shared by the posterior means and covariances."""
+        if not self.num_observations:
+            return np.zeros((0, len(x_new)))
+        return np.linalg.solve(self._chol, self.cross_covariance(x_new))
+
+    def predict(self, x_new):
+        """Posterior mean energies ``(m,)``, mean gradients ``(m, d)`` and energy variances ``(m,)``."""
+        x_new = np.asarray(x_new, dtype=float)
+        if not self.num_observations:
+            return np.full(len(x_new), self._mean), np.zeros(x_new.shape), np.full(len(x_new), self.variance)
+        whitened = self.whitened(x_new)
+        energies = self._mean + whitened.T @ self._alpha
+        # cov(grad f(x_new), observations) @ C^-1 (observations - mean)
+        k, k_gf, k_gg = _kernel_blocks(x_new, self._x, self.length_scale)
+        m, d = x_new.shape
+        cross = np.concatenate((k_gf, k_gg.reshape((m, d, -1))), axis=2).reshape((m * d, -1))
+        gradients = (cross @ np.linalg.solve(self._chol.T, self._alpha)).reshape((m, d))
+        variances = self.variance * np.maximum(1. - np.sum(whitened ** 2, axis=0), 0.)
+        return energies, gradients, variances
+
+
+class SfActiveLearner:
+    """Chooses the variants of a tag batch by batch where a surrogate of the results so far is least certain.
+
+    The variants of the configured grid or design are the candidates (at most ``max_candidates`` of the
+    untried ones, drawn at random, are scored per batch). After every batch an ``SfGradientGP`` is fit to
+    the energies and ``nu`` of the varied atoms of all converged frames; the next batch is picked greedily by
+    posterior variance, each pick conditioning the variances of the others as if it had been observed, so
+    the batch spreads out. Before a batch runs, its energies and ``nu`` are predicted; sampling stops once
+    those predictions are within ``target_energy_error`` (Hartree per atom) and ``target_nu_error``
+    (Hartree), once ``budget`` variants have been tried, or when no candidate is left.
+    """
+
+    def __init__(self, active_dict: Dict, variants: SfVariantSpace, num_atoms,
+                 eligible: Callable[[np.ndarray], np.ndarray] = None):
+        self._initial = active_dict.get("initial", 8)
+        self._batch_size = active_dict.get("batch", 8)
+        self._budget = active_dict.get("budget", 256)
+        self._target_energy_error = active_dict.get("target_energy_error", 1e-4)
+        self._target_nu_error = active_dict.get("target_nu_error")
+        self._max_candidates = active_dict.get("max_candidates", 4096)
+        self._random = np.random.RandomState(active_dict.get("seed", 0))
+        self._gp = SfGradientGP(active_dict.get("nugget", 1e-6))
+
+        self._variants = variants
+        self._num_atoms = num_atoms
+        self._eligible = eligible  # mask of the variants worth running, e.g. one per symmetry orbit
+        self._low = variants.bounds[:, 0]
+        high = variants.bounds[:, 1]
+        self._span = np.where(high > self._low, high - self._low, 1.)
+
+        self._tried = set()
+        self._observations = {}  # variant -> (energy, nu of the varied atoms)
+        self._predictions = {}  # variant -> (energy, nu) predicted when it was chosen
+        self._num_batches = 0
+        self._logger = None  # type: logging.Logger
+
+    @property
+    def num_tried(self):
+        return len(self._tried)
+
+    def unit(self, spins):
+        return (spins - self._low) / self._span
+
+    def observe(self, variant, energy, nu):
+        self._observations[variant] = (energy, np.asarray(nu, dtype=float))
+
+    def candidates(self) -> np.ndarray:
+        num_variants = len(self._variants)
+        if num_variants <= 4 * self._max_candidates:
+            indices = np.arange(num_variants)
+        else:  # too many to list, score a random draw
+            indices = np.unique(self._random.randint(0, num_variants, 4 * self._max_candidates))
+        indices = indices[[index not in self._tried and index not in self._observations for index in indices.tolist()]]
+        if self._eligible is not None and len(indices):
+            indices = indices[self._eligible(indices)]
+        if len(indices) > self._max_candidates:
+            indices = np.sort(self._random.choice(indices, self._max_candidates, replace=False))
+        return indices
+
+    def fit(self):
+        if not self._observations:
+            return
+        variants = np.array(sorted(self._observations))
+        energies = np.array([self._observations[variant][0] for variant in variants.tolist()])
+        # d E / d u = nu * span in unit-cube coordinates
+        gradients = np.array([self._observations[variant][1] for variant in variants.tolist()]) * self._span
+        self._gp.fit(self.unit(self._variants.take(variants)), energies, gradients)
+        self._logger.info("Surrogate fit to {} frames: length scale {:.2f} (unit cube), energy scale {:.3e} Hartree"
+                          .format(len(variants), self._gp.length_scale, np.sqrt(self._gp.variance)))
+
+    def next_batch(self) -> List[int]:
+        size = min(self._initial if not self._num_batches else self._batch_size, self._budget - self.num_tried)
+        candidates = self.candidates() if size > 0 else np.zeros(0, dtype=int)
+        if not len(candidates):
+            self._logger.info("Active sampling stopped: {}".format(
+                "budget of {} variants spent".format(self._budget) if size <= 0 else "no candidate left"))
+            return []
+
+        self.fit()
+        x = self.unit(self._variants.take(candidates))
+        energies, gradients, variances = self._gp.predict(x)
+        whitened = self._gp.whitened(x)
+        # greedy maximum variance, conditioning on each pick (a pivoted Cholesky of the posterior covariance)
+        chosen = []
+        factors = []
+        for _ in range(min(size, len(candidates))):
+            pick = int(np.argmax(variances))
+            if variances[pick] <= 0:
+                break
+            prior = _kernel_blocks(x, x[pick:pick + 1], self._gp.length_scale)[0][:, 0]
+            column = self._gp.variance * (prior - whitened.T @ whitened[:, pick])
+            for factor in factors:
+                column -= factor * factor[pick]
+            factor = column / np.sqrt(variances[pick])
+            variances = variances - factor ** 2
+            variances[pick] = -np.inf
+            factors.append(factor)
+            chosen.append(pick)
+
+        self._num_batches += 1
+        batch = candidates[chosen].tolist()
+        self._tried.update(batch)
+        if self._gp.num_observations:
+            for pick, variant in zip(chosen, batch):
+                self._predictions[variant] = (energies[pick], gradients[pick] / self._span)
+        self._logger.info("Active sampling batch {}: {} variants, {} tried so far".format(
+            self._num_batches, len(batch), self.num_tried))
+        return batch
+
+    def converged(self) -> bool:
+        """Whether the predictions of the batch just run were good enough to stop."""
+        predicted = [(prediction, self._observations[variant]) for variant, prediction in self._predictions.items()
+                     if variant in self._observations]
+        self._predictions = {}
+        if not predicted:
+            return False
+        energy_error = np.sqrt(np.mean([((p[0] - o[0]) / self._num_atoms) ** 2 for p, o in predicted]))
+        nu_error = np.sqrt(np.mean([np.mean((p[1] - o[1]) ** 2) for p, o in predicted]))
+        self._logger.info("Surrogate predicted the batch with energy RMSE {:.3e} Hartree/atom and nu RMSE {:.3e} "
+                          "Hartree".format(energy_error, nu_error))
+        if energy_error < self._target_energy_error and \
+                (self._target_nu_error is None or nu_error < self._target_nu_error):
+            self._logger.info("Active sampling stopped: target error reached after {} variants".format(
+                self.num_tried))
+            return True
+        return False
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+# @File    : SfSymmetry.py
+# @Time    : 5/6/2021 10:30 AM
+# @Author  : Zavier Cai
+# @Email   : caizefeng18@gmail.com
+import itertools
+from typing import List, Tuple
+
+import numpy as np
+
+from spinforce.SfStructure import SfStructure
+from spinforce.SfVariantSpace import SfGridSpace
+
+
+class SfSymmetryOperation:
+    """``x -> x @ rotation.T + translation`` (Cartesian, Bohr), taking atom ``a`` onto atom ``permutation[a]``,
+    followed by flipping all spins if ``time_reversal``."""
+
+    def __init__(self, rotation, translation, permutation, time_reversal=False):
+        self.rotation = rotation
+        self.translation = translation
+        self.permutation = permutation
+        self.time_reversal = time_reversal
+
+    @staticmethod
+    def identity(num_atoms) -> "SfSymmetryOperation":
+        return SfSymmetryOperation(np.eye(3), np.zeros(3), np.arange(num_atoms))
+
+    def reversed(self) -> "SfSymmetryOperation":
+        """The same operation combined with time reversal."""
+        return SfSymmetryOperation(self.rotation, self.translation, self.permutation, not self.time_reversal)
+
+
+def find_operations(cell, coord_array, colors, tolerance=1e-3) -> List[SfSymmetryOperation]:
+    """Space group operations of a structure whose atoms only map onto atoms of the same color.
+
+    Rotations are found as the maps of the lattice vectors onto lattice vectors of equal lengths and
+    angles (up to twice a cell vector away, enough for reasonably reduced cells); translations by
+    sending one atom of the rarest color onto each atom of that color. Operations are unique by
+    their permutation, the identity first.
+    """
+    cell = np.asarray(cell, dtype=float)  # rows are the lattice vectors
+    inv_cell = np.linalg.inv(cell)
+    colors = np.asarray(colors)
+    frac = coord_array @ inv_cell
+    metric = cell @ cell.T
+
+    lattice_points = np.array(list(itertools.product(range(-2, 3), repeat=3)))
+    lengths = np.linalg.norm(lattice_points @ cell, axis=1)
+    candidates = [lattice_points[np.abs(lengths - np.linalg.norm(a)) < tolerance] for a in cell]
+    # own lattice vector first, so that the identity and the pure translations are found first
+    candidates = [sorted(rows, key=lambda n: np.sum(np.abs(n - np.eye(3, dtype=int)[i])))
+                  for i, rows in enumerate(candidates)]
+
+    rarest = min(set(colors.tolist()), key=lambda color: np.count_nonzero(colors == color))
+    reference = int(np.flatnonzero(colors == rarest)[0])
+    targets = np.flatnonzero(colors == rarest)
+
+    operations = []
+    permutations = set()
+    for rows in itertools.product(*candidates):
+        lattice_map = np.array(rows)  # integer, new lattice vectors in terms of the old ones
+        if abs(abs(np.linalg.det(lattice_map)) - 1) > 1e-6:
+            continue
+        if np.max(np.abs(lattice_map @ metric @ lattice_map.T - metric)) > tolerance * np.max(np.abs(metric)):
+            continue
+        rotation = (inv_cell @ lattice_map @ cell).T
+        rotated = coord_array @ rotation.T
+        for target in targets:
+            translation = coord_array[target] - rotated[reference]
+            diff = (rotated + translation) @ inv_cell
+            diff = diff[:, np.newaxis, :] - frac[np.newaxis, :, :]
+            distances = np.linalg.norm((diff - np.round(diff)) @ cell, axis=2)
+            matches = (distances < tolerance) & (colors[:, np.newaxis] == colors[np.newaxis, :])
+            if not np.all(np.count_nonzero(matches, axis=1) == 1):
+                continue
+            permutation = np.argmax(matches, axis=1)
+            if len(set(permutation.tolist())) != len(permutation) or tuple(permutation) in permutations:
+                continue
+            permutations.add(tuple(permutation))
+            operations.append(SfSymmetryOperation(rotation, translation, permutation))
+    return operations
+
+
+class SfSymmetry:
+    """Orbits of the variants of a grid under the symmetry of a tag, to compute one variant per orbit.
+
+    Atoms are only considered equivalent if they also share their spin in ``spin-initial`` (for atoms
+    kept fixed) or their spin samples (for varied atoms), so every operation maps the grid onto itself
+    by permuting the varied atoms. The variant of lowest index of an orbit represents it; the frames of
+    the others follow from its result by permuting the atoms and rotating the forces. Collinear spins
+    are invariant under the spatial operations, so the spins of an image are simply those of its variant.
+
+    With ``time_reversal``, flipping all spins (same energy and forces, opposite ``nu``) joins the group
+    if it maps the grid onto itself, i.e. all fixed atoms carry no spin and all spin samples come in
+    ``+/-`` pairs; ``time_reversal`` tells whether it did.
+    """
+
+    def __init__(self, structure: SfStructure, spins, changing_atom_indices, variants: SfGridSpace,
+                 tolerance=1e-3, spatial=True, time_reversal=False):
+        self._variants = variants
+        self._changing_atom_indices = np.asarray(changing_atom_indices, dtype=int)
+        labels = [("fixed", int(atom_type), round(float(spin), 6)) for atom_type, spin in
+                  zip(structure.type_array, spins)]
+        for atom_idx, samples in zip(changing_atom_indices, variants.samples_list):
+            labels[atom_idx] = ("varied", int(structure.type_array[atom_idx]), tuple(np.round(samples, 6).tolist()))
+        colors = [sorted(set(labels)).index(label) for label in labels]
+        if spatial:
+            self.operations = find_operations(structure.cell, structure.coord_array, colors, tolerance)
+        else:
+            self.operations = [SfSymmetryOperation.identity(structure.num_atoms)]
+
+        # sample index of -spin for every sample index of every varied atom
+        self._flips = [self.flip_indices(samples) for samples in variants.samples_list]
+        fixed = np.ones(structure.num_atoms, dtype=bool)
+        fixed[self._changing_atom_indices] = False
+        self.time_reversal = time_reversal and all(flips is not None for flips in self._flips) and \
+            np.all(np.abs(np.asarray(spins, dtype=float)[fixed]) < 1e-6)
+        if self.time_reversal:
+            self.operations += [op.reversed() for op in self.operations]
+
+        # position of the image of each varied atom in the list of varied atoms, per operation
+        position = {int(atom_idx): k for k, atom_idx in enumerate(self._changing_atom_indices)}
+        self._varied_maps = np.array([[position[int(op.permutation[atom_idx])] for atom_idx in
+                                       self._changing_atom_indices] for op in self.operations], dtype=int)
+        self._varied_maps = self._varied_maps.reshape((len(self.operations), len(self._changing_atom_indices)))
+
+    @staticmethod
+    def flip_indices(samples):
+        samples = np.asarray(samples, dtype=float)
+        distances = np.abs(samples[:, np.newaxis] + samples[np.newaxis, :])
+        flips = np.argmin(distances, axis=1)
+        if np.any(distances[np.arange(len(samples)), flips] > 1e-6 * max(1., np.max(np.abs(samples)))):
+            return None
+        return flips
+
+    @property
+    def num_operations(self):
+        return len(self.operations)
+
+    def image_indices(self, indices: np.ndarray) -> np.ndarray:
+        """``(num_operations, len(indices))`` grid indices of the images of the given variants."""
+        digits = np.array(np.unravel_index(indices, self._variants.shape)).reshape(
+            (len(self._variants.shape), len(indices)))
+        images = np.empty((self.num_operations, len(indices)), dtype=int)
+        for i, (varied_map, op) in enumerate(zip(self._varied_maps, self.operations)):
+            image_digits = np.empty_like(digits)
+            image_digits[varied_map] = digits
+            if op.time_reversal:
+                image_digits = np.array([flips[row] for flips, row in zip(self._flips, image_digits)]).reshape(
+                    digits.shape)
+            images[i] = np.ravel_multi_index(tuple(image_digits), self._variants.shape)
+        return images
+
+    def is_representative(self, index) -> bool:
+        return int(self.image_indices(np.array([index])).min()) == index
+
+    def count_orbits(self, chunk_size=4096) -> int:
+        num_orbits = 0
+        for start in range(0, len(self._variants), chunk_size):
+            indices = np.arange(start, min(start + chunk_size, len(self._variants)))
+            num_orbits += int(np.count_nonzero(self.image_indices(indices).min(axis=0) == indices))
+        return num_orbits
+
+    def images(self, index) -> List[Tuple[int, SfSymmetryOperation]]:
+        """The other variants of the orbit of ``index``, each with an operation taking ``index`` onto it."""
+        images = {}
+        for image, op in zip(self.image_indices(np.array([index]))[:, 0].tolist(), self.operations):
+            if image != index and image not in images:
+                images[image] = op
+        return sorted(images.items())
+
+    @staticmethod
+    def transform(op: SfSymmetryOperation, force_array, nu_array):
+        """Flat 3N forces and nu of the image of a variant under ``op``."""
+        image_forces = np.empty((len(op.permutation), 3))
+        image_forces[op.permutation] = force_array.reshape((-1, 3)) @ op.rotation.T
+        image_nu = np.empty((len(op.permutation), 3))
+        image_nu[op.permutation] = -nu_array.reshape((-1, 3)) if op.time_reversal else nu_array.reshape((-1, 3))
+        return image_forces.reshape(-1), image_nu.reshape(-1)
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# @File    : SfValidation.py
+# @Time    : 4/29/2021 3:05 PM
+# @Author  : Zavier Cai
+# @Email   : caizefeng18@gmail.com
+import logging
+import os
+import random
+import shutil
+from typing import Dict, List
+
+import numpy as np
+
+from spinforce.SfExecutor import SfExecutor
+from spinforce.SfStructure import SfStructure
+from spinforce.SfVariant import SfVariantJob, SfVariantResult
+from spinforce.SphinxIO import SphinxIO
+from spinforce.helper.fs_helper import link_or_copy
+
+
+class SfValidationSample:
+    """One variant to validate and the atoms whose spin force is checked on it."""
+
+    def __init__(self, tag, variant, spins, atoms, structure_file, structure: SfStructure, input_file):
+        self.tag = tag
+        self.variant = variant
+        self.spins = spins
+        self.atoms = atoms
+        self.structure_file = structure_file
+        self.structure = structure
+        self.input_file = input_file
+
+
+class SfForceValidator:
+    """Checks the Hellmann-Feynman spin forces ``nu`` against central differences of the total energy.
+
+    All base calculations run concurrently first; then every ``spin +/- step`` calculation of every
+    sampled atom is launched at once, each warm-starting from the density of its base run.
+    """
+
+    def __init__(self, validation_dict: Dict):
+        self._num_frames = validation_dict.get("frames", 4)  # per tag
+        self._num_atoms = validation_dict.get("atoms", 2)  # per frame
+        self._step = validation_dict.get("step", 0.01)
+        self._random = random.Random(validation_dict.get("seed", 0))
+
+        self._executor = None  # type: SfExecutor
+        self._sphinx_path = None
+        self._validation_dir = None
+        self._keep_scratch = False
+        self._logger = None  # type: logging.Logger
+
+        self._samples = []  # type: List[SfValidationSample]
+        self._rows = []
+
+    def add_samples(self, tag, num_variants, variant_spins, structure_file, input_file):
+        """Draw variants of a tag; ``variant_spins(i)`` gives the full spin vector of variant ``i``."""
+        structure = SfStructure.read(structure_file)
+        variants = sorted(self._random.sample(range(num_variants), min(self._num_frames, num_variants)))
+        for variant in variants:
+            atoms = sorted(self._random.sample(range(structure.num_atoms), min(self._num_atoms, structure.num_atoms)))
+            self._samples.append(
+                SfValidationSample(tag, variant, variant_spins(variant), atoms, structure_file, structure, input_file))
+        self._logger.info("Tag {}: validating variants {}".format(tag, variants))
+
+    def prepare_job(self, sample: SfValidationSample, name, spins, seed_dir=None) -> SfVariantJob:
+        work_dir = os.path.join(self._validation_dir, str(sample.tag), "{:06d}".format(sample.variant), name)
+        if os.path.exists(work_dir):
+            shutil.rmtree(work_dir)
+        os.makedirs(work_dir)
+        link_or_copy(sample.input_file, os.path.join(work_dir, "input.sx"))
+        link_or_copy(sample.structure_file, os.path.join(work_dir, "structure.sx"))
+        np.savetxt(os.path.join(work_dir, "spin-constraint.sx"), spins)
+        link_or_copy(os.path.join(work_dir, "spin-constraint.sx"), os.path.join(work_dir, "spin-initial.sx"))
+
+        if seed_dir is not None and os.path.exists(os.path.join(seed_dir, "rho.sxb")):
+            shutil.copyfile(os.path.join(seed_dir, "rho.sxb"), os.path.join(work_dir, "rho.sxb"))
+            waves_file = None
+            if os.path.exists(os.path.join(seed_dir, "waves.sxb")):
+                shutil.copyfile(os.path.join(seed_dir, "waves.sxb"), os.path.join(work_dir, "waves.sxb"))
+                waves_file = "waves.sxb"
+            SphinxIO.write_warm_start_input(sample.input_file, os.path.join(work_dir, "input.sx"), "rho.sxb",
+                                            waves_file)
+        return SfVariantJob(sample.tag, sample.variant, work_dir, self._sphinx_path, True, None, spins.copy(),
+                            sample.structure)
+
+    def run(self):
+        base_jobs = [self.prepare_job(sample, "base", sample.spins) for sample in self._samples]
+        self._logger.info("Running {} base calculations".format(len(base_jobs)))
+        base_results = list(self._executor.execute(base_jobs))
+
+        displaced = []  # (sample, base result, atom)
+        for sample, result in zip(self._samples, base_results):
+            if not result.accepted:
+                self._logger.warning("Base calculation of Tag {} Variant {} not usable ({}), skipped".format(
+                    sample.tag, sample.variant, result.status))
+                continue
+            for atom in sample.atoms:
+                displaced.append((sample, result, atom))
+
+        def displaced_jobs():
+            for sample, result, atom in displaced:
+                for sign, name in ((1, "plus"), (-1, "minus")):
+                    spins = sample.spins.copy()
+                    spins[atom] += sign * self._step
+                    yield self.prepare_job(sample, "{}_{}".format(atom, name), spins, result.work_dir)
+
+        self._logger.info("Running {} displaced calculations (step {})".format(2 * len(displaced), self._step))
+        results = self._executor.execute(displaced_jobs())
+        for sample, base_result, atom in displaced:
+            plus, minus = next(results), next(results)
+            self.compare(sample, base_result, atom, plus, minus)
+
+        if not self._keep_scratch:
+            shutil.rmtree(self._validation_dir, ignore_errors=True)
+
+    def compare(self, sample, base_result: SfVariantResult, atom, plus: SfVariantResult, minus: SfVariantResult):
+        if not (plus.accepted and minus.accepted):
+            self._logger.warning("Displaced calculations of Tag {} Variant {} Atom {} not usable ({}/{}), skipped"
+                                 .format(sample.tag, sample.variant, atom, plus.status, minus.status))
+            return
+        nu_hf = base_result.nu_array[3 * atom + 2]  # collinear, z component
+        nu_fd = (plus.total_energy - minus.total_energy) / (2 * self._step)
+        self._rows.append((sample.tag, sample.variant, atom, sample.spins[atom], nu_hf, nu_fd))
+
+    def report(self, report_path=None):
+        self._logger.info("{:>5} {:>8} {:>5} {:>10} {:>16} {:>16} {:>12}".format(
+            "tag", "variant", "atom", "spin", "nu (HF)", "nu (FD)", "abs. error"))
+        for tag, variant, atom, spin, nu_hf, nu_fd in self._rows:
+            self._logger.info("{:>5} {:>8} {:>5} {:>10.4f} {:>16.8e} {:>16.8e} {:>12.3e}".format(
+                tag, variant, atom, spin, nu_hf, nu_fd, abs(nu_hf - nu_fd)))
+
+        num_checks = sum(len(sample.atoms) for sample in self._samples)
+        if not self._rows:
+            self._logger.warning("No spin force could be validated ({} checks failed)".format(num_checks))
+            return
+        nu_hf = np.array([row[4] for row in self._rows])
+        nu_fd = np.array([row[5] for row in self._rows])
+        errors = np.abs(nu_hf - nu_fd)
+        rmse = np.sqrt(np.mean(errors ** 2))
+        self._logger.info("{} of {} spin forces validated: MAE {:.3e}, RMSE {:.3e}, max error {:.3e} Hartree, "
+                          "relative RMSE {:.2%}".format(len(self._rows), num_checks, errors.mean(), rmse,
+                                                       errors.max(), rmse / max(np.sqrt(np.mean(nu_fd ** 2)), 1e-300)))
+        if report_path is not None:
+            np.savetxt(report_path, np.array(self._rows), fmt=["%d", "%d", "%d", "%.8f", "%.12e", "%.12e"],
+                       header="tag variant atom spin nu_HF nu_FD (Hartree)")
+            self._logger.info("Validation table written to {}".format(report_path))
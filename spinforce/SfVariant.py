@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+# @File    : SfVariant.py
+# @Time    : 4/20/2021 2:31 PM
+# @Author  : Zavier Cai
+# @Email   : caizefeng18@gmail.com
+import math
+import os
+import subprocess
+import tempfile
+import time
+
+from spinforce.SfMonitor import SfScfMonitor
+from spinforce.SphinxIO import SphinxIO
+from spinforce.helper.fs_helper import change_dir
+from spinforce.helper.proc_helper import command_argv, read_tail
+
+
+class SfVariantJob:
+    """Everything a worker process needs to run one spin variant in its own directory."""
+
+    def __init__(self, tag, variant, work_dir, sphinx_path, collinear=True, monitor=None, spins=None, structure=None):
+        self.tag = tag
+        self.variant = variant
+        self.work_dir = work_dir
+        self.sphinx_path = sphinx_path
+        self.collinear = collinear
+        self.monitor = monitor  # SfScfMonitor settings, None to run SPHInX unattended
+        self.spins = spins  # content of spin-constraint.sx
+        self.structure = structure  # SfStructure of the tag, read from structure.sx if None
+        self.key = None  # SfResultCache key
+        self.continuation = None  # settings of prepare_continuation, None to discard unconverged variants
+        self.result = None  # set if the outcome is already known (e.g. cached), nothing to run then
+
+
+class SfVariantResult:
+    """Parsed outcome of one spin variant, shipped back from the worker to the writer."""
+
+    CONVERGED = "converged"
+    STEPS_OVER = "steps_over"
+    CONSTRAINT_FAILED = "constraint_failed"
+    FAILED = "failed"
+    ABORTED = "aborted"
+
+    def __init__(self, job: SfVariantJob):
+        self.tag = job.tag
+        self.variant = job.variant
+        self.work_dir = job.work_dir
+        self.spins = job.spins
+        self.key = job.key
+        self.status = None
+        self.num_step = 0
+        self.attempt_steps = []  # SCF steps of every SPHInX run of the variant, continuations last
+        self.abort_reason = None
+        self.returncode = None  # exit status of SPHInX, None if it never started
+        self.stderr = ""  # tail of what SPHInX wrote to stderr
+        self.timings = {}  # seconds per phase spent where the variant ran, see SfMetrics
+
+        self.cell = None
+        self.structure_dict = None
+        self.structure_array = None
+        self.spin_array = None
+        if job.structure is not None:  # known before SPHInX runs
+            self.cell = job.structure.cell
+            self.structure_dict = job.structure.structure_dict
+            self.structure_array = job.structure.structure_array
+            self.spin_array = job.structure.expand_spins(job.spins, job.collinear)
+        self.nu_array = None
+        self.force_array = None
+        self.total_energy = None
+
+    @property
+    def accepted(self):
+        return self.status == self.CONVERGED
+
+    @property
+    def retries(self):
+        return max(len(self.attempt_steps) - 1, 0)
+
+    @property
+    def continuation_steps(self):
+        return sum(self.attempt_steps[1:])
+
+
+def run_variant(job: SfVariantJob) -> SfVariantResult:
+    """Run SPHInX for one prepared variant directory and parse its output, continuing it if unconverged.
+
+    Module-level so that it can be shipped to a process pool.
+    """
+    try:
+        result = run_attempt(job)
+        while prepare_continuation(job, result):
+            result = merge_attempts(result, run_attempt(job))
+    finally:
+        finish_continuation(job)
+    return result
+
+
+def run_attempt(job: SfVariantJob) -> SfVariantResult:
+    start = time.perf_counter()
+    if job.monitor is None:
+        abort_reason = None
+        returncode, stderr = launch_sphinx(job)
+    else:
+        monitor = SfScfMonitor(job.monitor)
+        with change_dir(job.work_dir), tempfile.TemporaryFile() as stderr_file:
+            try:
+                abort_reason = monitor.run(job.sphinx_path, stderr_file)
+                returncode, stderr = monitor.returncode, read_tail(stderr_file)
+            except OSError as error:  # binary gone or not executable
+                abort_reason, returncode, stderr = None, None, str(error)
+    sphinx_seconds = time.perf_counter() - start
+
+    result = aborted_variant(job, monitor, abort_reason) if abort_reason else collect_variant(job)
+    result.timings["sphinx"] = sphinx_seconds
+    result.returncode, result.stderr = returncode, stderr
+    return result
+
+
+def prepare_continuation(job: SfVariantJob, result: SfVariantResult) -> bool:
+    """Rewrite ``input.sx`` of an unconverged variant to restart SPHInX from the density it stopped at.
+
+    Runs out of SCF steps or with the spins off their constraints get up to ``max_retries`` continuations,
+    the k-th with ``maxSteps`` of the original input times ``step_factor ** k`` and, after constraint failures,
+    ``dSpinMoment`` times ``spin_moment_factor ** k``. The original input is kept aside as ``input.first.sx``
+    until ``finish_continuation``. Returns whether to run SPHInX again.
+    """
+    policy = job.continuation
+    if policy is None or result.status not in (SfVariantResult.STEPS_OVER, SfVariantResult.CONSTRAINT_FAILED):
+        return False
+    if result.retries >= policy.get("max_retries", 2) or not os.path.exists(os.path.join(job.work_dir, "rho.sxb")):
+        return False
+
+    input_path = os.path.join(job.work_dir, "input.sx")
+    first_path = os.path.join(job.work_dir, "input.first.sx")
+    if not os.path.exists(first_path):
+        os.replace(input_path, first_path)
+    retry = result.retries + 1
+    max_steps = SphinxIO.read_scf_parameters(first_path)[0]
+    scf_parameters = {"maxSteps": int(math.ceil(max_steps * policy.get("step_factor", 2.0) ** retry))}
+    spin_moment = SphinxIO.read_scf_parameter("dSpinMoment", first_path)
+    if result.status == SfVariantResult.CONSTRAINT_FAILED and spin_moment is not None:
+        scf_parameters["dSpinMoment"] = float(spin_moment) * policy.get("spin_moment_factor", 0.1) ** retry
+    waves_file = "waves.sxb" if os.path.exists(os.path.join(job.work_dir, "waves.sxb")) else None
+    SphinxIO.write_warm_start_input(first_path, input_path, "rho.sxb", waves_file, scf_parameters)
+    return True
+
+
+def merge_attempts(previous: SfVariantResult, result: SfVariantResult) -> SfVariantResult:
+    """The outcome of a continuation, accounting for the steps and time of the runs before it."""
+    result.attempt_steps = previous.attempt_steps + result.attempt_steps
+    for phase, seconds in previous.timings.items():
+        result.timings[phase] = result.timings.get(phase, 0.) + seconds
+    return result
+
+
+def finish_continuation(job: SfVariantJob):
+    first_path = os.path.join(job.work_dir, "input.first.sx")
+    if os.path.exists(first_path):  # the shared working directory must see the original input again
+        os.replace(first_path, os.path.join(job.work_dir, "input.sx"))
+
+
+def aborted_variant(job: SfVariantJob, monitor: SfScfMonitor, abort_reason) -> SfVariantResult:
+    result = SfVariantResult(job)
+    result.status = SfVariantResult.ABORTED
+    result.abort_reason = abort_reason
+    result.num_step = monitor.num_step
+    result.attempt_steps = [result.num_step]
+    if result.spin_array is None:
+        with change_dir(job.work_dir):
+            spin_dict, result.spin_array = SphinxIO.read_spin(SphinxIO.read_structure()[1], job.collinear)
+    return result
+
+
+def launch_sphinx(job: SfVariantJob):
+    """Run SPHInX unattended in the variant directory; returns its exit status and the tail of its stderr."""
+    with open(os.path.join(job.work_dir, "output.sx"), "wb") as output, tempfile.TemporaryFile() as stderr:
+        try:
+            returncode = subprocess.call(command_argv(job.sphinx_path), cwd=job.work_dir, stdout=output,
+                                         stderr=stderr)
+        except OSError as error:  # binary gone or not executable
+            return None, str(error)
+        return returncode, read_tail(stderr)
+
+
+def collect_variant(job: SfVariantJob) -> SfVariantResult:
+    """Parse the files SPHInX left in the variant directory."""
+    start = time.perf_counter()
+    result = parse_variant(job)
+    result.timings["parse"] = time.perf_counter() - start
+    return result
+
+
+def parse_variant(job: SfVariantJob) -> SfVariantResult:
+    result = SfVariantResult(job)
+    with change_dir(job.work_dir):
+        if job.structure is None:
+            result.cell, result.structure_dict, result.structure_array = SphinxIO.read_structure()
+            spin_dict, result.spin_array = SphinxIO.read_spin(result.structure_dict, job.collinear)
+
+        sphinx_result = SphinxIO.read_result()
+        if sphinx_result.num_step is None:  # SPHInX died before its first SCF step
+            result.status = SfVariantResult.FAILED
+            return result
+        result.num_step = sphinx_result.num_step
+        result.attempt_steps = [result.num_step]
+        final_spin, nu = sphinx_result.final_spin, sphinx_result.nu
+
+        if job.collinear:
+            result.nu_array = SphinxIO.expand_collinear(nu)
+            final_spin_array = SphinxIO.expand_collinear(final_spin)
+        else:
+            result.nu_array = nu
+            final_spin_array = final_spin
+
+        if (not sphinx_result.convergence_reached) and sphinx_result.steps_over:
+            result.status = SfVariantResult.STEPS_OVER
+        elif len(final_spin_array) != len(result.spin_array) or \
+                not SphinxIO.check_constraint(result.spin_array, final_spin_array):  # both are 3N long
+            result.status = SfVariantResult.CONSTRAINT_FAILED
+        elif sphinx_result.total_energy is None:  # energy.dat missing or empty, nothing to write as a frame
+            result.status = SfVariantResult.FAILED
+        else:
+            result.status = SfVariantResult.CONVERGED
+            force_dict, result.force_array = SphinxIO.read_force()
+            result.total_energy = sphinx_result.total_energy
+
+    return result
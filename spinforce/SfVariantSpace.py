@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# @File    : SfVariantSpace.py
+# @Time    : 4/28/2021 10:40 AM
+# @Author  : Zavier Cai
+# @Email   : caizefeng18@gmail.com
+from functools import reduce
+from typing import Iterator, List, Tuple
+
+import numpy as np
+
+from spinforce.helper.design_helper import DESIGNS
+
+
+class SfVariantSpace:
+    """Spins of the varied atoms for every variant of a tag, computed on demand from the variant index.
+
+    ``space[i]`` is the spin vector of variant ``i`` (one value per varied atom) and ``len(space)`` the
+    number of variants; nothing proportional to the number of variants is held in memory. ``bounds`` is
+    ``(num_atoms, 2)``, the lowest and highest spin of each varied atom.
+    """
+
+    bounds = None  # type: np.ndarray
+
+    def __len__(self):
+        return self.num_variants
+
+    @property
+    def num_variants(self) -> int:
+        raise NotImplementedError
+
+    @property
+    def num_atoms(self) -> int:
+        raise NotImplementedError
+
+    def __getitem__(self, index) -> np.ndarray:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("Variant {} out of range".format(index))
+        return self.take(np.array([index]))[0]
+
+    def __iter__(self):
+        for _, spins in self.chunks():
+            yield from spins
+
+    def take(self, indices: np.ndarray) -> np.ndarray:
+        """``(len(indices), num_atoms)`` spins of the given variants."""
+        raise NotImplementedError
+
+    def chunks(self, chunk_size=4096) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """Consecutive (indices, spins) blocks of at most ``chunk_size`` variants."""
+        for start in range(0, len(self), chunk_size):
+            indices = np.arange(start, min(start + chunk_size, len(self)))
+            yield indices, self.take(indices)
+
+
+class SfGridSpace(SfVariantSpace):
+    """Cartesian product of per-atom samples, variant ``i`` decoded from ``i`` as a C-order grid index."""
+
+    def __init__(self, samples_list: List[np.ndarray]):
+        self.samples_list = [np.asarray(samples, dtype=float) for samples in samples_list]
+        self.shape = tuple(len(samples) for samples in self.samples_list)
+        self.bounds = np.array([[samples.min(), samples.max()] for samples in self.samples_list]).reshape((-1, 2))
+
+    @property
+    def num_variants(self):
+        return reduce(lambda x, y: x * y, self.shape, 1)
+
+    @property
+    def num_atoms(self):
+        return len(self.shape)
+
+    def take(self, indices):
+        digits = np.unravel_index(indices, self.shape)
+        return np.stack([samples[digit] for samples, digit in zip(self.samples_list, digits)], axis=-1)
+
+
+class SfDesignSpace(SfVariantSpace):
+    """Space-filling design of fixed budget scaled to the per-atom bounds (``bounds`` is ``(num_atoms, 2)``).
+
+    Sobol and Halton points are generated from their index; a Latin hypercube only exists as a whole and
+    is drawn once (it is ``budget`` points, which is small by construction).
+    """
+
+    def __init__(self, method, budget, seed, bounds: np.ndarray):
+        self.method = method
+        self.budget = budget
+        self.seed = seed
+        self.bounds = bounds
+        self._design = DESIGNS[method]
+        self._unit_samples = self._design(budget, len(bounds), seed) if method == "lhs" else None
+
+    @property
+    def num_variants(self):
+        return self.budget
+
+    @property
+    def num_atoms(self):
+        return len(self.bounds)
+
+    def take(self, indices):
+        if self._unit_samples is not None:
+            unit_samples = self._unit_samples[indices]
+        elif len(indices) and np.all(np.diff(indices) == 1):  # contiguous, one call
+            unit_samples = self._design(len(indices), self.num_atoms, self.seed, int(indices[0]))
+        else:
+            unit_samples = np.array([self._design(1, self.num_atoms, self.seed, int(i))[0] for i in indices])
+            unit_samples = unit_samples.reshape((len(indices), self.num_atoms))
+        return self.bounds[:, 0] + unit_samples * (self.bounds[:, 1] - self.bounds[:, 0])
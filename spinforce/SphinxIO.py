@@ -3,32 +3,69 @@
 # @Time    : 3/18/2021 1:24 PM
 # @Author  : Zavier Cai
 # @Email   : caizefeng18@gmail.com
+import os
 import re
-import subprocess as sp
-from typing import Tuple
+from functools import lru_cache
+from typing import List, Tuple
 
 import numpy as np
 
+from spinforce.SphinxOutput import SphinxResult, parse_output
+
+# quoted strings are matched too, so that a "//" inside them (e.g. in a path) is not taken for a comment
+_COMMENT_PATTERN = re.compile(r'("[^"\n]*")|//[^\n]*|/\*.*?\*/', flags=re.DOTALL)
+_CELL_PATTERN = re.compile(r'\bcell\s*=\s*(.*?)\s*;', flags=re.DOTALL)
+
+
+_ELEMENT_PATTERN = re.compile(r'element\s*=\s*"([^"]*)"')
+
+
+def _strip_comments(content):
+    """``content`` without its ``//`` and ``/* */`` comments, quoted strings left as they are."""
+    if "//" not in content and "/*" not in content:
+        return content
+    def replace(match):
+        if match.group(1) is not None:
+            return match.group(1)
+        return "" if match.group(0).startswith("//") else " "  # the line end stays, a block becomes a blank
+
+    return _COMMENT_PATTERN.sub(replace, content)
+
+
+def _group_end(content, start):
+    """Index of the brace closing the first group opened at or after ``start``."""
+    depth = 0
+    end = content.index("{", start)
+    for end in range(end, len(content)):
+        if content[end] == "{":
+            depth += 1
+        elif content[end] == "}":
+            depth -= 1
+            if depth == 0:
+                break
+    return end
+
+
+@lru_cache()
+def _vector_pattern(key, with_tail):
+    # a literal prefix keeps the regex engine on its fast path; the tail is the rest of the atom group
+    return re.compile(re.escape(key) + r'\s*=\s*\[([^\]]*)\]' + (r'([^{}]*)' if with_tail else ''))
+
 
 class SphinxIO:
+    @staticmethod
+    def read_result(output_path="output.sx", energy_path="energy.dat") -> SphinxResult:
+        # one pass over output.sx instead of one grep pipeline per quantity
+        return parse_output(output_path, energy_path)
+
     @staticmethod
     def read_final_energy():
-        get_energy_cmd = 'tail -1 energy.dat | awk \'{print $5}\''
-        sub = sp.Popen(get_energy_cmd, shell=True, stdout=sp.PIPE)
-        total_energy = float(str(sub.stdout.read(), 'utf-8'))
-        sub.kill()
-        return total_energy
+        return SphinxIO.read_result().total_energy
 
     @staticmethod
     def read_final_spin_and_nu():
-        get_spin_cmd = 'grep -A 3 \"nu(0)\" output.sx | tail -4'
-        sub = sp.Popen(get_spin_cmd, shell=True, stdout=sp.PIPE)
-        spin_info = str(sub.stdout.read(), 'utf-8')
-        sub.kill()
-        final_spin_array = np.array(
-            [float(i) for i in re.findall(r'^Spin of atom \d = (.*?)$', spin_info, flags=re.MULTILINE)])
-        nu_array = np.array([float(i) for i in re.findall(r'^nu\(\d*\) = (.*?)$', spin_info, flags=re.MULTILINE)])
-        return final_spin_array, nu_array
+        result = SphinxIO.read_result()
+        return result.final_spin, result.nu
 
     @staticmethod
     def check_constraint(spin_array, final_spin_array):
@@ -36,123 +73,145 @@ class SphinxIO:
 
     @staticmethod
     def check_convergence() -> Tuple[bool, bool, int]:
-        convergence_reached = False
-        steps_over = True
-        get_convergence_cmd = 'grep \"Convergence reached.\" output.sx'
-        sub = sp.Popen(get_convergence_cmd, shell=True, stdout=sp.PIPE)
-        matched_line = str(sub.stdout.read(), 'utf-8')
-        if matched_line:  # not empty
-            convergence_reached = True
-        sub.kill()
-
-        if convergence_reached:
-            get_step_cmd = 'grep -B 1 \"Convergence reached.\" output.sx | head -n 1'
-            sub = sp.Popen(get_step_cmd, shell=True, stdout=sp.PIPE)
-            line = str(sub.stdout.read(), 'utf-8')
-            num_step = int(re.findall(r'F\((\d+)\)=', line)[0])
-            steps_over = False
-            sub.kill()
-        else:
-            get_step_cmd = 'grep -B 2 \"Convergence not yet reached.\" output.sx | head -n 1'
-            sub = sp.Popen(get_step_cmd, shell=True, stdout=sp.PIPE)
-            line = str(sub.stdout.read(), 'utf-8')
-            if line:  # terminated by step limitation
-                num_step = int(re.findall(r'F\((\d+)\)=', line)[0])
-                sub.kill()
-            else:  # terminated from other error
-                sub.kill()
-                get_step_cmd = 'grep \"F(\" output.sx | tail -n 1'
-                sub = sp.Popen(get_step_cmd, shell=True, stdout=sp.PIPE)
-                new_line = str(sub.stdout.read(), 'utf-8')
-                num_step = int(re.findall(r'F\((\d+)\)=', new_line)[0])
-                steps_over = False
-                sub.kill()
-
-        return convergence_reached, steps_over, num_step
-
-    @staticmethod
-    def read_structure():
-        with open("structure.sx", "r") as f:
-            content = f.read()
+        result = SphinxIO.read_result()
+        return result.convergence_reached, result.steps_over, result.num_step
+
+    @staticmethod
+    def read_scf_parameters(input_path="input.sx") -> Tuple[int, float]:
+        # maxSteps and dEnergy of the (first) scfDiag block, with conservative fallbacks if not given
+        with open(input_path, "r") as f:
+            content = _strip_comments(f.read())
+        scf_start = content.find("scfDiag")
+        content = content[scf_start:] if scf_start >= 0 else ""
+        max_steps = re.findall(r'maxSteps\s*=\s*(\d+)\s*;', content)
+        d_energy = re.findall(r'dEnergy\s*=\s*([-+\d.eE]+)\s*;', content)
+        return int(max_steps[0]) if max_steps else 100, float(d_energy[0]) if d_energy else 1e-8
+
+    @staticmethod
+    def read_scf_parameter(key, input_path="input.sx"):
+        """Value of ``key`` in the (first) scfDiag block as written, None if not given."""
+        with open(input_path, "r") as f:
+            content = _strip_comments(f.read())
+        scf_start = content.find("scfDiag")
+        found = re.findall(r'\b' + key + r'\s*=\s*([^;]*?)\s*;', content[scf_start:]) if scf_start >= 0 else []
+        return found[0] if found else None
 
-            # cell parameter
-            cell_parameter = re.findall(r'\s*cell\s*?=\s*?(.*?)\s*;', content, flags=re.DOTALL)[0]  # type: str
-            cell_parameter = re.sub(r'[\[\]\n]', '', cell_parameter)
-            cell = np.fromstring(cell_parameter, dtype=float, sep=',').reshape((3, 3))
+    @staticmethod
+    def write_warm_start_input(template_path, output_path, rho_file="rho.sxb", waves_file=None,
+                               scf_parameters=None):
+        # same input, but SCF starts from a stored density (and wavefunctions) instead of atomic guesses,
+        # optionally with some entries of the scfDiag block replaced
+        with open(template_path, "r") as f:
+            content = _strip_comments(f.read())
+        start = content.find("initialGuess")
+        if start < 0:
+            raise RuntimeError("No initialGuess group in {}".format(template_path))
+        end = _group_end(content, start)
+        waves = 'waves {{ file = "{}"; }}'.format(waves_file) if waves_file else "waves { lcao {} }"
+        initial_guess = 'initialGuess {{\n    {}\n    rho {{ file = "{}"; }}\n}}'.format(waves, rho_file)
+        content = content[:start] + initial_guess + content[end + 1:]
+        if scf_parameters:
+            content = SphinxIO.replace_scf_parameters(content, scf_parameters)
+        # replaced rather than rewritten, output_path may be a hard link to the template
+        with open(output_path + ".tmp", "w") as f:
+            f.write(content)
+        os.replace(output_path + ".tmp", output_path)
 
-            coord_pattern = r'atom\s*{\s*coords\s*=(.*?)\s*;'
-            structure_dict, structure_array = SphinxIO.read_atomwise_info(content, coord_pattern, cell)
+    @staticmethod
+    def replace_scf_parameters(content, scf_parameters):
+        """Set ``key = value;`` entries of the (first) scfDiag block, adding those not given yet."""
+        start = content.find("scfDiag")
+        if start < 0:
+            raise RuntimeError("No scfDiag group in input")
+        end = _group_end(content, start)
+        group = content[start:end]
+        for key, value in scf_parameters.items():
+            entry = "{} = {};".format(key, value)
+            pattern = re.compile(r'\b' + key + r'\s*=[^;]*;')
+            if pattern.search(group):
+                group = pattern.sub(entry, group, count=1)
+            else:
+                brace = group.index("{") + 1
+                group = group[:brace] + "\n        " + entry + group[brace:]
+        return content[:start] + group + content[end:]
 
+    @staticmethod
+    def read_structure(path="structure.sx"):
+        with open(path, "r") as f:
+            content = f.read()
+        cell = SphinxIO.parse_cell(content)
+        coord_array, type_array, elements = SphinxIO.tokenize_atomwise(content, "coords", cell)
+        structure_dict, structure_array = SphinxIO.group_by_type(coord_array, type_array, len(elements))
         return cell, structure_dict, structure_array
 
+    @staticmethod
+    def parse_cell(content):
+        cell_parameter = _CELL_PATTERN.search(content).group(1)  # type: str
+        cell_parameter = re.sub(r'[\[\]\n]', '', cell_parameter)
+        return np.fromstring(cell_parameter, dtype=float, sep=',').reshape((3, 3))
+
+    @staticmethod
+    def tokenize_atomwise(content, key, cell: np.ndarray = None) -> Tuple[np.ndarray, np.ndarray, List[str]]:
+        """Single pass over ``species``/``atom`` groups collecting the ``key = [x, y, z]`` vector of each atom.
+
+        Returns the contiguous ``(N, 3)`` vectors, the species index of each atom and the element names.
+        Vectors of atoms flagged ``relative`` (after the vector, within the atom group) are converted with
+        ``cell`` in one matrix product.
+        """
+        content = _strip_comments(content)
+        with_tail = cell is not None and "relative" in content
+        pattern = _vector_pattern(key, with_tail)
+
+        species = list(_ELEMENT_PATTERN.finditer(content))
+        elements = [match.group(1) for match in species]
+        bounds = [match.end() for match in species] + [len(content)]
+        tokens = []
+        counts = []
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            found = pattern.findall(content, start, end)
+            tokens.extend(found)
+            counts.append(len(found))
+        type_array = np.repeat(np.arange(len(counts)), counts)
+
+        vectors = [token[0] for token in tokens] if with_tail else tokens
+        values = ",".join(vectors).split(",") if vectors else []
+        if len(values) != 3 * len(vectors):
+            raise ValueError("Every \"{}\" entry must be a 3-vector".format(key))
+        entry_array = np.array(values, dtype=float).reshape((-1, 3))
+
+        if with_tail:  # only for atom coordinates occasion
+            is_relative = np.array(["relative" in token[1] for token in tokens], dtype=bool)
+            entry_array[is_relative] = entry_array[is_relative] @ cell
+        return entry_array, type_array, elements
+
+    @staticmethod
+    def group_by_type(entry_array, type_array, num_types):
+        entry_dict = {str(atom_type): entry_array[type_array == atom_type] for atom_type in range(num_types)}
+        return entry_dict, entry_array.reshape(-1)
+
     @staticmethod
     def expand_collinear(entry):
-        entry_array = np.zeros(len(entry) * 3)
-        for i, entry_z in enumerate(entry):
-            entry_array[(i + 1) * 3 - 1] = entry_z
-        return entry_array
+        entry_array = np.zeros((len(entry), 3))
+        entry_array[:, 2] = entry
+        return entry_array.reshape(-1)
 
     @staticmethod
     def read_spin(structure_dict, is_collinear=True):
-        spin_raw = np.loadtxt("spin-constraint.sx")
-        spin_dict = {}
-        spin_list = []
-        idx = 0
-        for atom_type, coords in structure_dict.items():
-            spin_dict[atom_type] = []
-            for _ in range(len(coords)):
-                if is_collinear:
-                    spin = np.array([0., 0., spin_raw[idx]])
-                    spin_dict[atom_type].append(spin)
-                    spin_list.append(spin)
-                    idx += 1
-                else:
-                    NotImplemented
-
-        for atom_type, spins in spin_dict.items():
-            spin_dict[atom_type] = np.array(spins)
-
-        spin_array = np.array(spin_list).reshape(-1)
+        spin_raw = np.atleast_1d(np.loadtxt("spin-constraint.sx"))
+        counts = [len(coords) for coords in structure_dict.values()]
+        if is_collinear:
+            spin_array = SphinxIO.expand_collinear(spin_raw[:sum(counts)])
+        else:
+            NotImplemented
+            spin_array = np.zeros(0)
+
+        spins = np.split(spin_array.reshape((-1, 3)), np.cumsum(counts)[:-1]) if len(spin_array) else []
+        spin_dict = dict(zip(structure_dict.keys(), spins))
         return spin_dict, spin_array
 
     @staticmethod
-    def read_force():
-
-        with open("forces.sx", "r") as f:
+    def read_force(path="forces.sx"):
+        with open(path, "r") as f:
             content = f.read()
-            force_pattern = r'force\s*=(.*?)\s*;'
-            force_dict, force_array = SphinxIO.read_atomwise_info(content, force_pattern)
-
-        return force_dict, force_array
-
-    @staticmethod
-    def read_atomwise_info(content, entry_pattern, cell: np.ndarray = None):
-        lines = content.split('\n')
-        entry_dict = {}
-        entry_list = []
-        current_type = -1
-
-        for line in lines:
-            pure_line = line.strip()
-            if pure_line[0:2] != "//":  # not a comment
-                element = re.findall(r'element\s*=\s*"(.*)"\s*;', pure_line)
-                entry_raw = re.findall(entry_pattern, pure_line)
-                if element:
-                    current_type += 1
-                    entry_dict[str(current_type)] = []
-                elif entry_raw:
-                    entry = np.fromstring(entry_raw[0].strip(' []'), dtype=float, sep=',')
-
-                    # only for atom coordinates occasion
-                    is_relative = ("relative" in pure_line)
-                    if is_relative:
-                        entry = entry @ cell
-
-                    entry_dict[str(current_type)].append(entry)
-                    entry_list.append(entry)
-
-        for atom_type, entry in entry_dict.items():
-            entry_dict[atom_type] = np.array(entry)  # list to ndarray
-
-        entry_array = np.array(entry_list).reshape(-1)
-        return entry_dict, entry_array
+        force_array, type_array, elements = SphinxIO.tokenize_atomwise(content, "force")
+        return SphinxIO.group_by_type(force_array, type_array, len(elements))
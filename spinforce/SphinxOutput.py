@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# @File    : SphinxOutput.py
+# @Time    : 4/22/2021 9:47 AM
+# @Author  : Zavier Cai
+# @Email   : caizefeng18@gmail.com
+import mmap
+import os
+
+import numpy as np
+
+_STEP = b"F("
+_NU = b"nu("
+_NU_FIRST = b"nu(0) ="
+_SPIN = b"Spin of atom "
+_CONVERGENCE = b"Convergence "
+_CONVERGED = b"Convergence reached."
+_NOT_CONVERGED = b"Convergence not yet reached."
+
+
+def starts_with(data, pos, token: bytes):
+    # works on bytes and mmap alike
+    return data[pos:pos + len(token)] == token
+
+
+def rfind_line_start(data, token: bytes, end):
+    """Start of the last line beginning with ``token`` before ``end``, or -1."""
+    pos = data.rfind(b"\n" + token, 0, end)
+    if pos >= 0:
+        return pos + 1
+    if end > 0 and starts_with(data, 0, token):
+        return 0
+    return -1
+
+
+def parse_step(data, pos):
+    """Step number of the ``F(n)=...`` line starting at ``pos``."""
+    return int(data[pos + 2:data.find(b")", pos)])
+
+
+class SphinxResult:
+    """Everything the task needs from one finished (or running) SPHInX calculation."""
+
+    def __init__(self):
+        self.convergence_reached = False
+        self.steps_over = False
+        self.num_step = None  # None if SPHInX never finished an SCF step
+        self.final_spin = np.zeros(0)
+        self.nu = np.zeros(0)
+        self.total_energy = None
+
+
+class SphinxOutputParser:
+    """Single-pass, incremental parser of ``output.sx``.
+
+    Bytes can be fed in arbitrary chunks (e.g. while SPHInX is still writing); only complete lines
+    are consumed. Instead of looking at every line, each chunk is searched backwards for the few
+    markers we need, so a finished file costs a handful of ``rfind`` calls near its end.
+
+    The final spins and nu values are those of the last ``nu(0)`` block. Convergence is taken from
+    the last ``Convergence ...`` message, provided no SCF step follows it, and the step count from
+    the ``F(n)=`` line preceding that message (or the last one if SPHInX terminated otherwise).
+    """
+
+    def __init__(self):
+        self._remainder = b""
+        self._last_step = None
+        self._block_open = False
+        self._nu = []
+        self._spin = []
+        self.result = SphinxResult()
+
+    @property
+    def finished(self):
+        return self.result.convergence_reached or self.result.steps_over
+
+    def feed(self, data: bytes):
+        if self._remainder:
+            data = self._remainder + data
+        end = data.rfind(b"\n") + 1
+        self._remainder = data[end:]
+        if end:
+            self.scan(data, end)
+
+    def close(self) -> SphinxResult:
+        if self._remainder:
+            self.feed(b"\n")
+        result = self.result
+        if not self.finished:
+            result.num_step = self._last_step  # terminated from other error
+        result.final_spin = np.array(self._spin, dtype=float)
+        result.nu = np.array(self._nu, dtype=float)
+        return result
+
+    def scan(self, data, end):
+        """Consume ``data[:end]``, which must consist of complete lines."""
+        start = 0
+        if self._block_open:  # a block may continue across chunks
+            start = self._consume_block(data, 0, end)
+
+        step_pos = rfind_line_start(data, _STEP, end)
+        marker_pos, marker = self._rfind_convergence(data, end)
+        if marker_pos > step_pos:
+            self.result.convergence_reached = marker == _CONVERGED
+            self.result.steps_over = marker == _NOT_CONVERGED
+            self.result.num_step = parse_step(data, step_pos) if step_pos >= 0 else self._last_step
+        elif step_pos >= 0:  # SCF (still) running
+            self.result.convergence_reached = False
+            self.result.steps_over = False
+            self.result.num_step = None
+        if step_pos >= 0:
+            self._last_step = parse_step(data, step_pos)
+
+        block_pos = rfind_line_start(data, _NU_FIRST, end)
+        if block_pos >= start:
+            self._consume_block(data, block_pos, end)
+
+    @staticmethod
+    def _rfind_convergence(data, end):
+        pos = end
+        while True:
+            pos = data.rfind(_CONVERGENCE, 0, pos)
+            if pos < 0:
+                return -1, None
+            for marker in (_CONVERGED, _NOT_CONVERGED):
+                if starts_with(data, pos, marker):
+                    return pos, marker
+
+    def _consume_block(self, data, pos, end):
+        """Read consecutive ``nu(i)``/``Spin of atom i`` lines from ``pos``; return where the block ends."""
+        while pos < end:
+            line_end = data.find(b"\n", pos, end)
+            line = data[pos:line_end]
+            if line.startswith(_NU):
+                if line.startswith(_NU_FIRST):  # a new block starts
+                    self._nu = []
+                    self._spin = []
+                self._nu.append(float(line.split(b"=", 1)[1]))
+            elif line.startswith(_SPIN):
+                self._spin.append(float(line.split(b"=", 1)[1]))
+            else:
+                self._block_open = False
+                return pos
+            pos = line_end + 1
+        self._block_open = True
+        return pos
+
+
+def read_last_line(path, block_size=4096):
+    """Last non-empty line of a file, reading only its tail."""
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        end = f.tell()
+        tail = b""
+        while end > 0:
+            start = max(0, end - block_size)
+            f.seek(start)
+            tail = f.read(end - start) + tail
+            end = start
+            lines = tail.strip().split(b"\n")
+            if len(lines) > 1 or start == 0:
+                return str(lines[-1], 'utf-8')
+    return ""
+
+
+def parse_output(output_path="output.sx", energy_path="energy.dat") -> SphinxResult:
+    """Parse a finished ``output.sx`` and the last line of ``energy.dat``.
+
+    The file is memory-mapped and searched from its end, so only the pages holding the final SCF
+    steps are actually read, however long the log is.
+    """
+    parser = SphinxOutputParser()
+    with open(output_path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                end = data.rfind(b"\n") + 1
+                parser.scan(data, end)
+                if end < size:
+                    parser.feed(data[end:])
+    result = parser.close()
+
+    if os.path.exists(energy_path):
+        columns = read_last_line(energy_path).split()
+        if len(columns) > 4:
+            result.total_energy = float(columns[4])
+    return result
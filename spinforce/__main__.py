@@ -6,15 +6,105 @@
 
 import argparse
 import os
+import sys
 
+from spinforce.SfArchive import SfArchive
+from spinforce.SfDataset import SfDatasetMerger
+from spinforce.SfIngest import SfRunIngester
+from spinforce.SfLogging import SfLogging
 from spinforce.SfStructureSpinTask import SfStructureSpinTask
 from spinforce import __version__
 
+
+def merge(argv):
+    parser = argparse.ArgumentParser(prog="spinforce merge",
+                                     description="Merge DP output directories, drop duplicate frames and split "
+                                                 "off a validation set")
+    parser.add_argument("output_dir", help="merged data, in train/ and validation/ if a validation set is split off")
+    parser.add_argument("source_dirs", nargs='+', help="DP output directories written by spinforce")
+    parser.add_argument("--format", choices=["raw", "npy"], default="raw", help="format of the merged data")
+    parser.add_argument("--validation", type=float, default=0.1, help="fraction of frames (or tags) for validation")
+    parser.add_argument("--split", choices=["random", "tag"], default="random",
+                        help="split frames at random, or whole tags (recognised by their structure)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--set_size", type=int, default=5000, help="frames per set.NNN of the npy format")
+    parser.add_argument("--chunk_size", type=int, default=1024, help="frames read and committed at once")
+    args = parser.parse_args(argv)
+
+    merger = SfDatasetMerger(args.output_dir, args.format, args.validation, args.split, args.seed, args.set_size,
+                             args.chunk_size)
+    merger._logger = SfLogging().get_logger("Dataset")
+    merger.merge(args.source_dirs)
+
+
+def archive(argv):
+    parser = argparse.ArgumentParser(prog="spinforce archive",
+                                     description="List or extract the raw SPHInX outputs archived by spinforce")
+    parser.add_argument("archive_dir", help="\"dir\" of \"archive\" in the configuration of the run")
+    parser.add_argument("--tag", help="only variants of this tag")
+    parser.add_argument("--variant", type=int, help="only this variant")
+    parser.add_argument("--extract", metavar="DEST", help="write the files of the variants to DEST/<tag>/<variant>/")
+    args = parser.parse_args(argv)
+
+    sf_archive = SfArchive(args.archive_dir)
+    sf_archive._logger = SfLogging().get_logger("Archive")
+    sf_archive.load_index()
+    entries = sf_archive.find(args.tag, args.variant)
+    for entry in entries:
+        if args.extract:
+            sf_archive.extract(entry, os.path.join(args.extract, str(entry["tag"]), "{:06d}".format(entry["variant"])))
+        else:
+            print("{:>6} {:>8} {:>12} {:>10}  {}".format(entry["tag"], entry["variant"], entry["status"],
+                                                         sum(entry["files"].values()), " ".join(entry["files"])))
+    if args.extract:
+        sf_archive._logger.info("{} variants extracted to {}".format(len(entries), args.extract))
+
+
+def ingest(argv):
+    parser = argparse.ArgumentParser(prog="spinforce ingest",
+                                     description="Parse finished SPHInX run directories into DP output without "
+                                                 "running SPHInX")
+    parser.add_argument("output_dir", help="DP output directory")
+    parser.add_argument("run_dirs", nargs='+', help="directories searched for runs (structure.sx, "
+                                                    "spin-constraint.sx and output.sx side by side)")
+    parser.add_argument("--format", choices=["raw", "npy"], default="raw", help="format of the DP output")
+    parser.add_argument("--workers", type=int, help="parsing processes, all CPUs by default")
+    parser.add_argument("--resume", action='store_true', help="append to output_dir, skipping runs committed there")
+    parser.add_argument("--set_size", type=int, default=5000, help="frames per set.NNN of the npy format")
+    parser.add_argument("--chunk_size", type=int, default=1024, help="frames committed at once")
+    args = parser.parse_args(argv)
+
+    ingester = SfRunIngester(args.output_dir, args.format, args.workers, args.resume, args.set_size,
+                             args.chunk_size)
+    ingester._logger = SfLogging().get_logger("Ingest")
+    ingester.ingest(args.run_dirs)
+
+
 def main():
+    if sys.argv[1:2] == ["merge"]:
+        merge(sys.argv[2:])
+        return
+    if sys.argv[1:2] == ["archive"]:
+        archive(sys.argv[2:])
+        return
+    if sys.argv[1:2] == ["ingest"]:
+        ingest(sys.argv[2:])
+        return
+
     parser = argparse.ArgumentParser(description="Calculate spin forces based on DFT code SPHInX")
     parser.add_argument("-c", nargs='?', help="Configuration JSON location")
-    parser.add_argument("config",  nargs='?', help="Configuration JSON location")
+    parser.add_argument("config",  nargs='?', help="Configuration JSON location, or `merge` to merge DP outputs "
+                                                   "(see `spinforce merge -h`), `archive` to list or extract "
+                                                   "archived SPHInX outputs (see `spinforce archive -h`) or "
+                                                   "`ingest` to parse existing SPHInX runs (see `spinforce ingest "
+                                                   "-h`)")
     parser.add_argument('-V', '--version', action='version', version='%(prog)s ' + __version__)
+    parser.add_argument("--validate", action='store_true',
+                        help="compare spin forces with finite differences on a sample of variants instead of "
+                             "generating data (see \"validation\" in the configuration)")
+    parser.add_argument("--plan", action='store_true',
+                        help="count the variants of every tag and estimate wall time and core-hours from earlier "
+                             "runs, without running SPHInX (see \"plan\" in the configuration)")
     example_config_path = os.path.join(os.path.dirname(__file__), "configs/spinforce.json")
     parser.add_argument("--example_config", action='store_true', help="view example configuration JSON at {}".format(
         os.path.abspath(example_config_path)))
@@ -25,10 +115,11 @@ def main():
         os.system("{} {}".format(EDITOR, example_config_path))
     else:
         task = SfStructureSpinTask()
+        run = task.plan if args.plan else task.validate if args.validate else task.run
         if args.c:
-            task.run(args.c)
+            run(args.c)
         elif args.config:
-            task.run(args.config)
+            run(args.config)
         else:
             print('No configuration file provided, use `--example_config` to see a example JSON for configuration!')
 
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# @File    : design_helper.py
+# @Time    : 4/27/2021 2:15 PM
+# @Author  : Zavier Cai
+# @Email   : caizefeng18@gmail.com
+"""
+Space-filling designs on the unit hypercube, returned as ``(num_points, dim)`` arrays in [0, 1).
+
+A seed randomises a design while keeping its structure (digital shift for Sobol, digit permutations
+for Halton, jitter and stratum permutations for Latin hypercube); ``seed=None`` gives the plain
+deterministic sequence.
+"""
+from functools import lru_cache
+
+import numpy as np
+
+_SOBOL_BITS = 30
+
+# Joe & Kuo (2008), new-joe-kuo-6.21201: degree s, coefficients a and initial m_1..m_s of dimensions 2, 3, ...
+_SOBOL_DIRECTIONS = (
+    (1, 0, (1,)),
+    (2, 1, (1, 3)),
+    (3, 1, (1, 3, 1)),
+    (3, 2, (1, 1, 1)),
+    (4, 1, (1, 1, 3, 3)),
+    (4, 4, (1, 3, 5, 13)),
+    (5, 2, (1, 1, 5, 5, 17)),
+    (5, 4, (1, 1, 5, 5, 5)),
+    (5, 7, (1, 1, 7, 11, 19)),
+    (5, 11, (1, 1, 5, 1, 1)),
+    (5, 13, (1, 1, 1, 3, 11)),
+    (5, 14, (1, 3, 5, 5, 31)),
+    (6, 1, (1, 3, 3, 9, 7, 49)),
+    (6, 13, (1, 1, 1, 15, 21, 21)),
+    (6, 16, (1, 3, 1, 13, 27, 49)),
+    (6, 19, (1, 1, 1, 15, 7, 5)),
+    (6, 22, (1, 3, 1, 15, 13, 25)),
+    (6, 25, (1, 1, 5, 5, 19, 61)),
+    (7, 1, (1, 3, 7, 11, 23, 15, 103)),
+    (7, 4, (1, 3, 7, 13, 13, 15, 69)),
+)
+
+SOBOL_MAX_DIM = len(_SOBOL_DIRECTIONS) + 1
+
+
+@lru_cache()
+def sobol_directions(dim) -> np.ndarray:
+    """``(dim, _SOBOL_BITS)`` direction integers v_k = m_k * 2^(BITS - k); shared, do not modify."""
+    if dim > SOBOL_MAX_DIM:
+        raise ValueError("Sobol designs are available up to {} dimensions".format(SOBOL_MAX_DIM))
+    directions = np.zeros((dim, _SOBOL_BITS), dtype=np.uint64)
+    for k in range(_SOBOL_BITS):
+        directions[0, k] = 1 << (_SOBOL_BITS - 1 - k)  # first dimension is the van der Corput sequence
+    for d in range(1, dim):
+        s, a, m_init = _SOBOL_DIRECTIONS[d - 1]
+        m = list(m_init)
+        for k in range(s, _SOBOL_BITS):
+            m_k = m[k - s] ^ (m[k - s] << s)
+            for j in range(1, s):
+                if (a >> (s - 1 - j)) & 1:
+                    m_k ^= m[k - j] << j
+            m.append(m_k)
+        for k in range(_SOBOL_BITS):
+            directions[d, k] = m[k] << (_SOBOL_BITS - 1 - k)
+    return directions
+
+
+def sobol(num_points, dim, seed=None, start=0) -> np.ndarray:
+    """Points ``start``... of the Sobol sequence in Gray-code order, digitally shifted if seeded."""
+    directions = sobol_directions(dim)
+    index = np.arange(start, start + num_points, dtype=np.uint64)
+    gray = index ^ (index >> np.uint64(1))
+    points = np.zeros((num_points, dim), dtype=np.uint64)
+    for k in range(_SOBOL_BITS):
+        bit = ((gray >> np.uint64(k)) & np.uint64(1)).astype(bool)
+        points[bit] ^= directions[:, k]
+    if seed is not None:
+        shift = np.random.RandomState(seed).randint(0, 2 ** _SOBOL_BITS, dim).astype(np.uint64)
+        points ^= shift
+    return points.astype(float) / 2 ** _SOBOL_BITS
+
+
+def first_primes(count):
+    primes = []
+    candidate = 2
+    while len(primes) < count:
+        if all(candidate % p for p in primes):
+            primes.append(candidate)
+        candidate += 1
+    return primes
+
+
+def halton(num_points, dim, seed=None, start=0) -> np.ndarray:
+    """Points ``start``... of the Halton sequence; seeded designs permute the non-zero digits of each base."""
+    rng = np.random.RandomState(seed) if seed is not None else None
+    points = np.zeros((num_points, dim))
+    for d, base in enumerate(first_primes(dim)):
+        permutation = np.arange(base)
+        if rng is not None:
+            permutation[1:] = rng.permutation(np.arange(1, base))
+        index = np.arange(start, start + num_points)
+        scale = 1. / base
+        while np.any(index):
+            points[:, d] += permutation[index % base] * scale
+            index //= base
+            scale /= base
+    return points
+
+
+def latin_hypercube(num_points, dim, seed=None) -> np.ndarray:
+    """One point in each of ``num_points`` equal strata along every axis, jittered inside its stratum."""
+    rng = np.random.RandomState(seed)
+    strata = np.array([rng.permutation(num_points) for _ in range(dim)]).T
+    return (strata + rng.uniform(size=(num_points, dim))) / num_points
+
+
+DESIGNS = {"sobol": sobol, "halton": halton, "lhs": latin_hypercube}
@@ -3,7 +3,10 @@
 # @Time    : 3/19/2021 10:18 PM
 # @Author  : Zavier Cai
 # @Email   : caizefeng18@gmail.com
+import glob
 import os
+import shutil
+from contextlib import contextmanager
 
 
 def mkdir_without_override(path):
@@ -15,3 +18,34 @@ def batch_remove_if_exists(*paths):
     for path in paths:
         if os.path.exists(path):
             os.remove(path)
+
+
+def batch_remove_matching(*patterns):
+    for pattern in patterns:
+        for path in glob.glob(pattern):
+            os.remove(path)
+
+
+def link_or_copy(src, dst):
+    """Hard-link ``src`` to ``dst`` (replacing it), copying instead where links fail, e.g. across devices.
+
+    A link shares its content with ``src``, so only use it for files nobody writes in place afterwards.
+    """
+    if os.path.lexists(dst):
+        if os.path.exists(dst) and os.path.samefile(src, dst):
+            return
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+@contextmanager
+def change_dir(path):
+    previous = os.getcwd()
+    os.chdir(path)
+    try:
+        yield path
+    finally:
+        os.chdir(previous)
@@ -8,3 +8,19 @@ import numpy as np
 
 def cartesian_product(arrays) -> np.ndarray:
     return np.stack(np.meshgrid(*arrays, indexing='ij'), -1).reshape(-1, len(arrays))
+
+
+def serpentine_order(shape, positions=None) -> np.ndarray:
+    """Flat (C-order) indices of a grid visited boustrophedon-style, so consecutive points differ in one index by one.
+
+    Only the visits at ``positions`` (all of them by default) are computed, so long walks can be taken in blocks.
+    """
+    if positions is None:
+        positions = np.arange(int(np.prod(shape)))
+    digits = np.array(np.unravel_index(positions, shape)).reshape((len(shape), -1))
+    # a digit runs backwards whenever the digits before it, as already walked, sum to an odd number
+    walked_sum = np.zeros(digits.shape[1], dtype=int)
+    for axis, size in enumerate(shape):
+        digits[axis] = np.where(walked_sum % 2 == 1, size - 1 - digits[axis], digits[axis])
+        walked_sum += digits[axis]
+    return np.ravel_multi_index(tuple(digits), shape)
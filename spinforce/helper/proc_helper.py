@@ -0,0 +1,22 @@
+#!/usr/bin/env python3
+# @File    : proc_helper.py
+# @Time    : 5/4/2021 10:05 AM
+# @Author  : Zavier Cai
+# @Email   : caizefeng18@gmail.com
+import os
+import shlex
+from typing import List
+
+
+def command_argv(command) -> List[str]:
+    """argv of a command given as a list or as a shell-like string, e.g. ``"mpirun -np 4 sphinx"``."""
+    if isinstance(command, str):
+        return shlex.split(command)
+    return list(command)
+
+
+def read_tail(f, limit=4096) -> str:
+    """Last ``limit`` bytes of a binary file object, decoded for logging."""
+    f.seek(0, os.SEEK_END)
+    f.seek(max(0, f.tell() - limit))
+    return f.read().decode(errors="replace").strip()
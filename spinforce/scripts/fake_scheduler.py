@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+# @File    : fake_scheduler.py
+# @Time    : 4/21/2021 4:40 PM
+# @Author  : Zavier Cai
+# @Email   : caizefeng18@gmail.com
+"""
+Local stand-in for a batch scheduler, to exercise the ``batch`` execution backend without a cluster.
+
+    fake_scheduler.py submit job.sh    # runs job.sh in the background, prints "Submitted batch job <id>"
+    fake_scheduler.py status <ids>     # prints those of the comma-separated job ids still running
+
+Matching execution configuration::
+
+    "execution": {
+      "backend": "batch",
+      "batch": {
+        "submit_cmd": "python /<path>/fake_scheduler.py submit",
+        "status_cmd": "python /<path>/fake_scheduler.py status {job_ids}",
+        "poll_interval": 1
+      }
+    }
+"""
+import os
+import subprocess
+import sys
+
+
+def submit(script_path):
+    with open(os.path.join(os.path.dirname(os.path.abspath(script_path)), "job.log"), "w") as log:
+        sub = subprocess.Popen(["sh", script_path], stdout=log, stderr=subprocess.STDOUT,
+                               stdin=subprocess.DEVNULL, start_new_session=True)
+    print("Submitted batch job {}".format(sub.pid))
+
+
+def is_running(pid):
+    try:
+        with open("/proc/{}/stat".format(pid), "r") as f:
+            state = f.read().rsplit(")", 1)[1].split()[0]
+        return state != "Z"
+    except (OSError, IndexError):
+        try:
+            os.kill(pid, 0)
+        except OSError:
+            return False
+        return True
+
+
+def status(job_ids):
+    for job_id in job_ids.split(","):
+        if job_id and is_running(int(job_id)):
+            print(job_id)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3 or sys.argv[1] not in ("submit", "status"):
+        print(__doc__)
+        sys.exit(1)
+    if sys.argv[1] == "submit":
+        submit(sys.argv[2])
+    else:
+        status(sys.argv[2])
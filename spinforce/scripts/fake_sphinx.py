@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# @File    : fake_sphinx.py
+# @Time    : 4/24/2021 10:12 AM
+# @Author  : Zavier Cai
+# @Email   : caizefeng18@gmail.com
+"""
+Stand-in for the SPHInX binary, used for benchmarks and for exercising the
+orchestration without a DFT installation.
+
+It reads ``input.sx``, ``structure.sx`` and ``spin-constraint.sx`` from the current
+directory, writes an SCF log to stdout (redirected to ``output.sx`` by the caller)
+and leaves ``energy.dat``, ``forces.sx``, ``rho.sxb`` and ``waves.sxb`` behind, in
+the same layout the real code produces, for any number of atoms and species. The
+energy is a model Heisenberg Hamiltonian, so ``nu`` is its exact spin derivative.
+Set ``sphinx_path`` of a configuration to ``"python /<path>/fake_sphinx.py"``.
+
+Behaviour is controlled through environment variables:
+
+* ``FAKE_SPHINX_STEPS``      SCF steps needed from scratch (default 30)
+* ``FAKE_SPHINX_DELAY``      seconds slept per SCF step (default 0)
+* ``FAKE_SPHINX_FAIL``       ``none``/``steps``/``constraint``/``oscillate``/``crash``
+* ``FAKE_SPHINX_FAIL_RATE``  fraction of variants hit by ``FAKE_SPHINX_FAIL`` (default 1)
+"""
+import hashlib
+import math
+import os
+import re
+import sys
+import time
+
+import numpy as np
+
+VERSION_LINE = "S/PHI/nX 2.6.1 (fake)"
+
+E0_PER_ATOM = -123.4
+ANISOTROPY_2 = -0.02
+ANISOTROPY_4 = 0.002
+EXCHANGE = 0.005
+
+
+def model_energy(spins):
+    neighbours = np.roll(spins, -1)
+    return (E0_PER_ATOM * len(spins) + np.sum(ANISOTROPY_2 * spins ** 2 + ANISOTROPY_4 * spins ** 4)
+            + EXCHANGE * np.sum(spins * neighbours))
+
+
+def model_nu(spins):
+    return (2 * ANISOTROPY_2 * spins + 4 * ANISOTROPY_4 * spins ** 3
+            + EXCHANGE * (np.roll(spins, -1) + np.roll(spins, 1)))
+
+
+def read_scf_parameters():
+    max_steps, d_energy, warm = 500, 1e-7, False
+    if os.path.exists("input.sx"):
+        with open("input.sx", "r") as f:
+            content = re.sub(r'//.*', '', f.read())
+        scf = re.search(r'scfDiag\s*{(.*)}', content, flags=re.DOTALL)
+        scf = scf.group(1) if scf else content
+        found = re.search(r'maxSteps\s*=\s*(\d+)', scf)
+        max_steps = int(found.group(1)) if found else max_steps
+        found = re.search(r'dEnergy\s*=\s*([-+.\deE]+)', scf)
+        d_energy = float(found.group(1)) if found else d_energy
+        guess = re.search(r'initialGuess\s*{(.*?)}\s*main', content, flags=re.DOTALL)
+        warm = bool(guess and re.search(r'rho\s*{\s*file', guess.group(1)))
+    return max_steps, d_energy, warm
+
+
+def read_atoms():
+    """Element and Cartesian coordinates (Bohr) of every atom of ``structure.sx``, in file order."""
+    with open("structure.sx", "r") as f:
+        content = re.sub(r'//.*', '', f.read())
+    cell = re.search(r'cell\s*=\s*(.*?);', content, flags=re.DOTALL)
+    cell = np.array([float(x) for x in re.sub(r'[\[\]\s]', '', cell.group(1)).split(",")]).reshape((3, 3)) \
+        if cell else np.eye(3)
+    atoms = []
+    pieces = re.split(r'element\s*=\s*"([^"]*)"', content)
+    for element, body in zip(pieces[1::2], pieces[2::2]):
+        for coords, rest in re.findall(r'coords\s*=\s*\[([^\]]*)\]([^{}]*)', body):
+            coord = np.array([float(x) for x in coords.split(",")])
+            atoms.append((element, coord @ cell if "relative" in rest else coord))
+    return atoms
+
+
+def main():
+    if "--version" in sys.argv[1:]:
+        print(VERSION_LINE)
+        return 0
+
+    steps_scratch = int(os.environ.get("FAKE_SPHINX_STEPS", 30))
+    delay = float(os.environ.get("FAKE_SPHINX_DELAY", 0))
+    fail = os.environ.get("FAKE_SPHINX_FAIL", "none")
+    fail_rate = float(os.environ.get("FAKE_SPHINX_FAIL_RATE", 1))
+
+    max_steps, d_energy, warm = read_scf_parameters()
+    atoms = read_atoms()
+    spins = np.atleast_1d(np.loadtxt("spin-constraint.sx"))
+    if len(spins) != len(atoms):
+        print("ERROR: {} spins for {} atoms".format(len(spins), len(atoms)))
+        return 1
+
+    digest = hashlib.sha1(spins.tobytes()).digest()
+    if fail != "none" and digest[0] / 255 >= fail_rate:
+        fail = "none"
+
+    # warm start: the distance to the stored spins decides how much work is left
+    steps_needed = steps_scratch
+    if warm and os.path.exists("rho.sxb"):
+        previous = np.atleast_1d(np.loadtxt("rho.sxb"))
+        if len(previous) == len(spins):
+            distance = float(np.max(np.abs(previous - spins)))
+            steps_needed = max(3, int(math.ceil(steps_scratch * min(1.0, distance / 2.0))))
+    if fail in ("steps", "oscillate"):
+        steps_needed = max_steps + 1
+
+    energy = model_energy(spins)
+    nu = model_nu(spins)
+    final_spins = spins + (0.1 if fail == "constraint" else 0.0)
+    rate = math.log(1.0 / d_energy) / steps_needed
+
+    print("+" + "-" * 77)
+    print("| {}".format(VERSION_LINE))
+    print("+" + "-" * 77)
+    sys.stdout.flush()
+
+    energy_lines = []
+    num_steps = min(steps_needed, max_steps)
+    for step in range(1, num_steps + 1):
+        if delay:
+            time.sleep(delay)
+        if fail == "crash" and step > num_steps // 2:
+            print("SxSymMatrix: matrix not positive definite")
+            sys.stdout.flush()
+            return 1
+        decay = math.exp(-rate * step)
+        if fail == "oscillate":
+            decay = 0.05 * (-1) ** step
+        step_energy = energy + decay
+        sys.stdout.write("".join("nu({0}) = {1:.12f}\nSpin of atom {0} = {2:.12f}\n".format(
+            i, nu_i * (1 + decay), spin_i + 0.5 * decay) for i, (nu_i, spin_i) in enumerate(zip(nu, final_spins))))
+        print("F({})={:.12f}, eBand={:.8f}, dEnergy={:.3e}".format(step, step_energy, step_energy / 3, abs(decay)))
+        energy_lines.append("{} {:.3f} {:.12f} {:.12f} {:.12f}".format(
+            step, step * delay, step_energy, step_energy + 1e-4, step_energy + 5e-5))
+        sys.stdout.flush()
+
+    if steps_needed <= max_steps:
+        print("Convergence reached.")
+    else:
+        print("WARNING: maximum number of steps ({}) exceeded".format(max_steps))
+        print("Convergence not yet reached.")
+    sys.stdout.flush()
+
+    with open("energy.dat", "w") as f:
+        f.write("\n".join(energy_lines) + "\n")
+    np.savetxt("rho.sxb", final_spins)
+    np.savetxt("waves.sxb", final_spins)
+    with open("forces.sx", "w") as f:
+        f.write("structure  {\n   movable;\n")
+        current_element = None
+        for i, (element, coord) in enumerate(atoms):
+            if element != current_element:  # same species blocks as structure.sx
+                if current_element is not None:
+                    f.write("   }\n")
+                f.write("   species  {{\n      element=\"{}\";\n".format(element))
+                current_element = element
+            force = 1e-3 * (spins[(i + 1) % len(spins)] - spins[i - 1]) * np.array([1.0, -0.5, 0.25])
+            f.write("      atom {{coords = [{:.10f},{:.10f},{:.10f}]; label = \"A{}\";\n".format(*coord, i))
+            f.write("            force  = [{:.10f},{:.10f},{:.10f}]; }}\n".format(*force))
+        if current_element is not None:
+            f.write("   }\n")
+        f.write("}\n")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# @File    : test_archive.py
+# @Time    : 5/12/2021 3:10 PM
+# @Author  : Zavier Cai
+# @Email   : caizefeng18@gmail.com
+import logging
+import os
+import subprocess
+
+import pytest
+
+from spinforce.SfArchive import SfArchive
+
+
+def new_archive(archive_dir, compression="gzip"):
+    archive = SfArchive(str(archive_dir), compression)
+    archive._logger = logging.getLogger("test")
+    return archive
+
+
+def variant_dir(tmp_path, variant):
+    work_dir = tmp_path / "work{}".format(variant)
+    work_dir.mkdir()
+    (work_dir / "output.sx").write_text("F(1)=-1.{}\nConvergence reached.\n".format(variant))
+    (work_dir / "energy.dat").write_text("1 0.1 -1.0 -1.0 -1.{}\n".format(variant))
+    (work_dir / "rho.sxb").write_bytes(b"\0" * 100)  # not matched by the default patterns
+    return str(work_dir)
+
+
+def fill(archive, tmp_path, variants):
+    archive.open()
+    for variant in variants:
+        archive.append("1", variant, [float(variant), -1.], "key{}".format(variant), "converged",
+                       variant_dir(tmp_path, variant))
+    archive.close()
+
+
+@pytest.mark.parametrize("compression", ["gzip", "xz"])
+def test_read_back_single_variant(tmp_path, compression):
+    archive = new_archive(tmp_path / "archive", compression)
+    fill(archive, tmp_path, range(3))
+
+    reopened = new_archive(tmp_path / "archive", compression)
+    reopened.load_index()
+    entry, = reopened.find(tag=1, spins=[1., -1.])
+    assert entry["variant"] == 1 and entry["files"] == {"energy.dat": 21, "output.sx": 31}
+    assert reopened.read(entry) == {"energy.dat": b"1 0.1 -1.0 -1.0 -1.1\n",
+                                    "output.sx": b"F(1)=-1.1\nConvergence reached.\n"}
+    reopened.extract(entry, str(tmp_path / "extracted"))
+    assert sorted(os.listdir(str(tmp_path / "extracted"))) == ["energy.dat", "output.sx"]
+
+
+def test_standard_tar_reads_all_members(tmp_path):
+    fill(new_archive(tmp_path / "archive"), tmp_path, range(3))
+    names = subprocess.run(["tar", "-tzif", str(tmp_path / "archive" / "outputs.tar.gz")], stdout=subprocess.PIPE,
+                           universal_newlines=True, check=True).stdout.split()
+    assert sorted(names) == ["1/{:06d}/{}".format(variant, name) for variant in range(3)
+                             for name in ("energy.dat", "output.sx")]
+
+
+def test_torn_append_is_cut_off(tmp_path):
+    archive_dir = tmp_path / "archive"
+    fill(new_archive(archive_dir), tmp_path, range(2))
+    sizes = [os.path.getsize(str(archive_dir / name)) for name in ("outputs.tar.gz", "outputs.index")]
+    with open(str(archive_dir / "outputs.tar.gz"), "ab") as f:
+        f.write(b"\x1f\x8b half a member")
+    with open(str(archive_dir / "outputs.index"), "ab") as f:
+        f.write(b'{"tag": "1", "vari')
+
+    archive = new_archive(archive_dir)
+    archive.open()
+    archive.close()
+    assert [os.path.getsize(str(archive_dir / name)) for name in ("outputs.tar.gz", "outputs.index")] == sizes
+    fill(archive, tmp_path, [2])
+    assert [entry["variant"] for entry in archive.entries] == [0, 1, 2]
+    assert archive.read(archive.find(variant=2)[0])["output.sx"].startswith(b"F(1)=-1.2")
+
+
+def test_compression_mismatch(tmp_path):
+    fill(new_archive(tmp_path / "archive"), tmp_path, [0])
+    with pytest.raises(RuntimeError):
+        new_archive(tmp_path / "archive", "xz").open()
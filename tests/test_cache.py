@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# @File    : test_cache.py
+# @Time    : 5/12/2021 7:40 PM
+# @Author  : Zavier Cai
+# @Email   : caizefeng18@gmail.com
+import os
+
+import numpy as np
+
+from spinforce.SfCache import SfResultCache
+from spinforce.SfVariant import SfVariantJob, SfVariantResult
+
+
+def write(path, content):
+    with open(str(path), "w") as f:
+        f.write(content)
+    return str(path)
+
+
+def files_digest(tmp_path, input_content="input", structure_content="structure", name="a"):
+    os.makedirs(str(tmp_path / name), exist_ok=True)
+    return SfResultCache.file_digest(write(tmp_path / name / "input.sx", input_content),
+                                     write(tmp_path / name / "structure.sx", structure_content))
+
+
+def test_key_depends_on_every_input(tmp_path):
+    digest = files_digest(tmp_path)
+    key = SfResultCache.key(digest, [2.0, -2.0], True)
+    assert len({key,
+                SfResultCache.key(files_digest(tmp_path, input_content="input 2"), [2.0, -2.0], True),
+                SfResultCache.key(files_digest(tmp_path, structure_content="structure 2"), [2.0, -2.0], True),
+                SfResultCache.key(digest, [2.0, -2.1], True),
+                SfResultCache.key(digest, [-2.0, 2.0], True),
+                SfResultCache.key(digest, [2.0, -2.0], False)}) == 6
+
+
+def test_key_ignores_paths_and_spin_types(tmp_path):
+    key = SfResultCache.key(files_digest(tmp_path, name="a"), [2.0, -2.0], True)
+    assert SfResultCache.key(files_digest(tmp_path, name="b"), np.array([2, -2]), True) == key
+    # the input and the structure file do not stand in for each other
+    assert files_digest(tmp_path, "structure", "input") != files_digest(tmp_path)
+
+
+def test_store_and_load(tmp_path):
+    job = SfVariantJob(1, 3, str(tmp_path), "sphinx", spins=np.array([2.0, -2.0]))
+    job.key = SfResultCache.key(files_digest(tmp_path), job.spins, True)
+    result = SfVariantResult(job)
+    result.status = SfVariantResult.CONVERGED
+    result.num_step = 17
+    result.cell = np.eye(3) * 5.35
+    result.structure_dict = {"0": np.zeros((1, 3)), "1": np.full((2, 3), 0.5)}
+    result.structure_array = np.concatenate(list(result.structure_dict.values()))
+    result.spin_array = np.array([[0., 0., 2.], [0., 0., -2.], [0., 0., 0.]])
+    result.nu_array = np.full((3, 3), 0.1)
+    result.force_array = np.full((3, 3), -0.2)
+    result.total_energy = -123.4
+
+    cache = SfResultCache(str(tmp_path / "cache"))
+    assert cache.load(job) is None
+    cache.store(result)
+    assert cache.contains(job.key)
+    loaded = cache.load(job)
+    assert loaded.status == SfVariantResult.CONVERGED and loaded.work_dir is None
+    assert loaded.num_step == 17 and loaded.total_energy == -123.4
+    for name in ("cell", "structure_array", "spin_array", "nu_array", "force_array"):
+        assert np.array_equal(getattr(loaded, name), getattr(result, name))
+    assert sorted(loaded.structure_dict) == ["0", "1"]
+    assert np.array_equal(loaded.structure_dict["1"], result.structure_dict["1"])
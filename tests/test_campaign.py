@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# @File    : test_campaign.py
+# @Time    : 5/12/2021 4:25 PM
+# @Author  : Zavier Cai
+# @Email   : caizefeng18@gmail.com
+import json
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+from spinforce.DPIO import DPReader
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPTS_DIR = os.path.join(PACKAGE_DIR, "spinforce", "scripts")
+RAW_FILES = ("box.raw", "coord.raw", "energy.raw", "force.raw", "type.raw")
+
+STRUCTURE = """cell = [[  5.35000000,   0.00000000,   0.00000000],
+       [  0.00000000,   5.35000000,   0.00000000],
+       [  0.00000000,   0.00000000,   5.35000000]];
+movable;
+species  {
+  element="Fe";
+  atom {coords = [ 0 , 0 , 0 ] ; relative; label = "A"; }
+  atom {coords = [ 0.5 , 0.5 , 0.5 ] ; relative; label = "B"; }
+}
+"""
+
+
+def run_campaign(campaign_dir, env=None, **sections):
+    """Run ``python -m spinforce`` on the campaign with fake_sphinx.py; returns its metrics events."""
+    config = {
+        "sphinx_file": {"working_dir": str(campaign_dir), "structure_dir": "structure", "spin_dir": "spin",
+                        "config_dir": "config", "input_path": os.path.join(PACKAGE_DIR, "spinforce", "templates",
+                                                                           "input.sx")},
+        "dp_file": {"output_dir": "raw"},
+        "sphinx_path": "{} {}".format(sys.executable, os.path.join(SCRIPTS_DIR, "fake_sphinx.py")),
+        "spin_constraint": {"collinear": True, "atoms": [
+            {"index": 0, "sampling": "uniform", "bound": {"high": 3, "low": 1, "interval": 1.0}},
+            {"index": 1, "sampling": "uniform", "bound": {"high": 3, "low": -3, "points": 3}}]},
+        "metrics": {"enabled": True},
+    }
+    for name, section in sections.items():
+        config[name] = dict(config.get(name, {}), **section)
+    config_path = os.path.join(str(campaign_dir), "config.json")
+    with open(config_path, "w") as f:
+        json.dump(config, f)
+
+    metrics_path = os.path.join(str(campaign_dir), "metrics.jsonl")
+    if os.path.exists(metrics_path):
+        os.remove(metrics_path)
+    process_env = dict(os.environ, PYTHONPATH=PACKAGE_DIR, **(env or {}))
+    subprocess.run([sys.executable, "-m", "spinforce", config_path], env=process_env, check=True,
+                   stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=300)
+    with open(metrics_path, "r") as f:
+        return [json.loads(line) for line in f]
+
+
+def variant_statuses(events):
+    return sorted((event["variant"], event["status"]) for event in events
+                  if event["event"] == "counter" and event["name"] == "variants")
+
+
+def read_frames(campaign_dir):
+    frames = {}
+    for name in RAW_FILES:
+        with open(os.path.join(str(campaign_dir), "raw", name), "r") as f:
+            frames[name] = f.read()
+    return frames
+
+
+@pytest.fixture
+def campaign_dir(tmp_path):
+    for sub_dir in ("structure", "spin"):
+        (tmp_path / sub_dir).mkdir()
+    (tmp_path / "structure" / "1_structure.sx").write_text(STRUCTURE)
+    (tmp_path / "spin" / "1_spin.sx").write_text("3\n2.2\n")
+    return tmp_path
+
+
+@pytest.fixture(scope="module")
+def reference(tmp_path_factory):
+    """Frames and variant statuses of the campaign run one variant after the other."""
+    reference_dir = tmp_path_factory.mktemp("reference")
+    (reference_dir / "structure").mkdir()
+    (reference_dir / "spin").mkdir()
+    (reference_dir / "structure" / "1_structure.sx").write_text(STRUCTURE)
+    (reference_dir / "spin" / "1_spin.sx").write_text("3\n2.2\n")
+    events = run_campaign(reference_dir)
+    return read_frames(reference_dir), variant_statuses(events)
+
+
+def test_inline_writes_converged_variants(reference):
+    frames, statuses = reference
+    assert statuses == [(variant, "converged") for variant in range(9)]
+    assert len(frames["energy.raw"].splitlines()) == 9
+    assert frames["type.raw"].split() == ["0", "0", "1", "1"]  # two Fe atoms and their pseudo atoms
+
+
+@pytest.mark.parametrize("execution", [
+    {"backend": "pool", "num_workers": 2},
+    {"backend": "async", "async": {"cores_per_job": 1}},
+    {"backend": "batch", "batch": {
+        "submit_cmd": "{} {} submit".format(sys.executable, os.path.join(SCRIPTS_DIR, "fake_scheduler.py")),
+        "status_cmd": "{} {} status {{job_ids}}".format(sys.executable, os.path.join(SCRIPTS_DIR, "fake_scheduler.py")),
+        "poll_interval": 0.1, "max_queued": 4}},
+], ids=["pool", "async", "batch"])
+def test_backends_write_the_inline_frames(campaign_dir, reference, execution):
+    events = run_campaign(campaign_dir, execution=execution)
+    assert read_frames(campaign_dir) == reference[0]
+    assert variant_statuses(events) == reference[1]
+
+
+def test_second_run_hits_the_cache(campaign_dir, reference):
+    run_campaign(campaign_dir, cache={"enabled": True})
+    events = run_campaign(campaign_dir, cache={"enabled": True}, env={"FAKE_SPHINX_FAIL": "crash"})
+    assert read_frames(campaign_dir) == reference[0]
+    # SPHInX is not run again: it would crash on every variant now
+    assert [status for _, status in variant_statuses(events)] == ["cached"] * 9
+
+
+def test_resume_runs_only_the_missing_variants(campaign_dir, reference):
+    run_campaign(campaign_dir, env={"FAKE_SPHINX_FAIL": "crash", "FAKE_SPHINX_FAIL_RATE": "0.5"})
+    first = read_frames(campaign_dir)
+    num_first = len(first["energy.raw"].splitlines())
+    assert 0 < num_first < len(reference[0]["energy.raw"].splitlines())
+
+    events = run_campaign(campaign_dir, dp_file={"resume": True, "flush_frames": 2})
+    frames = read_frames(campaign_dir)
+    assert sum(status == "committed" for _, status in variant_statuses(events)) == num_first
+    assert frames["energy.raw"].startswith(first["energy.raw"])
+    for name in ("box.raw", "coord.raw", "energy.raw", "force.raw"):  # resumed frames follow the committed ones
+        assert sorted(frames[name].splitlines()) == sorted(reference[0][name].splitlines())
+
+
+def test_monitor_aborts_oscillating_scf(campaign_dir, reference):
+    events = run_campaign(campaign_dir, monitor={"enabled": True, "poll_interval": 0.05, "window": 8,
+                                                 "min_steps": 12},
+                          env={"FAKE_SPHINX_FAIL": "oscillate", "FAKE_SPHINX_DELAY": "0.01"})
+    assert [status for _, status in variant_statuses(events)] == ["aborted"] * 9
+    assert len(read_frames(campaign_dir)["energy.raw"].splitlines()) == 0
+    scf_steps = [event["value"] for event in events if event["event"] == "counter" and event["name"] == "scf_steps"]
+    assert max(scf_steps) < 100  # killed long before maxSteps
+
+
+def test_time_reversal_writes_flipped_frames(campaign_dir, reference):
+    run_campaign(campaign_dir, spin_constraint={"time_reversal": True})
+    chunk = next(DPReader(str(campaign_dir / "raw")).chunks())
+    coord, force = chunk["coord"].reshape((-1, 4, 3)), chunk["force"].reshape((-1, 4, 3))
+    spins = (coord[:, 2:, 2] - coord[:, :2, 2]) / 0.5  # from the pseudo-atoms, affine parameter 0.5
+    assert len(spins) == 18  # the spins of atom 0 are all positive, no variant is the partner of another
+    reference_energies = [float(energy) for energy in reference[0]["energy.raw"].split()]
+    assert sorted(chunk["energy"][:, 0]) == sorted(2 * reference_energies)
+    for i in range(len(spins)):
+        partners = [j for j in range(len(spins)) if np.allclose(spins[j], -spins[i])]
+        assert len(partners) == 1
+        j, = partners
+        assert chunk["energy"][j, 0] == chunk["energy"][i, 0]
+        assert np.allclose(force[j, :2], force[i, :2])  # forces on the atoms
+        assert np.allclose(force[j, 2:], -force[i, 2:])  # nu
+        assert np.allclose(coord[j, :2], coord[i, :2])
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# @File    : test_dataset.py
+# @Time    : 5/12/2021 6:30 PM
+# @Author  : Zavier Cai
+# @Email   : caizefeng18@gmail.com
+import logging
+import os
+
+import numpy as np
+import pytest
+
+from spinforce.DPIO import DPReader, DPWriter
+from spinforce.SfDataset import SfDatasetMerger
+
+TYPE_ARRAY = np.array([0, 0, 1, 1])
+# four structures with three spins each; b repeats the last two spins of structures 1 and 2 of a
+SOURCE_FRAMES = {"a": [(structure, spin) for structure in range(3) for spin in range(3)],
+                 "b": [(structure, spin) for structure in (1, 2, 3) for spin in (1, 2, 3)]}
+MERGED_ENERGIES = [-10. * structure - spin for structure in range(3) for spin in range(3)] + \
+                  [-10. * structure - 3 for structure in (1, 2)] + [-30. - spin for spin in (1, 2, 3)]
+
+
+def write_source(output_dir, frames):
+    """A raw source of frames (structure, spin) numbered by their energy, -10 * structure - spin."""
+    writer = DPWriter()
+    writer._logger = logging.getLogger("test")
+    writer.init(str(output_dir), flush_frames=4)
+    writer.write_type(TYPE_ARRAY)
+    for structure, spin in frames:
+        coord_array = np.array([[0., 0., 0.], [0.5, 0.5, 0.5 + structure]])
+        spin_array = np.array([[0., 0., spin], [0., 0., -spin]])
+        writer.write_frame(np.eye(3) * (5. + structure), coord_array, spin_array, -10. * structure - spin,
+                           np.zeros((2, 3)), np.ones((2, 3)))
+    writer.close()
+
+
+def merge(output_dir, source_dirs, **kwargs):
+    merger = SfDatasetMerger(str(output_dir), chunk_size=3, **kwargs)
+    merger._logger = logging.getLogger("test")
+    merger.merge([str(source_dir) for source_dir in source_dirs])
+
+
+def read_energies(output_dir):
+    return [float(energy) for chunk in DPReader(str(output_dir)).chunks() for energy in chunk["energy"][:, 0]]
+
+
+def read_files(output_dir):
+    contents = {}
+    for dir_path, _, file_names in os.walk(str(output_dir)):
+        for name in file_names:
+            if name != "frames.journal":
+                with open(os.path.join(dir_path, name), "r") as f:
+                    contents[os.path.relpath(os.path.join(dir_path, name), str(output_dir))] = f.read()
+    return contents
+
+
+@pytest.fixture
+def sources(tmp_path):
+    for name, frames in sorted(SOURCE_FRAMES.items()):
+        write_source(tmp_path / name, frames)
+    return [tmp_path / name for name in sorted(SOURCE_FRAMES)]
+
+
+def test_merge_drops_duplicates(tmp_path, sources):
+    merge(tmp_path / "merged", sources, validation=0.)
+    assert read_energies(tmp_path / "merged") == MERGED_ENERGIES
+
+
+def test_random_split_is_deterministic(tmp_path, sources):
+    merge(tmp_path / "first", sources, validation=0.4, seed=3)
+    merge(tmp_path / "second", sources, validation=0.4, seed=3)
+    assert read_files(tmp_path / "first") == read_files(tmp_path / "second")
+
+    train = read_energies(tmp_path / "first" / "train")
+    validation = read_energies(tmp_path / "first" / "validation")
+    assert train and validation
+    assert sorted(train + validation) == sorted(MERGED_ENERGIES)
+
+    merge(tmp_path / "other", sources, validation=0.4, seed=4)
+    assert read_energies(tmp_path / "other" / "validation") != validation
+
+
+def test_tag_split_keeps_structures_together(tmp_path, sources):
+    merge(tmp_path / "first", sources, validation=0.25, split="tag", seed=1)
+    merge(tmp_path / "second", sources, validation=0.25, split="tag", seed=1)
+    assert read_files(tmp_path / "first") == read_files(tmp_path / "second")
+
+    validation = read_energies(tmp_path / "first" / "validation")
+    validation_structures = {int(-energy // 10) for energy in validation}
+    assert len(validation_structures) == 1  # one of four structures
+    structure, = validation_structures
+    assert sorted(validation) == sorted(energy for energy in MERGED_ENERGIES if int(-energy // 10) == structure)
+
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# @File    : test_design_helper.py
+# @Time    : 5/12/2021 11:15 AM
+# @Author  : Zavier Cai
+# @Email   : caizefeng18@gmail.com
+import numpy as np
+import pytest
+
+from spinforce.helper.design_helper import SOBOL_MAX_DIM, halton, latin_hypercube, sobol
+
+
+def count_in_boxes(points, divisions):
+    """Points per box of a grid with ``divisions[d]`` equal intervals along axis ``d``."""
+    cells = np.floor(points * np.array(divisions)).astype(int)
+    counts = np.zeros(divisions, dtype=int)
+    np.add.at(counts, tuple(cells.T), 1)
+    return counts
+
+
+def test_sobol_first_points():
+    assert np.allclose(sobol(4, 2), [[0, 0], [0.5, 0.5], [0.75, 0.25], [0.25, 0.75]])
+
+
+@pytest.mark.parametrize("seed", [None, 3])
+def test_sobol_strata(seed):
+    # the first 2^m points fill every one of 2^m intervals of each axis once, digitally shifted or not,
+    # and the first two dimensions form a (0, m, 2)-net: one point in every elementary box
+    points = sobol(64, SOBOL_MAX_DIM, seed)
+    assert np.all((points >= 0) & (points < 1))
+    for d in range(SOBOL_MAX_DIM):
+        assert np.all(count_in_boxes(points[:, [d]], (64,)) == 1)
+    for a in range(7):
+        assert np.all(count_in_boxes(points[:, :2], (2 ** a, 2 ** (6 - a))) == 1)
+
+
+@pytest.mark.parametrize("design", [sobol, halton])
+def test_sequences_continue_from_start(design):
+    whole = design(50, 5, 7)
+    assert np.array_equal(design(20, 5, 7, start=30), whole[30:])
+
+
+def test_halton_strata():
+    points = halton(2 * 3 * 5, 3, seed=1)
+    for d, base in enumerate((2, 3, 5)):
+        assert np.all(count_in_boxes(points[:, [d]], (base,)) == 30 // base)
+    assert np.allclose(halton(4, 1)[:, 0], [0, 0.5, 0.25, 0.75])
+
+
+def test_latin_hypercube_strata():
+    points = latin_hypercube(17, 4, seed=2)
+    assert np.all((points >= 0) & (points < 1))
+    for d in range(4):
+        assert np.all(count_in_boxes(points[:, [d]], (17,)) == 1)
+    assert np.array_equal(points, latin_hypercube(17, 4, seed=2))
+
+
+def test_sobol_dimension_limit():
+    with pytest.raises(ValueError):
+        sobol(4, SOBOL_MAX_DIM + 1)
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# @File    : test_dpio.py
+# @Time    : 5/11/2021 5:00 PM
+# @Author  : Zavier Cai
+# @Email   : caizefeng18@gmail.com
+import logging
+import os
+
+import numpy as np
+import pytest
+
+from spinforce.DPIO import DPReader, DPWriter
+
+TYPE_ARRAY = np.array([0, 0, 1, 1])
+
+
+def new_writer(output_dir, output_format="raw", resume=False, **kwargs):
+    writer = DPWriter()
+    writer._logger = logging.getLogger("test")
+    writer.init(str(output_dir), output_format, resume=resume, **kwargs)
+    writer.write_type(TYPE_ARRAY)
+    return writer
+
+
+def write_frames(writer, start, stop):
+    for i in range(start, stop):
+        writer.write_frame(np.eye(3).reshape(-1) * (i + 1), np.full(6, float(i)), np.zeros(6), -float(i),
+                           np.ones(6), np.full(6, 0.5), key="frame{}".format(i))
+
+
+def read_energies(output_dir):
+    return np.concatenate([chunk["energy"][:, 0] for chunk in DPReader(str(output_dir)).chunks(2)]).tolist()
+
+
+@pytest.mark.parametrize("output_format", ["raw", "npy"])
+def test_frames_read_back(tmp_path, output_format):
+    writer = new_writer(tmp_path, output_format, set_size=3, flush_frames=2)
+    write_frames(writer, 0, 7)
+    writer.close()
+    assert read_energies(tmp_path) == [-float(i) for i in range(7)]
+    assert DPWriter.read_committed_keys(str(tmp_path)) == {"frame{}".format(i) for i in range(7)}
+
+
+def test_recover_drops_uncommitted_frames(tmp_path):
+    writer = new_writer(tmp_path, flush_frames=2)
+    write_frames(writer, 0, 5)  # 4 committed, 1 staged
+    writer.f_energy.write("-99.0\n")  # half of a commit that never got its journal record
+    writer.f_energy.flush()
+    with open(os.path.join(str(tmp_path), "frames.journal"), "a") as f:
+        f.write('{"frames": 6, "se')
+    for f in (writer.f_box, writer.f_coord, writer.f_type, writer.f_energy, writer.f_force, writer.f_journal):
+        f.close()  # crash: nothing flushed on close
+
+    resumed = new_writer(tmp_path, resume=True, flush_frames=2)
+    assert resumed.committed_keys == {"frame{}".format(i) for i in range(4)}
+    write_frames(resumed, 4, 6)
+    resumed.close()
+    assert read_energies(tmp_path) == [-float(i) for i in range(6)]
+
+
+def test_recover_keeps_committed_frames_of_open_set(tmp_path):
+    writer = new_writer(tmp_path, "npy", set_size=3, flush_frames=2)
+    write_frames(writer, 0, 5)  # set.000 full, 1 frame committed to set.001, 1 staged
+    for f in (writer.f_type, writer.f_journal):
+        f.close()  # crash
+    assert read_energies(tmp_path) == [-float(i) for i in range(4)]
+    # and in the middle of replacing set.001 by its next version
+    os.rename(os.path.join(str(tmp_path), "set.001"), os.path.join(str(tmp_path), "set.001.old"))
+    os.makedirs(os.path.join(str(tmp_path), "set.001.tmp"))
+
+    resumed = new_writer(tmp_path, "npy", resume=True, set_size=3, flush_frames=2)
+    assert resumed.committed_keys == {"frame{}".format(i) for i in range(4)}
+    write_frames(resumed, 4, 8)
+    resumed.close()
+    assert read_energies(tmp_path) == [-float(i) for i in range(8)]
+    assert sorted(os.listdir(str(tmp_path))) == ["frames.journal", "set.000", "set.001", "set.002", "type.raw"]
+
+
+def test_commit_on_time_without_new_frames(tmp_path):
+    writer = new_writer(tmp_path, flush_frames=100, flush_seconds=3600.)
+    write_frames(writer, 0, 1)
+    writer.flush_if_due()
+    assert not DPWriter.read_committed_keys(str(tmp_path))
+    writer._flush_seconds = 0.  # as if an hour had passed
+    writer.flush_if_due()
+    assert DPWriter.read_committed_keys(str(tmp_path)) == {"frame0"}
+    writer.close()
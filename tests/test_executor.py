@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# @File    : test_executor.py
+# @Time    : 5/11/2021 3:30 PM
+# @Author  : Zavier Cai
+# @Email   : caizefeng18@gmail.com
+import asyncio
+import logging
+import os
+import sys
+
+import pytest
+
+from spinforce.SfExecutor import SfAsyncExecutor, SfBatchExecutor
+from spinforce.SfVariant import SfVariantJob, SfVariantResult
+
+
+def new_batch_executor(**batch_dict):
+    executor = SfBatchExecutor(dict({"poll_interval": 0}, **batch_dict))
+    executor._logger = logging.getLogger("test")
+    return executor
+
+
+def new_async_executor(monkeypatch, cpus, **async_dict):
+    monkeypatch.setattr(SfAsyncExecutor, "available_cpus", staticmethod(lambda: cpus))
+    executor = SfAsyncExecutor(async_dict)
+    executor._logger = logging.getLogger("test")
+    return executor
+
+
+@pytest.mark.parametrize("async_dict, cpu_sets", [
+    ({"cores": 6, "cores_per_job": 2}, [[0, 1], [2, 3], [4, 5]]),
+    ({"cores": 16, "cores_per_job": 3}, [[0, 1, 2], [3, 4, 5]]),  # budget cut to the 8 cores available
+    ({"cores_per_job": 4}, [[0, 1, 2, 3], [4, 5, 6, 7]]),
+])
+def test_async_slots_split_core_budget(monkeypatch, async_dict, cpu_sets):
+    executor = new_async_executor(monkeypatch, list(range(8)), **async_dict)
+    executor.start()
+    try:
+        assert executor._free_cpu_sets == cpu_sets
+        assert executor.capacity() == (len(cpu_sets), len(cpu_sets[0]))
+    finally:
+        executor.shutdown()
+
+
+def test_async_budget_below_one_job(monkeypatch):
+    with pytest.raises(RuntimeError):
+        new_async_executor(monkeypatch, list(range(8)), cores=2, cores_per_job=3).start()
+
+
+def test_async_attempts_run_on_disjoint_cores(monkeypatch):
+    executor = new_async_executor(monkeypatch, list(range(8)), cores_per_job=2)
+    running, used = set(), []
+
+    async def launch(job, cpus, monitor=None):
+        assert not running & set(cpus)
+        running.update(cpus)
+        used.append(sorted(cpus))
+        await asyncio.sleep(0.01)
+        running.difference_update(cpus)
+        return 0, "", None
+
+    monkeypatch.setattr(executor, "launch", launch)
+    monkeypatch.setattr("spinforce.SfExecutor.collect_variant", SfVariantResult)
+    executor.start()
+    try:
+        jobs = [SfVariantJob(1, variant, ".", "sphinx") for variant in range(6)]
+        executor._loop.run_until_complete(asyncio.gather(*[executor.run_attempt(job) for job in jobs[:4]]))
+        assert sorted(used) == [[0, 1], [2, 3], [4, 5], [6, 7]]
+        executor._loop.run_until_complete(asyncio.gather(*[executor.run_attempt(job) for job in jobs[4:]]))
+        assert sorted(map(sorted, executor._free_cpu_sets)) == [[0, 1], [2, 3], [4, 5], [6, 7]]
+    finally:
+        executor.shutdown()
+
+
+@pytest.mark.skipif(not hasattr(os, "sched_setaffinity"), reason="CPU affinity not supported")
+def test_async_launch_pins_process_and_sets_threads(tmp_path):
+    cpu = sorted(os.sched_getaffinity(0))[-1]
+    executor = SfAsyncExecutor({"cores_per_job": 1})
+    executor._logger = logging.getLogger("test")
+    script = "import os; print(sorted(os.sched_getaffinity(0)), os.environ['OMP_NUM_THREADS'])"
+    job = SfVariantJob(1, 0, str(tmp_path), [sys.executable, "-c", script])
+    executor.start()
+    try:
+        returncode, _, abort_reason = executor._loop.run_until_complete(executor.launch(job, [cpu]))
+    finally:
+        executor.shutdown()
+    assert returncode == 0 and abort_reason is None
+    with open(str(tmp_path / "output.sx"), "r") as f:
+        assert f.read().split() == ["[{}]".format(cpu), "1"]
+
+
+def test_one_status_call_lists_queued_jobs():
+    executor = new_batch_executor(status_cmd="echo 17 {job_ids}")
+    assert executor.queued_job_ids(["17", "18"]) == {"17", "18"}
+    executor = new_batch_executor(status_cmd="echo 17")
+    assert executor.queued_job_ids(["17", "18"]) == {"17"}
+
+
+def test_failed_status_call_is_unknown():
+    assert new_batch_executor(status_cmd="false {job_ids}").queued_job_ids(["17"]) is None
+    assert new_batch_executor(status_cmd="/nonexistent/squeue").queued_job_ids(["17"]) is None
+
+
+def test_jobs_not_collected_while_status_unknown(monkeypatch):
+    executor = new_batch_executor(status_cmd="false", max_status_failures=3)
+    collected = []
+    monkeypatch.setattr("spinforce.SfExecutor.collect_variant", collected.append)
+    monkeypatch.setattr(executor, "submit", lambda job: ("17", job))
+    with pytest.raises(RuntimeError):
+        list(executor.execute([SfVariantJob(1, 0, ".", "sphinx")]))
+    assert not collected
+
+
+def test_batch_wait_calls_idle(monkeypatch):
+    executor = new_batch_executor()
+    replies = [{"17"}, {"17"}, set()]
+    idle_calls = []
+    executor.on_idle(lambda: idle_calls.append(None), 0)
+    monkeypatch.setattr(executor, "queued_job_ids", lambda job_ids: replies.pop(0))
+    monkeypatch.setattr(executor, "submit", lambda job: ("17", job))
+    monkeypatch.setattr("spinforce.SfExecutor.collect_variant", lambda job: job.variant)
+    assert list(executor.execute([SfVariantJob(1, 0, ".", "sphinx")])) == [0]
+    assert len(idle_calls) == 2
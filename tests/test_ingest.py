@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# @File    : test_ingest.py
+# @Time    : 5/12/2021 5:40 PM
+# @Author  : Zavier Cai
+# @Email   : caizefeng18@gmail.com
+import logging
+import os
+import shutil
+import subprocess
+import sys
+
+from spinforce.DPIO import DPReader
+from spinforce.SfIngest import SfRunIngester
+
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STRUCTURE = """cell = [[5.35, 0, 0], [0, 5.35, 0], [0, 0, 5.35]];
+species  {
+  element="Fe";
+  atom {coords = [ 0 , 0 , 0 ] ; relative; label = "A"; }
+  atom {coords = [ 0.5 , 0.5 , 0.5 ] ; relative; label = "B"; }
+}
+"""
+
+
+def fake_run(run_dir, spins, env=None):
+    os.makedirs(run_dir)
+    shutil.copy(os.path.join(PACKAGE_DIR, "spinforce", "templates", "input.sx"), run_dir)
+    with open(os.path.join(run_dir, "structure.sx"), "w") as f:
+        f.write(STRUCTURE)
+    with open(os.path.join(run_dir, "spin-constraint.sx"), "w") as f:
+        f.write("".join("{}\n".format(spin) for spin in spins))
+    with open(os.path.join(run_dir, "output.sx"), "w") as output:
+        subprocess.run([sys.executable, os.path.join(PACKAGE_DIR, "spinforce", "scripts", "fake_sphinx.py")],
+                       cwd=run_dir, stdout=output, env=dict(os.environ, **(env or {})))
+
+
+def new_ingester(output_dir, **kwargs):
+    ingester = SfRunIngester(str(output_dir), num_workers=1, **kwargs)
+    ingester._logger = logging.getLogger("test")
+    return ingester
+
+
+def test_ingest_filters_and_deduplicates(tmp_path):
+    runs = tmp_path / "runs"
+    fake_run(str(runs / "a" / "1"), [2.0, -2.0])
+    fake_run(str(runs / "a" / "2"), [2.0, 2.0])
+    fake_run(str(runs / "b" / "1"), [2.0, -2.0])  # copy of a/1
+    fake_run(str(runs / "b" / "2"), [1.0, 1.0], env={"FAKE_SPHINX_FAIL": "steps"})
+    (runs / "b" / "3").mkdir()
+    (runs / "b" / "3" / "output.sx").write_text("not a run\n")
+    fake_run(str(runs / "b" / "4"), [1.0, -1.0])
+    os.remove(str(runs / "b" / "4" / "energy.dat"))  # converged, but without a total energy
+
+    counts = new_ingester(tmp_path / "raw").ingest([str(runs)])
+    assert counts["written"] == 2 and counts["duplicate"] == 1 and counts["steps_over"] == 1
+    assert counts["failed"] == 1
+    assert sum(counts.values()) == 5  # b/3 lacks the other run files, it is not a run
+    frames = next(DPReader(str(tmp_path / "raw")).chunks())
+    assert len(frames["energy"]) == 2
+    with open(str(tmp_path / "raw" / "energy.raw"), "r") as f:
+        assert "None" not in f.read()
+
+    fake_run(str(runs / "c"), [-2.0, -2.0])
+    counts = new_ingester(tmp_path / "raw", resume=True).ingest([str(runs)])
+    assert counts["written"] == 1 and counts["duplicate"] == 3 and counts["failed"] == 1
+    assert len(next(DPReader(str(tmp_path / "raw")).chunks())["energy"]) == 3
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# @File    : test_metrics.py
+# @Time    : 5/12/2021 8:15 PM
+# @Author  : Zavier Cai
+# @Email   : caizefeng18@gmail.com
+import json
+import logging
+import os
+import re
+
+from spinforce.SfMetrics import SfMetrics
+
+# one sample of the Prometheus text format: name, optional {label="value",...}, value
+SAMPLE_PATTERN = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{((?:[a-zA-Z_]\w*="[^"]*",?)*)\})? (\S+)$')
+
+
+def new_metrics(tmp_path, **metrics_dict):
+    metrics = SfMetrics(dict({"enabled": True}, **metrics_dict), str(tmp_path))
+    metrics._logger = logging.getLogger("test")
+    metrics.start()
+    return metrics
+
+
+def parse_exposition(text):
+    """{(name, labels): value} of a text-format exposition, every line checked against the format."""
+    samples, types = {}, {}
+    for line in text.splitlines():
+        if line.startswith("# TYPE "):
+            name, metric_type = line.split()[2:]
+            assert metric_type in ("counter", "gauge") and name not in types
+            types[name] = metric_type
+        elif not line.startswith("# HELP "):
+            match = SAMPLE_PATTERN.match(line)
+            assert match, line
+            name, labels, value = match.groups()
+            assert name in types  # declared before its samples
+            label_items = tuple(re.findall(r'(\w+)="([^"]*)"', labels or ""))
+            samples[(name, label_items)] = float(value)
+    return samples
+
+
+def test_jsonl_records(tmp_path):
+    metrics = new_metrics(tmp_path)
+    metrics.observe("sphinx", 1.5, tag="1", variant=3)
+    metrics.inc("variants", tag="1", variant=3, status="converged")
+    metrics.close()
+
+    with open(str(tmp_path / "metrics.jsonl"), "r") as f:
+        span, counter = [json.loads(line) for line in f]
+    assert span.pop("time") > 0 and counter.pop("time") > 0
+    assert span == {"event": "span", "phase": "sphinx", "tag": "1", "variant": 3, "seconds": 1.5}
+    assert counter == {"event": "counter", "name": "variants", "tag": "1", "variant": 3, "value": 1,
+                       "status": "converged"}
+
+
+def test_prometheus_exposition(tmp_path):
+    metrics = new_metrics(tmp_path, prometheus="run.prom")
+    metrics.observe("sphinx", 1.5, tag="1")
+    metrics.observe("sphinx", 0.5, tag="2")
+    with metrics.span("write", tag="1"):
+        pass
+    metrics.inc("variants", status="converged")
+    metrics.inc("variants", status="converged")
+    metrics.inc("variants", status="aborted")
+    metrics.inc("scf_steps", 30)
+    metrics.close()
+
+    with open(str(tmp_path / "run.prom"), "r") as f:
+        samples = parse_exposition(f.read())
+    assert samples[("spinforce_phase_seconds_total", (("phase", "sphinx"),))] == 2.0
+    assert samples[("spinforce_phase_spans_total", (("phase", "sphinx"),))] == 2
+    assert samples[("spinforce_phase_spans_total", (("phase", "write"),))] == 1
+    assert samples[("spinforce_variants_total", (("status", "converged"),))] == 2
+    assert samples[("spinforce_variants_total", (("status", "aborted"),))] == 1
+    assert samples[("spinforce_scf_steps_total", ())] == 30
+    assert samples[("spinforce_run_seconds", ())] >= 0
+    assert not os.path.exists(str(tmp_path / "run.prom.tmp"))
+
+
+def test_disabled_metrics_write_nothing(tmp_path):
+    metrics = SfMetrics({}, str(tmp_path))
+    metrics._logger = logging.getLogger("test")
+    metrics.start()
+    metrics.observe("sphinx", 1.0)
+    metrics.inc("variants", status="converged")
+    metrics.close()
+    assert metrics.total("sphinx") == (1.0, 1)
+    assert os.listdir(str(tmp_path)) == []
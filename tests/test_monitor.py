@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# @File    : test_monitor.py
+# @Time    : 5/11/2021 11:20 AM
+# @Author  : Zavier Cai
+# @Email   : caizefeng18@gmail.com
+import os
+import shutil
+import sys
+
+import pytest
+
+from spinforce.SfMonitor import SfScfMonitor, SfTail
+from spinforce.helper.fs_helper import change_dir
+
+PACKAGE_DIR = os.path.join(os.path.dirname(__file__), os.pardir, "spinforce")
+FAKE_SPHINX = [sys.executable, os.path.abspath(os.path.join(PACKAGE_DIR, "scripts", "fake_sphinx.py"))]
+MONITOR_DICT = {"poll_interval": 0.05, "window": 8, "min_steps": 12}
+
+
+@pytest.fixture
+def variant_dir(tmp_path):
+    for name in ("input.sx", "structure.sx", "spin-constraint.sx"):
+        shutil.copy(os.path.join(PACKAGE_DIR, "templates", name), str(tmp_path))
+    return str(tmp_path)
+
+
+def test_tail_hands_out_complete_lines(tmp_path):
+    path = str(tmp_path / "energy.dat")
+    tail = SfTail(path)
+    assert tail.read_new() == b""
+    with open(path, "ab") as f:
+        f.write(b"1 a\n2 b\n3")
+    assert tail.read_new() == b"1 a\n2 b\n"
+    with open(path, "ab") as f:
+        f.write(b" c\n")
+    assert tail.read_new() == b"3 c\n"
+    assert tail.read_new() == b""
+
+
+def test_tail_starts_over_after_truncation(tmp_path):
+    path = str(tmp_path / "energy.dat")
+    tail = SfTail(path)
+    with open(path, "wb") as f:
+        f.write(b"1 old\n2 old\n3 ol")
+    tail.read_new()
+    with open(path, "wb") as f:
+        f.write(b"1 new\n")
+    assert tail.read_new() == b"1 new\n"
+
+
+def test_begin_removes_leftovers(variant_dir):
+    for name in ("output.sx", "energy.dat"):
+        with open(os.path.join(variant_dir, name), "w") as f:
+            f.write("F(1)=-1.0\n")
+    SfScfMonitor(MONITOR_DICT).begin(variant_dir)
+    assert not os.path.exists(os.path.join(variant_dir, "output.sx"))
+    assert not os.path.exists(os.path.join(variant_dir, "energy.dat"))
+
+
+def test_oscillation_detected_after_previous_variant(variant_dir, monkeypatch):
+    # inline runs reuse one directory, the converged history of the previous variant must not count
+    monkeypatch.setenv("FAKE_SPHINX_STEPS", "30")
+    with change_dir(variant_dir):
+        assert SfScfMonitor(MONITOR_DICT).run(FAKE_SPHINX) is None
+        monkeypatch.setenv("FAKE_SPHINX_FAIL", "oscillate")
+        monkeypatch.setenv("FAKE_SPHINX_DELAY", "0.005")
+        monitor = SfScfMonitor(MONITOR_DICT)
+        reason = monitor.run(FAKE_SPHINX)
+    assert reason is not None and "oscillating" in reason
+    assert monitor.num_step < 100
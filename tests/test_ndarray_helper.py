@@ -0,0 +1,25 @@
+#!/usr/bin/env python3
+# @File    : test_ndarray_helper.py
+# @Time    : 5/11/2021 10:05 AM
+# @Author  : Zavier Cai
+# @Email   : caizefeng18@gmail.com
+import numpy as np
+import pytest
+
+from spinforce.helper.ndarray_helper import serpentine_order
+
+
+@pytest.mark.parametrize("shape", [(5,), (3, 3), (2, 3, 4), (3, 3, 3), (4, 4, 4), (3, 2, 2, 3), (2, 2, 2, 2)])
+def test_serpentine_order_moves_one_step(shape):
+    order = serpentine_order(shape)
+    assert sorted(order.tolist()) == list(range(int(np.prod(shape))))
+    digits = np.array(np.unravel_index(order, shape))
+    steps = np.abs(np.diff(digits, axis=1))
+    assert np.all(steps.sum(axis=0) == 1)
+
+
+def test_serpentine_order_in_blocks():
+    shape = (4, 3, 2, 4)
+    order = serpentine_order(shape)
+    positions = np.arange(7, 61)
+    assert np.array_equal(serpentine_order(shape, positions), order[positions])
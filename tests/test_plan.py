@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+# @File    : test_plan.py
+# @Time    : 5/11/2021 4:15 PM
+# @Author  : Zavier Cai
+# @Email   : caizefeng18@gmail.com
+import json
+import logging
+
+import pytest
+
+from spinforce.SfPlan import SfCostModel, SfPlan
+
+
+@pytest.fixture
+def cost_model(tmp_path):
+    # 1e-4 * num_atoms ** 2 seconds per SCF step, 20 steps per variant
+    path = str(tmp_path / "metrics.jsonl")
+    with open(path, "w") as f:
+        for tag, num_atoms in (("a", 10), ("b", 40)):
+            f.write(json.dumps({"event": "structure", "tag": tag, "num_atoms": num_atoms}) + "\n")
+            for variant in range(3):
+                f.write(json.dumps({"event": "counter", "name": "scf_steps", "tag": tag, "variant": variant,
+                                    "value": 20}) + "\n")
+                f.write(json.dumps({"event": "span", "phase": "sphinx", "tag": tag, "variant": variant,
+                                    "seconds": 20 * 1e-4 * num_atoms ** 2}) + "\n")
+        f.write('{"event": "span", "pha')  # run still in progress
+    model = SfCostModel()
+    model._logger = logging.getLogger("test")
+    model.load([path, str(tmp_path / "missing.jsonl")])
+    return model
+
+
+def test_cost_model_fits_size_scaling(cost_model):
+    assert cost_model.predict("a", 10, 100) == (20, pytest.approx(0.2), "tag history")
+    steps, seconds, source = cost_model.predict("c", 20, 100)
+    assert source == "size fit" and seconds == pytest.approx(20 * 1e-4 * 20 ** 2)
+
+
+def test_cost_model_without_history():
+    model = SfCostModel()
+    assert model.predict("a", 10, 100) == (100, None, "maxSteps")
+
+
+@pytest.mark.parametrize("concurrency, wall_time", [(4, "about 0.00 h of wall time"), (None, "wall time unknown")])
+def test_plan_wall_time(cost_model, caplog, concurrency, wall_time):
+    plan = SfPlan(cost_model, concurrency)
+    plan._logger = logging.getLogger("test")
+    plan.add_tag("b", {"num_atoms": 40, "runs": 10, "committed": 2, "cached": 1, "variants": 10}, 100)
+    with caplog.at_level(logging.INFO):
+        plan.report()
+    assert "7 SPHInX runs" in caplog.text and wall_time in caplog.text
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# @File    : test_sphinx_io.py
+# @Time    : 5/12/2021 9:40 AM
+# @Author  : Zavier Cai
+# @Email   : caizefeng18@gmail.com
+import os
+
+import numpy as np
+
+from spinforce.SphinxIO import SphinxIO
+
+INPUT = """format paw;
+include <parameters.sx>;
+structure { include "structure.sx"; }
+pawPot {
+    species { potential = "/data//PAW_PBE/Fe/POTCAR"; // doubled slash in a path
+    }
+}
+initialGuess {
+    waves { lcao {} }
+    rho { atomicOrbitals; atomicSpin { file="spin-initial.sx";} } // { unbalanced in a comment
+}
+/* maxSteps = 7; */
+main {
+    scfDiag {
+        // maxSteps = 3;
+        dEnergy = 1e-6;
+        maxSteps = 80;
+        label = "";
+    }
+}
+"""
+
+STRUCTURE = """cell = [[5.35, 0, 0], [0, 5.35, 0], [0, 0, 5.35]];
+species {
+  element="Fe";  // iron
+  atom {coords = [ 0 , 0 , 0 ] ; relative; label = "A"; }
+//  atom {coords = [ 0.25 , 0.25 , 0.25 ] ; relative; }
+  atom {coords = [ 0.5 , 0.5 , 0.5 ] ; relative; label = "B//C"; }
+}
+species {
+  element="Co";
+  atom {coords = [ 1.0 , 2.0 , 3.0 ] ; }
+}
+"""
+
+
+def write(tmp_path, name, content):
+    path = os.path.join(str(tmp_path), name)
+    with open(path, "w") as f:
+        f.write(content)
+    return path
+
+
+def test_scf_parameters_skip_comments(tmp_path):
+    path = write(tmp_path, "input.sx", INPUT)
+    assert SphinxIO.read_scf_parameters(path) == (80, 1e-6)
+    assert SphinxIO.read_scf_parameter("label", path) == '""'
+    assert SphinxIO.read_scf_parameter("rhoMixing", path) is None
+
+
+def test_warm_start_input_keeps_quoted_paths(tmp_path):
+    template_path = write(tmp_path, "input.sx", INPUT)
+    output_path = os.path.join(str(tmp_path), "warm.sx")
+    SphinxIO.write_warm_start_input(template_path, output_path, scf_parameters={"maxSteps": 20, "rhoMixing": 0.5})
+    with open(output_path, "r") as f:
+        content = f.read()
+    assert '"/data//PAW_PBE/Fe/POTCAR"' in content
+    assert 'rho { file = "rho.sxb"; }' in content and "atomicOrbitals" not in content
+    assert SphinxIO.read_scf_parameters(output_path) == (20, 1e-6)
+    assert SphinxIO.read_scf_parameter("rhoMixing", output_path) == "0.5"
+
+
+def test_read_structure(tmp_path):
+    cell, structure_dict, structure_array = SphinxIO.read_structure(write(tmp_path, "structure.sx", STRUCTURE))
+    assert np.allclose(cell, 5.35 * np.eye(3))
+    assert np.allclose(structure_dict["0"], [[0, 0, 0], [2.675, 2.675, 2.675]])
+    assert np.allclose(structure_dict["1"], [[1, 2, 3]])
+    assert structure_array.shape == (9,)
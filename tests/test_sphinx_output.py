@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# @File    : test_sphinx_output.py
+# @Time    : 5/12/2021 10:30 AM
+# @Author  : Zavier Cai
+# @Email   : caizefeng18@gmail.com
+import numpy as np
+import pytest
+
+from spinforce.SphinxOutput import SphinxOutputParser, parse_output, read_last_line
+
+
+def synthetic_output(num_steps, ending="Convergence reached.\n", spins=(2.0, -1.5)):
+    lines = ["+" + "-" * 40, "| S/PHI/nX (test)"]
+    for step in range(1, num_steps + 1):
+        for i, spin in enumerate(spins):
+            lines.append("nu({0}) = {1:.6f}".format(i, 0.01 * step * (i + 1)))
+            lines.append("Spin of atom {0} = {1:.6f}".format(i, spin))
+        lines.append("| eig = -0.3 Ha   Convergence of the CCG")  # not a convergence marker
+        lines.append("F({})=-247.{:06d}, eBand=-82.4".format(step, step))
+    return ("\n".join(lines) + "\n" + ending).encode()
+
+
+def parse_in_chunks(data, chunk_size):
+    parser = SphinxOutputParser()
+    for start in range(0, len(data), chunk_size):
+        parser.feed(data[start:start + chunk_size])
+    return parser.close()
+
+
+def assert_same(result, expected):
+    assert (result.convergence_reached, result.steps_over, result.num_step) == \
+           (expected.convergence_reached, expected.steps_over, expected.num_step)
+    assert np.array_equal(result.final_spin, expected.final_spin) and np.array_equal(result.nu, expected.nu)
+
+
+@pytest.mark.parametrize("ending, reached, over, num_step", [
+    ("Convergence reached.\n", True, False, 25),
+    ("WARNING: maximum number of steps (25) exceeded\nConvergence not yet reached.\n", False, True, 25),
+    ("SxSymMatrix: matrix not positive definite\n", False, False, 25),  # terminated otherwise
+])
+def test_parse_output(tmp_path, ending, reached, over, num_step):
+    output_path = str(tmp_path / "output.sx")
+    with open(output_path, "wb") as f:
+        f.write(synthetic_output(25, ending))
+    with open(str(tmp_path / "energy.dat"), "w") as f:
+        f.write("1 0.1 -247.1 -247.0 -247.05\n25 2.5 -247.5 -247.4 -247.45\n\n")
+    result = parse_output(output_path, str(tmp_path / "energy.dat"))
+    assert (result.convergence_reached, result.steps_over, result.num_step) == (reached, over, num_step)
+    assert np.allclose(result.final_spin, [2.0, -1.5]) and np.allclose(result.nu, [0.25, 0.5])
+    assert result.total_energy == -247.45
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 64, 1000, 10 ** 6])
+def test_chunks_parse_like_whole_file(tmp_path, chunk_size):
+    data = synthetic_output(40)
+    output_path = str(tmp_path / "output.sx")
+    with open(output_path, "wb") as f:
+        f.write(data)
+    assert_same(parse_in_chunks(data, chunk_size), parse_output(output_path, str(tmp_path / "missing.dat")))
+
+
+def test_running_then_finished():
+    data = synthetic_output(10)
+    parser = SphinxOutputParser()
+    parser.feed(data[:data.index(b"F(6)")])
+    assert not parser.finished and parser.result.num_step is None
+    parser.feed(data[data.index(b"F(6)"):])
+    assert parser.finished and parser.close().num_step == 10
+
+
+def test_no_scf_step(tmp_path):
+    output_path = str(tmp_path / "output.sx")
+    with open(output_path, "wb") as f:
+        f.write(b"ERROR: cannot open spin-constraint.sx\n")
+    result = parse_output(output_path, str(tmp_path / "energy.dat"))
+    assert result.num_step is None and result.total_energy is None and not len(result.nu)
+
+
+def test_read_last_line(tmp_path):
+    path = str(tmp_path / "energy.dat")
+    with open(path, "w") as f:
+        f.write("".join("{} {}\n".format(i, "x" * 50) for i in range(1000)) + "\n\n")
+    assert read_last_line(path, block_size=16) == "999 " + "x" * 50
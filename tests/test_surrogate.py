@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# @File    : test_surrogate.py
+# @Time    : 5/11/2021 2:10 PM
+# @Author  : Zavier Cai
+# @Email   : caizefeng18@gmail.com
+import logging
+import time
+
+import numpy as np
+
+from spinforce.SfSurrogate import SfActiveLearner, SfGradientGP
+from spinforce.SfVariantSpace import SfGridSpace
+
+
+def energy_and_gradient(x):
+    return np.sin(3 * x[:, 0]) + x[:, 1] ** 2, np.stack((3 * np.cos(3 * x[:, 0]), 2 * x[:, 1]), axis=1)
+
+
+def new_learner(variants, **active_dict):
+    learner = SfActiveLearner(active_dict, variants, num_atoms=2)
+    learner._logger = logging.getLogger("test")
+    return learner
+
+
+def test_gp_interpolates_energies_and_gradients():
+    x = np.random.RandomState(0).uniform(size=(12, 2))
+    energies, gradients = energy_and_gradient(x)
+    gp = SfGradientGP()
+    gp.fit(x, energies, gradients)
+
+    mean, mean_gradients, variances = gp.predict(x)
+    # the nugget makes it a (very slightly) smoothing fit
+    assert np.allclose(mean, energies, atol=2e-3)
+    assert np.allclose(mean_gradients, gradients, atol=2e-2)
+    assert np.all(variances < 1e-3 * gp.variance)
+
+    x_new = np.random.RandomState(1).uniform(size=(20, 2))
+    mean, mean_gradients, _ = gp.predict(x_new)
+    assert np.max(np.abs(mean - energy_and_gradient(x_new)[0])) < 0.05
+    assert gp.predict(np.array([[3., 3.]]))[2][0] > 0.5 * gp.variance  # far away, back to the prior
+
+
+def test_learner_bounds_without_listing_variants():
+    # 10 ** 12 variants, scaling must come from the samples and not from a pass over the grid
+    variants = SfGridSpace([np.linspace(-2., 2., 10)] * 12)
+    start = time.perf_counter()
+    learner = SfActiveLearner({}, variants, num_atoms=12)
+    assert time.perf_counter() - start < 1.
+    assert np.allclose(learner.unit(variants.bounds.T), [[0.] * 12, [1.] * 12])
+
+
+def test_learner_batches_are_distinct_and_stop_at_budget():
+    variants = SfGridSpace([np.linspace(-1., 1., 9), np.linspace(-1., 1., 9)])
+    learner = new_learner(variants, initial=4, batch=4, budget=12, target_energy_error=0.)
+    tried = []
+    batch = learner.next_batch()
+    while batch:
+        assert len(set(batch)) == len(batch) and not set(batch) & set(tried)
+        tried += batch
+        energies, gradients = energy_and_gradient(variants.take(np.array(batch)))
+        for variant, energy, gradient in zip(batch, energies, gradients):
+            learner.observe(variant, energy, gradient)
+        assert not learner.converged()
+        batch = learner.next_batch()
+    assert len(tried) == 12
+
+
+def test_learner_converges_on_smooth_energy():
+    variants = SfGridSpace([np.linspace(-1., 1., 21), np.linspace(-1., 1., 21)])
+    learner = new_learner(variants, initial=6, batch=6, budget=200, target_energy_error=1e-3)
+    converged = False
+    for _ in range(30):
+        batch = learner.next_batch()
+        if not batch:
+            break
+        energies, gradients = energy_and_gradient(variants.take(np.array(batch)))
+        for variant, energy, gradient in zip(batch, energies, gradients):
+            learner.observe(variant, energy, gradient)
+        if learner.converged():
+            converged = True
+            break
+    assert converged and learner.num_tried < len(variants)
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# @File    : test_symmetry.py
+# @Time    : 5/12/2021 2:20 PM
+# @Author  : Zavier Cai
+# @Email   : caizefeng18@gmail.com
+import numpy as np
+
+from spinforce.SfStructure import SfStructure
+from spinforce.SfSymmetry import SfSymmetry, SfSymmetryOperation, find_operations
+from spinforce.SfVariantSpace import SfGridSpace
+
+A = 6.8  # Bohr
+
+
+def fcc_structure():
+    # conventional fcc cell, its space group permutes the 4 atoms in every possible way
+    frac = np.array([[0, 0, 0], [0.5, 0.5, 0], [0.5, 0, 0.5], [0, 0.5, 0.5]])
+    return SfStructure(A * np.eye(3), frac * A, np.zeros(4, dtype=int), ["Fe"])
+
+
+def new_symmetry(samples, spins=(0., 0., 0., 0.), varied=(0, 1, 2, 3), time_reversal=False):
+    structure = fcc_structure()
+    variants = SfGridSpace([samples] * len(varied))
+    return SfSymmetry(structure, np.array(spins), list(varied), variants, time_reversal=time_reversal), variants
+
+
+def test_find_operations():
+    structure = fcc_structure()
+    operations = find_operations(structure.cell, structure.coord_array, np.zeros(4, dtype=int))
+    assert np.array_equal(operations[0].permutation, np.arange(4))
+    assert np.allclose(operations[0].rotation, np.eye(3))
+    assert len(operations) == 24  # unique by permutation: all of S4
+    for op in operations:
+        assert np.allclose(op.rotation @ op.rotation.T, np.eye(3))
+        moved = structure.coord_array @ op.rotation.T + op.translation
+        frac = (moved - structure.coord_array[op.permutation]) / A
+        assert np.allclose(frac, np.round(frac))
+
+
+def test_colors_restrict_operations():
+    structure = fcc_structure()
+    operations = find_operations(structure.cell, structure.coord_array, np.array([0, 1, 1, 1]))
+    assert len(operations) == 6 and all(op.permutation[0] == 0 for op in operations)
+
+
+def test_orbits_partition_the_grid():
+    samples = np.array([-2., 0., 2.])
+    symmetry, variants = new_symmetry(samples)
+    assert symmetry.count_orbits(chunk_size=10) == 15  # multisets of 4 out of 3 samples
+    covered = []
+    for index in range(len(variants)):
+        if not symmetry.is_representative(index):
+            continue
+        covered.append(index)
+        spins = variants[index]
+        for image, op in symmetry.images(index):
+            covered.append(image)
+            image_spins = np.empty(4)
+            image_spins[op.permutation] = spins
+            assert np.array_equal(variants[image], image_spins)
+    assert sorted(covered) == list(range(len(variants)))
+
+
+def test_fixed_spins_break_symmetry():
+    symmetry, _ = new_symmetry(np.array([-1., 1.]), spins=(0., 0., 0., 3.), varied=(0, 1, 2))
+    assert symmetry.num_operations == 6
+    assert symmetry.count_orbits() == 4
+
+
+def test_time_reversal():
+    symmetry, variants = new_symmetry(np.array([-2., 0., 2.]), time_reversal=True)
+    assert symmetry.time_reversal and symmetry.num_operations == 48
+    assert symmetry.count_orbits() == 9
+    for image, op in symmetry.images(0):  # all spins down
+        assert not op.time_reversal or np.array_equal(variants[image], [2.] * 4)
+    # not closed under flipping: no time reversal
+    symmetry, _ = new_symmetry(np.array([0., 1., 2.]), time_reversal=True)
+    assert not symmetry.time_reversal and symmetry.num_operations == 24
+
+
+def test_transform():
+    rotation = np.array([[0., -1., 0.], [1., 0., 0.], [0., 0., 1.]])
+    op = SfSymmetryOperation(rotation, np.zeros(3), np.array([1, 0]), time_reversal=True)
+    forces = np.array([1., 0., 0., 0., 2., 0.])
+    nu = np.array([0., 0., 0.5, 0., 0., -0.5])
+    image_forces, image_nu = SfSymmetry.transform(op, forces, nu)
+    assert np.allclose(image_forces, [-2., 0., 0., 0., 1., 0.])
+    assert np.allclose(image_nu, [0., 0., 0.5, 0., 0., -0.5])
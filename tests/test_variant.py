@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# @File    : test_variant.py
+# @Time    : 5/12/2021 7:05 PM
+# @Author  : Zavier Cai
+# @Email   : caizefeng18@gmail.com
+import os
+import shutil
+import sys
+
+import pytest
+
+import spinforce.SfVariant as SfVariant
+from spinforce.SfVariant import SfVariantJob, SfVariantResult, run_variant
+from spinforce.SphinxIO import SphinxIO
+
+PACKAGE_DIR = os.path.join(os.path.dirname(__file__), os.pardir, "spinforce")
+FAKE_SPHINX = [sys.executable, os.path.abspath(os.path.join(PACKAGE_DIR, "scripts", "fake_sphinx.py"))]
+CONTINUATION = {"max_retries": 2, "step_factor": 2.0, "spin_moment_factor": 0.1}
+
+
+@pytest.fixture
+def variant_dir(tmp_path):
+    for name in ("input.sx", "structure.sx", "spin-constraint.sx"):
+        shutil.copy(os.path.join(PACKAGE_DIR, "templates", name), str(tmp_path))
+    return str(tmp_path)
+
+
+@pytest.mark.parametrize("fail, status", [("steps", SfVariantResult.STEPS_OVER),
+                                          ("constraint", SfVariantResult.CONSTRAINT_FAILED)])
+def test_continuations_rewrite_and_restore_input(variant_dir, monkeypatch, fail, status):
+    inputs = []
+
+    def launch_sphinx(job):
+        with open(os.path.join(job.work_dir, "input.sx"), "r") as f:
+            inputs.append(f.read())
+        return launch(job)
+
+    launch = SfVariant.launch_sphinx
+    monkeypatch.setattr(SfVariant, "launch_sphinx", launch_sphinx)
+    monkeypatch.setenv("FAKE_SPHINX_FAIL", fail)
+    with open(os.path.join(variant_dir, "input.sx"), "r") as f:
+        original = f.read()
+
+    job = SfVariantJob(1, 0, variant_dir, FAKE_SPHINX)
+    job.continuation = CONTINUATION
+    result = run_variant(job)
+
+    assert result.status == status and result.retries == 2
+    assert len(inputs) == 3 and inputs[0] == original
+    for retry, content in enumerate(inputs[1:], 1):
+        input_path = os.path.join(variant_dir, "retry.sx")
+        with open(input_path, "w") as f:
+            f.write(content)
+        assert SphinxIO.read_scf_parameters(input_path)[0] == 500 * 2 ** retry
+        spin_moment = float(SphinxIO.read_scf_parameter("dSpinMoment", input_path))
+        assert spin_moment == pytest.approx(1e-8 * 0.1 ** retry if fail == "constraint" else 1e-8)
+        assert 'rho { file = "rho.sxb"; }' in content and 'waves { file = "waves.sxb"; }' in content
+    if fail == "steps":
+        assert result.attempt_steps == [500, 1000, 2000]
+
+    with open(os.path.join(variant_dir, "input.sx"), "r") as f:
+        assert f.read() == original
+    assert not os.path.exists(os.path.join(variant_dir, "input.first.sx"))
+
+
+def test_no_continuation_without_policy(variant_dir, monkeypatch):
+    monkeypatch.setenv("FAKE_SPHINX_FAIL", "steps")
+    result = run_variant(SfVariantJob(1, 0, variant_dir, FAKE_SPHINX))
+    assert result.status == SfVariantResult.STEPS_OVER and result.retries == 0
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+# @File    : test_variant_space.py
+# @Time    : 5/12/2021 11:50 AM
+# @Author  : Zavier Cai
+# @Email   : caizefeng18@gmail.com
+import numpy as np
+import pytest
+
+from spinforce.SfVariantSpace import SfDesignSpace, SfGridSpace
+from spinforce.helper.ndarray_helper import cartesian_product
+
+SAMPLES = [np.array([-3., 0., 3.]), np.array([1., 2.]), np.array([-1., -0.5, 0., 0.5])]
+
+
+def test_grid_matches_cartesian_product():
+    space = SfGridSpace(SAMPLES)
+    assert len(space) == 24 and space.num_atoms == 3
+    assert np.array_equal(np.array(list(space)), cartesian_product(SAMPLES))
+    assert np.array_equal(space[-1], [3., 2., 0.5])
+    assert np.array_equal(space.bounds, [[-3., 3.], [1., 2.], [-1., 0.5]])
+    with pytest.raises(IndexError):
+        space[24]
+
+
+def test_grid_chunks_cover_all_variants():
+    space = SfGridSpace(SAMPLES)
+    indices, spins = zip(*space.chunks(chunk_size=5))
+    assert np.array_equal(np.concatenate(indices), np.arange(24))
+    assert np.array_equal(np.concatenate(spins), cartesian_product(SAMPLES))
+
+
+def test_grid_is_not_listed():
+    space = SfGridSpace([np.linspace(-2., 2., 10)] * 15)  # 10 ** 15 variants
+    assert np.array_equal(space[10 ** 15 - 1], [2.] * 15)
+
+
+@pytest.mark.parametrize("method", ["sobol", "halton", "lhs"])
+def test_design_within_bounds_and_by_index(method):
+    bounds = np.array([[-3., 3.], [0., 1.], [2., 2.5]])
+    space = SfDesignSpace(method, 32, 5, bounds)
+    spins = np.array(list(space))
+    assert spins.shape == (32, 3)
+    assert np.all((spins >= bounds[:, 0]) & (spins <= bounds[:, 1]))
+    indices = np.array([30, 3, 17])
+    assert np.allclose(space.take(indices), spins[indices])
+    assert np.allclose(space[9], spins[9])